@@ -0,0 +1,182 @@
+""" Benchmarks of the song transformation pipeline, stage by stage.
+
+Times, on synthetic inputs (see benchmarks.synthetic) of several sizes:
+    read_xmk                       - parsing xmk files of varying length, meter and note density
+    tokenize_xmk                   - the same, into columns
+    get_onset_pattern              - converting every measure of a parsed song to its pattern
+    song_onset_patterns            - the same, for the whole song at once
+    format_dataset_patterns        - the counting part of rag_dataset_pattern_extractor(), on
+                                     synthetic corpora of varying size
+    rag_dataset_pattern_extractor  - the whole extraction from the PK dataset, without the cache
+                                     (only if the dataset is there)
+    generate_rules                 - the rule generation of algorithm_1 (with a fresh RuleSampler)
+    generate_melody_measure        - building the music21 measures of a song (needs music21)
+
+Every result has the benchmark name, its parameters and the best and median
+time per call over `repeat` runs. Save them with --json and compare two runs
+with --compare:
+
+Run from src/:
+    python -m benchmarks.pipeline --json before.json
+    python -m benchmarks.pipeline --json after.json --compare before.json
+"""
+from typing import Callable, Dict, List
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import synthetic_corpus, write_synthetic_xmk
+from song_transformations.algorithm_1 import generate_melody_measure, generate_rules
+from song_transformations.pattern_extractors import (XmkSong, format_dataset_patterns, get_onset_pattern,
+                                                     rag_dataset_pattern_extractor, read_xmk, song_onset_patterns,
+                                                     tokenize_xmk)
+
+# (measures, beats_per_measure, beat_unit, density) of the synthetic songs.
+SONGS = [(16, 4, 4, 0.3), (64, 4, 4, 0.3), (256, 4, 4, 0.3),
+         (64, 4, 4, 0.8), (64, 3, 4, 0.5), (64, 6, 8, 0.5), (64, 2, 4, 0.5)]
+# (num_songs, measures_per_song) of the synthetic corpora.
+CORPORA = [(100, 40), (500, 40), (2000, 40)]
+PATTERN_LENGTHS = [8, 16]
+QUICK_SONGS = SONGS[:2]
+QUICK_CORPORA = CORPORA[:1]
+
+
+def time_call(func: Callable, repeat=5, number=1) -> Dict:
+    """ Time `func()` `number` times in a row, `repeat` times, after one
+    untimed call (so lazy imports and first-use caches aren't measured).
+
+    :return: the best and median time per call, in seconds.
+    """
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return {"best": min(timings), "median": statistics.median(timings), "repeat": repeat, "number": number}
+
+
+def _result(benchmark, params, func, repeat, number=1) -> Dict:
+    try:
+        timing = time_call(func, repeat, number)
+        error = None
+    except Exception as e:
+        timing = {"best": None, "median": None, "repeat": repeat, "number": number}
+        error = type(e).__name__ + ": " + str(e)
+    return {"benchmark": benchmark, "params": params, **timing, "error": error}
+
+
+def _quiet(func):
+    """ Run func with its (per rule) prints silenced. """
+    def quiet():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+    return quiet
+
+
+def run(quick=False, repeat=5) -> List[Dict]:
+    songs = QUICK_SONGS if quick else SONGS
+    corpora = QUICK_CORPORA if quick else CORPORA
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        song_files = {}
+        for measures, beats_per_measure, beat_unit, density in songs:
+            params = {"measures": measures, "time_signature": f"{beats_per_measure}/{beat_unit}", "density": density}
+            filename = Path(tmp) / f"song_{measures}_{beats_per_measure}_{beat_unit}_{density}.xmk"
+            write_synthetic_xmk(filename, measures=measures, beats_per_measure=beats_per_measure,
+                                beat_unit=beat_unit, density=density)
+            song_files[filename] = params
+            results.append(_result("read_xmk", params, lambda: read_xmk(filename), repeat, number=10))
+            results.append(_result("tokenize_xmk", params, lambda: tokenize_xmk(filename), repeat, number=10))
+
+        for filename, params in song_files.items():
+            song = XmkSong(filename)
+            measures = [[line[0] if line[1] != -1 else (-line[0][0], -line[0][1]) for line in measure]
+                        for measure in song.song.values()]
+            for pattern_length in PATTERN_LENGTHS:
+                results.append(_result("get_onset_pattern", {**params, "pattern_length": pattern_length},
+                                       lambda: [get_onset_pattern(m, pattern_length) for m in measures],
+                                       repeat, number=10))
+                results.append(_result("song_onset_patterns", {**params, "pattern_length": pattern_length},
+                                       lambda: song_onset_patterns(song.columns, pattern_length),
+                                       repeat, number=10))
+
+        for num_songs, measures_per_song in corpora:
+            for pattern_length in PATTERN_LENGTHS:
+                corpus = synthetic_corpus(num_songs, measures_per_song, pattern_length)
+                params = {"songs": num_songs, "measures_per_song": measures_per_song, "pattern_length": pattern_length}
+                results.append(_result("format_dataset_patterns", params,
+                                       lambda: format_dataset_patterns(corpus), repeat))
+
+                dataset_patterns = format_dataset_patterns(corpus)
+                for filename, song_params in list(song_files.items())[:2]:
+                    song_patterns = XmkSong(filename).patterns(pattern_length)
+                    results.append(_result("generate_rules", {**params, **song_params},
+                                           _quiet(lambda: generate_rules(song_patterns, dataset_patterns,
+                                                                         pattern_length)),
+                                           repeat))
+
+        for filename, params in list(song_files.items())[:2]:
+            song = XmkSong(filename)
+            for pattern_length in PATTERN_LENGTHS:
+                pairs = list(zip(song.notes.values(), song.patterns(pattern_length)))
+                results.append(_result("generate_melody_measure", {**params, "pattern_length": pattern_length},
+                                       lambda: [generate_melody_measure(notes, pattern) for notes, pattern in pairs],
+                                       repeat))
+
+    if not quick:
+        for pattern_length in PATTERN_LENGTHS:
+            results.append(_result("rag_dataset_pattern_extractor", {"pattern_length": pattern_length},
+                                   lambda: rag_dataset_pattern_extractor(pattern_length, use_cache=False),
+                                   repeat=1))
+    return results
+
+
+def _key(result) -> str:
+    return result["benchmark"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results, baseline) -> List[str]:
+    """ One line per benchmark found in both runs, with the median time ratio (< 1 is faster). """
+    previous = {_key(r): r for r in baseline}
+    lines = []
+    for r in results:
+        old = previous.get(_key(r))
+        if old is None or not old["median"] or not r["median"]:
+            continue
+        lines.append(f"{_key(r):100} {old['median'] * 1e3:10.3f}ms -> {r['median'] * 1e3:10.3f}ms  "
+                     f"x{r['median'] / old['median']:.2f}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="only the smallest inputs, no PK dataset")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run(args.quick, args.repeat)
+    for r in results:
+        if r["error"]:
+            print(f"{_key(r):100} ERROR {r['error']}")
+        else:
+            print(f"{_key(r):100} best {r['best'] * 1e3:10.3f}ms  median {r['median'] * 1e3:10.3f}ms")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        print()
+        print("\n".join(compare(results, baseline)))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"python": sys.version.split()[0], "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, file, indent=2)
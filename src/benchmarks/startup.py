@@ -0,0 +1,88 @@
+""" Startup-time benchmark.
+
+Imports each module in a fresh interpreter (so nothing is cached by an
+earlier import) and reports how long the import took and which of the heavy
+libraries (music21, pandas, scipy, plotting) it pulled in. Short-lived CLI
+and worker processes pay this on every run.
+
+Run from src/:
+    python -m benchmarks.startup [--repeat 5] [--json startup.json]
+"""
+from typing import Dict, List
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ["song_transformations.pattern_extractors",
+           "song_transformations.alias_sampler",
+           "song_transformations.algorithm_1",
+           "song_transformations.midi_writer",
+           "song_transformations.song_transformer",
+           "data.BipStore",
+           "data.PKDataset"]
+
+# Reference points: what importing each heavy library costs on its own.
+HEAVY_MODULES = ["music21", "pandas", "scipy", "matplotlib", "seaborn"]
+
+_SNIPPET = """
+import importlib, json, sys, time
+start = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+    error = None
+except Exception as e:
+    error = type(e).__name__ + ": " + str(e)
+seconds = time.perf_counter() - start
+heavy = [name for name in sys.argv[2:] if name in sys.modules]
+print(json.dumps({"seconds": seconds, "heavy": heavy, "error": error}))
+"""
+
+
+def time_import(module, repeat=5) -> Dict:
+    """ Time `import module` in `repeat` fresh interpreters.
+
+    :param str module: dotted module name.
+    :param int repeat:
+    :return: the median import time, the median time of the whole process,
+             the heavy libraries loaded and the import error, if any.
+    """
+    import_times = []
+    process_times = []
+    result = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", _SNIPPET, module] + HEAVY_MODULES,
+                                   capture_output=True, text=True)
+        process_times.append(time.perf_counter() - start)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_times.append(result["seconds"])
+    return {"module": module,
+            "import_seconds": statistics.median(import_times),
+            "process_seconds": statistics.median(process_times),
+            "heavy_loaded": result["heavy"],
+            "error": result["error"]}
+
+
+def run(modules=None, repeat=5) -> List[Dict]:
+    return [time_import(module, repeat) for module in (modules or MODULES + HEAVY_MODULES)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", help="modules to time (default: the project's and the heavy ones)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.modules, args.repeat)
+    for r in results:
+        loaded = ", ".join(r["heavy_loaded"]) or "-"
+        status = f"  ERROR {r['error']}" if r["error"] else ""
+        print(f"{r['module']:42} {r['import_seconds']:8.3f}s  (process {r['process_seconds']:.3f}s)  "
+              f"heavy: {loaded}{status}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
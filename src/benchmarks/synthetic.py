@@ -0,0 +1,93 @@
+""" Synthetic inputs for the benchmarks.
+
+Songs are generated as xmk text (same format as the files read by
+read_xmk()) and corpora as {song ID: [onset patterns]}, the input of
+format_dataset_patterns(). Everything is drawn from a seeded generator, so
+the same arguments always give the same input and timings of different runs
+are comparable.
+"""
+from math import gcd
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+# Chord tokens as they appear in the third column of xmk files.
+CHORD_TOKENS = ["48", "53", "55", "53[m", "55[7", "57[m7", "50[d", "52[a", "48[6", "55[4", "50[2"]
+REST_PROBABILITY = 0.1
+
+
+def synthetic_measure(rng, beats_per_measure=4, beat_unit=4, density=0.5, resolution=8) -> List[tuple]:
+    """ One measure as (duration numerator, duration denominator, MIDI note, chord token) lines.
+
+    The measure is laid out on a grid of `resolution` slots per whole note:
+    the first slot always starts a note (or rest), every other slot does with
+    probability `density`, so the note values stay readable by
+    get_onset_pattern() for any pattern_length that is a multiple of
+    `resolution`.
+    """
+    slots = resolution * beats_per_measure // beat_unit
+    starts = np.flatnonzero(np.concatenate([[True], rng.random(slots - 1) < density]))
+    lengths = np.diff(np.append(starts, slots))
+    chord = CHORD_TOKENS[rng.integers(len(CHORD_TOKENS))]
+    lines = []
+    for length in lengths:
+        divisor = gcd(int(length), resolution)
+        note = -1 if rng.random() < REST_PROBABILITY else int(rng.integers(55, 80))
+        if rng.random() < 0.25:
+            chord = CHORD_TOKENS[rng.integers(len(CHORD_TOKENS))]
+        lines.append((int(length) // divisor, resolution // divisor, note, chord))
+    return lines
+
+
+def synthetic_xmk(measures=32, beats_per_measure=4, beat_unit=4, density=0.5, resolution=8, seed=0,
+                  beats_per_minute=120) -> str:
+    """ The text of a synthetic xmk song.
+
+    :param int measures: number of measures.
+    :param int beats_per_measure: top number of the time signature.
+    :param int beat_unit: bottom number of the time signature.
+    :param float density: probability of an onset on each grid slot after the first.
+    :param int resolution: grid slots per whole note (8 = eighth notes).
+    :param int seed:
+    :param int beats_per_minute:
+    :return: the xmk file contents.
+    """
+    rng = np.random.default_rng(seed)
+    lines = [f"[{beats_per_measure}][{beat_unit}][{beats_per_minute}]"]
+    for measure in range(1, measures + 1):
+        lines.append(f"={measure}")
+        for numerator, denominator, note, chord in synthetic_measure(rng, beats_per_measure, beat_unit,
+                                                                     density, resolution):
+            lines.append(f"{numerator}/{denominator}\t{note}\t{chord}")
+    lines.append("=end")
+    return "\n".join(lines) + "\n"
+
+
+def write_synthetic_xmk(path, **kwargs) -> Path:
+    """ Write synthetic_xmk(**kwargs) to `path`. """
+    path = Path(path)
+    path.write_text(synthetic_xmk(**kwargs))
+    return path
+
+
+def synthetic_corpus(num_songs=500, measures_per_song=40, pattern_length=16, vocabulary=2000, density=0.3,
+                     seed=0) -> Dict[str, List[str]]:
+    """ A synthetic pattern corpus, shaped like the output of PKDataset.get_melody_bips() per song.
+
+    Patterns are drawn from a fixed vocabulary with Zipf-like frequencies, as
+    in real music a few rhythms make up most measures.
+
+    :param int num_songs:
+    :param int measures_per_song:
+    :param int pattern_length:
+    :param int vocabulary: number of distinct patterns to draw from.
+    :param float density: probability of an onset in each position of a pattern.
+    :param int seed:
+    :return: a mapping of song ID to its patterns.
+    """
+    rng = np.random.default_rng(seed)
+    bits = rng.random((vocabulary, pattern_length)) < density
+    patterns = np.unique(np.where(bits, '1', '0').view(f'<U{pattern_length}').ravel())
+    weights = 1 / np.arange(1, len(patterns) + 1)
+    choices = rng.choice(len(patterns), size=(num_songs, measures_per_song), p=weights / weights.sum())
+    return {f"synthetic{i}": [str(patterns[j]) for j in row] for i, row in enumerate(choices)}
@@ -0,0 +1,397 @@
+import json
+import os
+import re
+import struct
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# matches each pattern inside the stringified python lists of the bit pattern CSVs
+_BIP_RE = re.compile(r"'([01]*)'")
+
+# Binary corpus format (.bips), all little-endian:
+#   header      magic 'BIPS', format version, bits per pattern, number of fileids, number of patterns
+#               of part0 and part1, and the byte position (and size) of every section below
+#   fileids     utf-8, one per line
+#   offsets0    int64[number of fileids + 1], where each fileid's part0 patterns start
+#   offsets1    int64[number of fileids + 1], same for part1
+#   part0       packed part0 patterns (uint8 up to 8 bits, uint16 up to 16, ...)
+#   part1       packed part1 patterns
+#   irregular   utf-8 json, the verbatim patterns that were not `width` long, per part
+# Sections start at multiples of 8 bytes so they can be mapped as arrays in place.
+_MAGIC = b'BIPS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIII' + 'Q' * 10)
+
+
+def _align(position, alignment=8):
+    return (position + alignment - 1) // alignment * alignment
+
+
+def parse_bip_list(cell) -> List[str]:
+    """
+    Parse a cell of the bit pattern CSVs (a stringified python list of patterns) without eval().
+    """
+    return _BIP_RE.findall(cell)
+
+
+def pack_bips(patterns, width) -> np.ndarray:
+    """
+    Pack a list of binary onset pattern strings into integers, first character in the
+    most significant bit.  8-bit patterns are stored as uint8, 16-bit patterns as uint16.
+    :param patterns: list of strings such as '10100010'.
+    :param width: number of bits per pattern.
+    :return:
+    """
+    return np.array([int(p, 2) if p else 0 for p in patterns], dtype=bip_dtype(width))
+
+
+def unpack_bips(packed, width) -> List[str]:
+    """
+    Inverse of pack_bips(): turn packed patterns back into strings of '0's and '1's.
+    """
+    fmt = '0' + str(width) + 'b'
+    return [format(int(p), fmt) for p in packed]
+
+
+def bips_to_matrix(patterns, width) -> np.ndarray:
+    """
+    Turn patterns into a (number of patterns, width) uint8 bit matrix.  Accepts a list of pattern
+    strings, an array of packed patterns (see pack_bips()) or a bit matrix, which is returned as is.
+    :param patterns:
+    :param width: number of bits per pattern.
+    :return:
+    """
+    if isinstance(patterns, np.ndarray):
+        if patterns.ndim == 2:
+            return patterns.astype(np.uint8, copy=False)
+        shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+        return ((patterns.astype(np.uint64)[:, None] >> shifts) & 1).astype(np.uint8)
+    if any(len(p) != width for p in patterns):
+        raise ValueError("All patterns must be " + str(width) + " characters long.")
+    chars = np.frombuffer(''.join(patterns).encode('ascii'), dtype=np.uint8)
+    return (chars - ord('0')).reshape(len(patterns), width)
+
+
+def matrix_to_bips(matrix) -> np.ndarray:
+    """
+    Inverse of bips_to_matrix() for a bit matrix: pack each row, first column in the most
+    significant bit (at most 64 columns).
+    """
+    width = matrix.shape[1]
+    if width > 64:
+        raise ValueError("Patterns of more than 64 bits cannot be packed.")
+    weights = np.left_shift(np.uint64(1), np.arange(width - 1, -1, -1, dtype=np.uint64))
+    return (matrix.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64).astype(bip_dtype(width))
+
+
+def matrix_to_strings(matrix) -> List[str]:
+    """
+    Turn a bit matrix back into pattern strings of '0's and '1's.
+    """
+    width = matrix.shape[1]
+    chars = np.ascontiguousarray(matrix, dtype=np.uint8) + np.uint8(ord('0'))
+    return chars.view('S' + str(width)).ravel().astype(str).tolist()
+
+
+def _spread_table(factor) -> Tuple[np.ndarray, int]:
+    """
+    Lookup table spreading the bits of a chunk of patterns `factor` bits apart (bit b goes to bit b * factor).
+    Chunks are a byte, or fewer bits when a byte would spread past 64 bits, so the table is complete and
+    increasing (which downsampling relies on).
+    :return: the table and the number of bits per chunk.
+    """
+    bits = min(8, 64 // factor)
+    chunk = np.arange(1 << bits, dtype=np.uint64)
+    table = np.zeros(1 << bits, dtype=np.uint64)
+    for b in range(bits):
+        table |= ((chunk >> np.uint64(b)) & np.uint64(1)) << np.uint64(b * factor)
+    return table, bits
+
+
+def _check_resolutions(width, new_width):
+    if max(width, new_width) > 64:
+        raise ValueError("Patterns of more than 64 bits cannot be packed.")
+    factor = max(width, new_width) // min(width, new_width)
+    if factor * min(width, new_width) != max(width, new_width):
+        raise ValueError("One resolution must be a multiple of the other: " + str(width) + ", " + str(new_width))
+    return factor
+
+
+def is_representable(packed, width, new_width) -> np.ndarray:
+    """
+    Return a boolean array saying which packed patterns can be converted to `new_width` bits without
+    losing onsets (always True when upsampling; when downsampling, True if every onset falls on the
+    coarser grid, e.g. a 16-bit pattern with onsets on even positions only).
+    """
+    packed = np.asarray(packed).astype(np.uint64)
+    if new_width >= width:
+        return np.ones(len(packed), dtype=bool)
+    factor = _check_resolutions(width, new_width)
+    # positions 0, factor, 2 * factor... (first character = most significant bit) are on the coarse grid
+    on_grid = sum(1 << (width - 1 - i) for i in range(0, width, factor))
+    return (packed & np.uint64(((1 << width) - 1) ^ on_grid)) == 0
+
+
+def convert_resolution(packed, width, new_width) -> np.ndarray:
+    """
+    Convert packed patterns to another resolution, e.g. 8-bit (eighth note) patterns to 16 bits
+    (sixteenth notes) or back, for the whole array at once.
+
+    Upsampling puts each position `new_width / width` positions apart and fills the gaps with '0's,
+    which is the same as appending that many '0's after every character of the pattern string
+    ('1010' -> '10001000').  Downsampling is the inverse and must be lossless: a ValueError is
+    raised if an onset falls between positions of the coarser grid (see is_representable()).
+    Both work a byte (or fewer bits, for factors above 8) at a time with lookup tables.
+    :param packed: array of packed patterns (see pack_bips()).
+    :param width: bits per pattern in `packed`.
+    :param new_width: bits per pattern wanted, a multiple or a divisor of `width`, at most 64.
+    :return: the packed patterns in the new resolution (dtype bip_dtype(new_width)).
+    """
+    packed = np.asarray(packed).astype(np.uint64)
+    if new_width == width:
+        return packed.astype(bip_dtype(width))
+    factor = _check_resolutions(width, new_width)
+    result = np.zeros(len(packed), dtype=np.uint64)
+
+    table, bits = _spread_table(factor)
+    if new_width > width:
+        for step in range((width + bits - 1) // bits):
+            chunk = (packed >> np.uint64(bits * step)) & np.uint64((1 << bits) - 1)
+            result |= table[chunk] << np.uint64(bits * step * factor)
+        # bit b of the pattern (counted from the least significant) goes to bit b * factor + factor - 1
+        return (result << np.uint64(factor - 1)).astype(bip_dtype(new_width))
+
+    if not is_representable(packed, width, new_width).all():
+        raise ValueError("Some patterns have onsets that cannot be represented with " + str(new_width) + " bits.")
+    # inverse of upsampling: shift the on-grid bits to b * factor and look the spread chunks up in the
+    # table, which is increasing, so a binary search finds the chunk that spreads to each one.
+    packed = packed >> np.uint64(factor - 1)
+    chunk_mask = np.uint64((1 << (bits * factor)) - 1)
+    for step in range((new_width + bits - 1) // bits):
+        chunk = (packed >> np.uint64(bits * step * factor)) & chunk_mask
+        result |= np.searchsorted(table, chunk).astype(np.uint64) << np.uint64(bits * step)
+    return result.astype(bip_dtype(new_width))
+
+
+def bip_dtype(width):
+    """
+    Return the smallest unsigned integer type that holds a pattern of `width` bits.
+    """
+    if width <= 8:
+        return np.uint8
+    elif width <= 16:
+        return np.uint16
+    elif width <= 32:
+        return np.uint32
+    else:
+        return np.uint64
+
+
+class BipStore(object):
+    """
+    Compiled store of binary onset patterns (bips) for every fileid in one of the bit pattern CSVs.
+
+    Each measure is packed into a single integer.  There is one flat array per part (part0, part1),
+    and per part an offsets array so that the measures of the i-th fileid are
+    parts[p][offsets[p][i]:offsets[p][i+1]].  Patterns whose length in the CSV is not `width` (a few
+    measures in the data are one bit short) are stored as 0 and kept verbatim in a small side table,
+    so the string accessors still return exactly what is in the CSV.
+
+    The store is built once from the CSV and cached next to it in the binary corpus format (a .bips
+    file, see save() and load()), which is rebuilt whenever the CSV is newer than the cache.
+    """
+
+    def __init__(self, width, fileids, offsets, parts, irregular):
+        self.width = width
+        self.fileids = fileids
+        self.offsets = offsets        # [offsets for part0, offsets for part1]
+        self.parts = parts            # [packed part0 patterns, packed part1 patterns]
+        self.irregular = irregular    # [dict index->string for part0, same for part1]
+        self.index = {fileid: i for i, fileid in enumerate(fileids)}
+
+    @staticmethod
+    def open(csv_path, width) -> 'BipStore':
+        """
+        Return the store for a bit pattern CSV, memory-mapping the cached .bips file if it is up to
+        date, otherwise compiling the CSV and writing the cache.
+        :param csv_path: the bit pattern CSV (bitpatterns.csv or 16bitpatterns.csv).
+        :param width: bits per pattern in that CSV.
+        :return:
+        """
+        csv_path = Path(csv_path)
+        cache_path = csv_path.with_suffix('.bips')
+        if cache_path.exists() and cache_path.stat().st_mtime >= csv_path.stat().st_mtime:
+            try:
+                store = BipStore.load(cache_path)
+                if store.width == width:
+                    return store
+            except (ValueError, struct.error):
+                pass  # written by another version of the format, rebuild it
+        store = BipStore.from_csv(csv_path, width)
+        try:
+            store.save(cache_path)
+        except OSError:
+            pass  # read-only data dir, we just don't get the cache
+        return store
+
+    @staticmethod
+    def from_csv(csv_path, width) -> 'BipStore':
+        """
+        Compile a bit pattern CSV (columns: index, fileid, part0list, part1list).
+        """
+        import pandas as pd
+        df = pd.read_csv(csv_path, usecols=['fileid', 'part0list', 'part1list'])
+
+        fileids = list(df['fileid'])
+        offsets = []
+        parts = []
+        irregular = []
+        for column in ['part0list', 'part1list']:
+            song_lengths = []
+            all_patterns = []
+            for cell in df[column]:
+                patterns = parse_bip_list(cell)
+                song_lengths.append(len(patterns))
+                all_patterns.extend(patterns)
+            odd = {i: p for i, p in enumerate(all_patterns) if len(p) != width}
+            packed = pack_bips([p if i not in odd else '' for i, p in enumerate(all_patterns)], width)
+            offsets.append(np.concatenate([[0], np.cumsum(song_lengths)]).astype(np.int64))
+            parts.append(packed)
+            irregular.append(odd)
+        return BipStore(width, fileids, offsets, parts, irregular)
+
+    def save(self, path):
+        """
+        Write the store in the binary corpus format (see the top of this file), atomically: the file is
+        written under a temporary name and then renamed, so readers never see a half-written corpus.
+        """
+        fileid_bytes = '\n'.join(self.fileids).encode('utf-8')
+        irregular_bytes = json.dumps([{str(i): p for i, p in odd.items()} for odd in self.irregular]).encode('utf-8')
+
+        # lay out the sections one after the other, each aligned to 8 bytes
+        position = _HEADER.size
+        layout = []
+        for section in [fileid_bytes, self.offsets[0], self.offsets[1], self.parts[0], self.parts[1],
+                        irregular_bytes]:
+            position = _align(position)
+            layout.append(position)
+            position += len(section) if isinstance(section, bytes) else section.nbytes
+        fileids_at, offsets0_at, offsets1_at, part0_at, part1_at, irregular_at = layout
+
+        header = _HEADER.pack(_MAGIC, _VERSION, self.width, len(self.fileids), len(self.parts[0]),
+                              len(self.parts[1]), fileids_at, len(fileid_bytes), offsets0_at, offsets1_at,
+                              part0_at, part1_at, irregular_at, len(irregular_bytes))
+        path = Path(path)
+        temp_path = path.with_name(path.name + '.' + str(os.getpid()) + '.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            for at, section in zip(layout, [fileid_bytes, np.ascontiguousarray(self.offsets[0], dtype='<i8'),
+                                            np.ascontiguousarray(self.offsets[1], dtype='<i8'),
+                                            self._little_endian(self.parts[0]), self._little_endian(self.parts[1]),
+                                            irregular_bytes]):
+                f.write(b'\0' * (at - f.tell()))
+                f.write(section if isinstance(section, bytes) else section.tobytes())
+        os.replace(temp_path, path)
+
+    def _little_endian(self, part):
+        return np.ascontiguousarray(part, dtype=np.dtype(bip_dtype(self.width)).newbyteorder('<'))
+
+    @staticmethod
+    def load(path) -> 'BipStore':
+        """
+        Open a corpus file written by save().  The offsets and patterns are numpy.memmap views of the
+        file, so opening is nearly free and processes that open the same file share the OS page cache.
+        """
+        mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        (magic, version, width, num_fileids, num_patterns0, num_patterns1, fileids_at, fileids_size,
+         offsets0_at, offsets1_at, part0_at, part1_at, irregular_at, irregular_size) = \
+            _HEADER.unpack(bytes(mapped[:_HEADER.size]))
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(str(path) + " is not a version " + str(_VERSION) + " binary pattern corpus.")
+
+        def section(at, count, dtype):
+            dtype = np.dtype(dtype).newbyteorder('<')
+            return mapped[at:at + count * dtype.itemsize].view(dtype)
+
+        fileid_bytes = bytes(mapped[fileids_at:fileids_at + fileids_size])
+        fileids = fileid_bytes.decode('utf-8').split('\n') if num_fileids else []
+        offsets = [section(offsets0_at, num_fileids + 1, np.int64), section(offsets1_at, num_fileids + 1, np.int64)]
+        parts = [section(part0_at, num_patterns0, bip_dtype(width)), section(part1_at, num_patterns1, bip_dtype(width))]
+        irregular = [{int(i): p for i, p in odd.items()}
+                     for odd in json.loads(bytes(mapped[irregular_at:irregular_at + irregular_size]).decode('utf-8'))]
+        return BipStore(width, fileids, offsets, parts, irregular)
+
+    def __contains__(self, fileid):
+        return fileid in self.index
+
+    def get_packed(self, fileid, part) -> np.ndarray:
+        """
+        Return the packed patterns of one part of a fileid, as a view into the store.
+        :param fileid:
+        :param part: 0 or 1.
+        :return:
+        """
+        i = self.index[fileid]
+        offsets = self.offsets[part]
+        return self.parts[part][offsets[i]:offsets[i + 1]]
+
+    def get_strings(self, fileid, part) -> List[str]:
+        """
+        Return the patterns of one part of a fileid as strings, exactly as they appear in the CSV.
+        """
+        i = self.index[fileid]
+        start = self.offsets[part][i]
+        patterns = unpack_bips(self.get_packed(fileid, part), self.width)
+        odd = self.irregular[part]
+        if odd:
+            for j in range(len(patterns)):
+                if start + j in odd:
+                    patterns[j] = odd[start + j]
+        return patterns
+
+    def get_regular_mask(self, fileid, part) -> np.ndarray:
+        """
+        Return a boolean array that is False for the measures whose CSV pattern was not `width` long.
+        """
+        i = self.index[fileid]
+        start, end = self.offsets[part][i], self.offsets[part][i + 1]
+        mask = np.ones(end - start, dtype=bool)
+        for j in self.irregular[part]:
+            if start <= j < end:
+                mask[j - start] = False
+        return mask
+
+    def gather(self, fileids, parts) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Concatenate the patterns of many fileids into one corpus-wide array.
+        :param fileids: the fileids, in the order wanted.
+        :param parts: the part (0 or 1) to take for each fileid.
+        :return: the packed patterns, the offsets of each fileid into them (len(fileids) + 1 values)
+                 and the mask of regular measures (see get_regular_mask()).
+        """
+        chunks = []
+        masks = []
+        for fileid, part in zip(fileids, parts):
+            chunks.append(self.get_packed(fileid, part))
+            masks.append(self.get_regular_mask(fileid, part))
+        if not chunks:
+            return np.zeros(0, dtype=bip_dtype(self.width)), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=bool)
+        offsets = np.concatenate([[0], np.cumsum([len(chunk) for chunk in chunks])]).astype(np.int64)
+        return np.concatenate(chunks), offsets, np.concatenate(masks)
+
+    def gather_irregular(self, fileids, parts) -> Dict[int, str]:
+        """
+        Return the verbatim patterns of the measures gather() marks as irregular (their packed value is 0),
+        by position in the corpus-wide array gather() returns for the same arguments.
+        """
+        irregular = {}
+        position = 0
+        for fileid, part in zip(fileids, parts):
+            i = self.index[fileid]
+            start, end = self.offsets[part][i], self.offsets[part][i + 1]
+            for j, pattern in self.irregular[part].items():
+                if start <= j < end:
+                    irregular[position + j - start] = pattern
+            position += end - start
+        return irregular
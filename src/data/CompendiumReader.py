@@ -0,0 +1,129 @@
+import pandas as pd
+import data.paths
+from data.BipStore import parse_bip_list, pack_bips
+from typing import Dict, Iterator, List, Tuple
+
+# Typed columns.  Repeated strings (composers, types, time signatures, ...) are read as categoricals,
+# which takes a fraction of the memory of one Python string per row.
+PK_COMPENDIUM_DTYPES = {'fileid': 'string', 'title': 'string', 'composer': 'category', 'year': 'string',
+                        'year_alt': 'string', 'rtctype': 'category', 'ts_pm': 'category',
+                        'ts_m21': 'category', 'true_ts': 'category', 'do_not_use': 'category',
+                        'quant_m21': 'string'}
+
+COMPENDIUM_DTYPES = {'rtcid': 'string', 'midiExist': 'category', 'title': 'string', 'subtitle': 'string',
+                     'composer': 'category', 'lyricist': 'category', 'year': 'string',
+                     'publisher': 'category', 'rtctype': 'category', 'source': 'category',
+                     'status': 'category', 'folio': 'category', 'folioDet': 'string',
+                     'auxFolders': 'string'}
+
+
+def iter_csv(path, chunksize=1000, columns=None, dtypes=None, fileids=None) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV in chunks of `chunksize` rows, so only one chunk is in memory at a time.
+    :param path: the CSV.
+    :param chunksize: rows per chunk.
+    :param columns: only read these columns (default: all).
+    :param dtypes: column -> dtype; entries for columns not being read are ignored.
+    :param fileids: if given, only the rows of these fileids are kept (chunks left empty are skipped).
+    :return: a generator of DataFrames.
+    """
+    dtypes = _wanted_dtypes(columns, dtypes)
+    if fileids is not None:
+        fileids = set(fileids)
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=columns, dtype=dtypes):
+        if fileids is not None:
+            chunk = chunk[chunk['fileid'].isin(fileids)]
+            if chunk.empty:
+                continue
+        yield chunk
+
+
+def _wanted_dtypes(columns, dtypes):
+    if dtypes is not None and columns is not None:
+        dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+    return dtypes
+
+
+def iter_compendium(chunksize=1000, columns=None) -> Iterator[pd.DataFrame]:
+    """
+    Read the full RTC compendium (compendium.csv) in chunks, with typed columns.
+    """
+    return iter_csv(data.paths.COMPENDIUM_CSV, chunksize, columns, COMPENDIUM_DTYPES)
+
+
+def iter_pk_compendium(chunksize=1000, columns=None, fileids=None) -> Iterator[pd.DataFrame]:
+    """
+    Read the PK compendium (pk-compendium2-new.csv, one row per midi rendition) in chunks, with typed columns.
+    """
+    return iter_csv(data.paths.PK_COMPENDIUM_CSV, chunksize, columns, PK_COMPENDIUM_DTYPES, fileids)
+
+
+def read_csv(path, columns=None, dtypes=None, chunksize=1000, fileids=None) -> pd.DataFrame:
+    """
+    Read the columns wanted of a CSV into one typed DataFrame, chunk by chunk (see iter_csv()).  If no rows
+    are left, the DataFrame is empty but still has the columns and their types.
+    """
+    chunks = list(iter_csv(path, chunksize, columns, dtypes, fileids))
+    if not chunks:
+        return pd.read_csv(path, nrows=0, usecols=columns, dtype=_wanted_dtypes(columns, dtypes))
+    # each chunk has its own categories, so concat gives back plain columns; make them categorical again.
+    df = pd.concat(chunks, ignore_index=True)
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def read_compendium(columns=None, chunksize=1000) -> pd.DataFrame:
+    """
+    Read the columns wanted of the full RTC compendium into one typed DataFrame, chunk by chunk.
+    """
+    return read_csv(data.paths.COMPENDIUM_CSV, columns, COMPENDIUM_DTYPES, chunksize)
+
+
+def read_pk_compendium(columns=None, chunksize=1000, fileids=None) -> pd.DataFrame:
+    """
+    Read the columns wanted of the PK compendium (only the rows of `fileids`, if given) into one typed
+    DataFrame, chunk by chunk.
+    """
+    return read_csv(data.paths.PK_COMPENDIUM_CSV, columns, PK_COMPENDIUM_DTYPES, chunksize, fileids)
+
+
+def iter_songs(bips_csv=None, width=16, metadata_columns=None, chunksize=100, packed=True,
+               fileids=None) -> Iterator[Tuple[str, Dict, Dict[str, List]]]:
+    """
+    Iterate over the songs of a bit pattern CSV as (fileid, metadata, patterns) records, reading the
+    patterns chunksize songs at a time.  Only the metadata columns asked for, of the songs asked for, are
+    kept in memory; they are joined to each chunk of songs at once.
+    :param bips_csv: the bit pattern CSV (default: 16bitpatterns.csv).
+    :param width: bits per pattern in that CSV.
+    :param metadata_columns: PK compendium columns to include in the metadata (default: title, composer,
+                             year, rtctype, ts_m21).
+    :param chunksize: songs per chunk.
+    :param packed: if True the patterns are packed integer arrays (see BipStore.pack_bips(), patterns of
+                   the wrong length are packed as 0); if False, lists of strings as in the CSV.
+    :param fileids: only these songs (default: all).
+    :return: a generator of (fileid, metadata dict, {'melody': patterns, 'bass': patterns}).  Songs without
+             a row in the PK compendium are skipped.
+    """
+    if bips_csv is None:
+        bips_csv = data.paths.PK_BINARY_ONSET_PATTERNS16_CSV
+    if metadata_columns is None:
+        metadata_columns = ['title', 'composer', 'year', 'rtctype', 'ts_m21']
+    metadata_columns = [c for c in metadata_columns if c != 'fileid']
+
+    # the melody part is the one with the higher average pitch (as in PKDataset)
+    wanted = ['fileid', 'part0_avgpitch', 'part1_avgpitch'] + metadata_columns
+    metadata = read_pk_compendium(wanted, fileids=fileids).drop_duplicates('fileid').set_index('fileid')
+    metadata['melody_part'] = (~(metadata['part0_avgpitch'] > metadata['part1_avgpitch'])).astype(int)
+    metadata = metadata[['melody_part'] + metadata_columns]
+
+    for chunk in iter_csv(bips_csv, chunksize, ['fileid', 'part0list', 'part1list'], fileids=fileids):
+        chunk = chunk.join(metadata, on='fileid', how='inner')
+        records = chunk[metadata_columns].to_dict('records')
+        for fileid, part0, part1, melody_part, record in zip(chunk['fileid'], chunk['part0list'],
+                                                               chunk['part1list'], chunk['melody_part'], records):
+            parts = [parse_bip_list(part0), parse_bip_list(part1)]
+            if packed:
+                parts = [pack_bips([p if len(p) == width else '' for p in part], width) for part in parts]
+            yield fileid, record, {'melody': parts[melody_part], 'bass': parts[1 - melody_part]}
@@ -0,0 +1,66 @@
+import pandas as pd
+from typing import Dict, List
+from data.PatternMatcher import PatternSpec, count_matches
+
+# metadata columns of the feature table (PKDataset.get_metadata() names -> feature table names)
+METADATA_COLUMNS = {'year_cat': 'year_cat', 'composer': 'composer', 'rtctype': 'rtctype', 'ts': 'ts',
+                    'year_num': 'year'}
+
+
+def build_feature_table(pkdata, specs: Dict[str, List[PatternSpec]], accept_no_silence_at_start=True,
+                        quant_cutoff=.95, bips16=False) -> pd.DataFrame:
+    """
+    Build the corpus feature table: one row per rag (its best version, see PKDataset.get_best_versions()),
+    with its metadata and how many of its melody measures match each group of pattern specs, in a single
+    vectorized pass over the whole corpus.
+
+    Measures where both melody and bass are silent are not counted, nor melody measures whose pattern
+    isn't the right length.
+    :param pkdata: a PKDataset.
+    :param specs: name -> list of PatternSpecs, see PatternMatcher.count_matches().
+    :param accept_no_silence_at_start: passed to get_best_versions().
+    :param quant_cutoff: passed to get_best_versions().
+    :param bips16: use the 16-bit patterns instead of the 8-bit ones.
+    :return: a DataFrame with columns fileid, barcount, one count and one '<name>_pct' (count / barcount)
+             column per spec group, and year_cat, composer, rtctype, ts and year (<NA> if not a number).
+    """
+    best_versions = pkdata.get_best_versions(accept_no_silence_at_start, quant_cutoff)
+    fileids = list(best_versions['fileid'])
+
+    melbips, offsets, mel_regular = pkdata.get_bips_corpus(fileids, melody=True, bips16=bips16)
+    bassbips, bass_offsets, bass_regular = pkdata.get_bips_corpus(fileids, melody=False, bips16=bips16)
+    assert (offsets == bass_offsets).all()
+
+    # if both mel and bass are silent, don't count either; also skip melody bars of the wrong length
+    bar_mask = ((melbips != 0) | (bassbips != 0) | ~bass_regular) & mel_regular
+    irregular = pkdata.get_irregular_bips(fileids, melody=True, bips16=bips16)
+    counts = count_matches(melbips, offsets, specs, bar_mask, irregular)
+
+    table = pd.DataFrame({'fileid': fileids})
+    for name, values in counts.items():
+        table[name] = values
+    metadata = pkdata.get_metadata(fileids, list(METADATA_COLUMNS)).rename(columns=METADATA_COLUMNS)
+    for column in metadata.columns:
+        table[column] = metadata[column].array
+    for name in specs:
+        table[name + '_pct'] = table[name] / table['barcount']
+    return table
+
+
+def rollup(table, by, columns) -> pd.DataFrame:
+    """
+    Add up feature table columns per group (e.g. per year, year_cat or composer).
+    :param table: a feature table from build_feature_table().
+    :param by: a column name, or a Series aligned with `table` giving each row's group.
+    :param columns: the (count) columns to add up.
+    :return: a DataFrame indexed by group with a 'compositions' column (number of rows in the group),
+             the summed columns and a '<column>_pct' column (sum / summed barcount) for each of them.
+    """
+    grouped = table.groupby(by, sort=False, dropna=False)
+    result = grouped[list(columns)].sum()
+    result.insert(0, 'compositions', grouped.size())
+    barcount = grouped['barcount'].sum()
+    for column in columns:
+        if column != 'barcount':
+            result[column + '_pct'] = result[column] / barcount
+    return result
@@ -1,23 +1,47 @@
 
+import numpy as np
 import pandas as pd
-import data.RagDataset
-from pathlib import Path
-from typing import List
+import data.paths
+from data.BipStore import BipStore, convert_resolution
+from typing import Dict, List
 
 class PKDataset(object):
-    PK_COMPENDIUM_CSV = (Path(__file__).parent / "../../data/processed/pk-compendium2-new.csv").resolve()  # my data
-
-    # set of patterns for 2/4 onset patterns by 16th notes, and 2/2 & 4/4 patterns in 8th notes
-    # (so each pattern has 16 bits)
-    PK_BINARY_ONSET_PATTERNS_CSV = (Path(__file__).parent / "../../data/processed/bitpatterns.csv").resolve()
-
-    # set of patterns for 2/2 and 4/4 including 16th notes, so each pattern has 16 bits
-    PK_BINARY_ONSET_PATTERNS16_CSV = (Path(__file__).parent / "../../data/processed/16bitpatterns.csv").resolve()
+    # see data/paths.py
+    PK_COMPENDIUM_CSV = data.paths.PK_COMPENDIUM_CSV
+    PK_BINARY_ONSET_PATTERNS_CSV = data.paths.PK_BINARY_ONSET_PATTERNS_CSV
+    PK_BINARY_ONSET_PATTERNS16_CSV = data.paths.PK_BINARY_ONSET_PATTERNS16_CSV
 
     def __init__(self):
         self.df = pd.read_csv(PKDataset.PK_COMPENDIUM_CSV)
-        self.bip_df = pd.read_csv(PKDataset.PK_BINARY_ONSET_PATTERNS_CSV, usecols=[1, 2, 3], index_col='fileid')
-        self.bip16_df = pd.read_csv(PKDataset.PK_BINARY_ONSET_PATTERNS16_CSV, usecols=[1,2,3], index_col='fileid')
+        # the bit pattern CSVs are compiled once into packed binary stores (cached as memory-mapped .bips
+        # files next to them, see data/convert_bips.py)
+        self.bips = BipStore.open(PKDataset.PK_BINARY_ONSET_PATTERNS_CSV, 8)
+        self.bips16 = BipStore.open(PKDataset.PK_BINARY_ONSET_PATTERNS16_CSV, 16)
+        self.meta_df = PKDataset._build_metadata(self.df)
+        self._best_versions = {}  # (accept_no_silence_at_start, quant_cutoff) -> best version table
+
+    @staticmethod
+    def _build_metadata(df) -> pd.DataFrame:
+        """
+        Build the fileid-indexed metadata table used by all the per-file accessors.  Besides the
+        compendium columns, it holds the derived values (melody part, clean time signature, numeric
+        year and year category) so they are computed once for the whole corpus instead of per call.
+        :param df: the compendium DataFrame.
+        :return:
+        """
+        meta = df.set_index('fileid')
+
+        meta['melody_part'] = np.where(meta['part0_avgpitch'] > meta['part1_avgpitch'], 0, 1)
+        meta['ts'] = meta['ts_m21'].str[2:5]
+
+        year_is_number = meta['year'].fillna('').astype(str).str.isdigit()
+        year_num = pd.to_numeric(meta['year'].where(year_is_number), errors='coerce').to_numpy(dtype=float)
+        meta['year_is_number'] = year_is_number
+        meta['year_num'] = pd.array(year_num, dtype='Int64')
+        year_cat = np.select([year_num < 1890, year_num < 1902, year_num < 1920],
+                             ["<1890", "1890-1901", "1902-1919"], ">1919")
+        meta['year_cat'] = pd.Series(year_cat, index=meta.index).where(year_is_number, meta['year_alt'])
+        return meta
 
     def get_best_version_of_rag(self, title, accept_no_silence_at_start=None, quant_cutoff=None):
         """
@@ -36,57 +60,63 @@ class PKDataset(object):
         if accept_no_silence_at_start is None:
             raise Exception("accept_no_silence_at_start must be True or False.")
 
+        best = self.get_best_versions(accept_no_silence_at_start, quant_cutoff)
+        if title not in best.index:
+            return None  # no files usable
+        return best.loc[title]
+
+    def get_best_versions(self, accept_no_silence_at_start=None, quant_cutoff=None) -> pd.DataFrame:
+        """
+        Return the best version of every rag at once, using the same rules as get_best_version_of_rag(),
+        as a DataFrame of compendium rows indexed by title.  Titles with no usable version are left out.
+        The table is computed in one pass over the compendium and memoized per argument pair.
+        :param accept_no_silence_at_start:
+        :param quant_cutoff:
+        :return:
+        """
+        if accept_no_silence_at_start is None:
+            raise Exception("accept_no_silence_at_start must be True or False.")
+
+        key = (bool(accept_no_silence_at_start), quant_cutoff)
+        if key not in self._best_versions:
+            self._best_versions[key] = self._compute_best_versions(*key)
+        return self._best_versions[key]
+
+    def _compute_best_versions(self, accept_no_silence_at_start, quant_cutoff) -> pd.DataFrame:
         mydf = self.df
-        mydf = mydf[mydf['title']==title]
-        mydf = mydf[mydf['do_not_use'].isna()]
+        mydf = mydf[mydf['title'].notna() & mydf['do_not_use'].isna()]
 
         # temporarliy remove 3/4 timesigs...these shouldn't be here
         mydf = mydf[mydf['ts_m21'] != "['3/4@0.0']"]
+        ts = mydf['ts_m21'].str[2:5]
 
-        if len(mydf) == 0:  # no files usable
-            return None
-
-        # Figure out if we have a "true" time sig in the PK data file.  Usually obtained from the score.
-        tempdf = mydf[mydf['true_ts'].notna()]
-        if len(tempdf) != 0:  # We have a true time sig.
-            #print("We have a hard-coded true TS")
-            true_ts = tempdf['true_ts'].iloc[0]
-            mydf = mydf[ mydf['ts_m21'].str[2:5]==true_ts ]
-        else:  # get the counts of the time sigs
-            tempdf = mydf['ts_m21'].str[2:5].mode()
-            if len(tempdf) == 1:
-                #print("Single-mode TS")
-                # easy, one most likely time sig, use it
-                true_ts = tempdf.iloc[0]
-                mydf = mydf[mydf['ts_m21'].str[2:5] == true_ts]
-            else:
-                #print("Multi-mode TS")
-                if (tempdf=='2/4').any():
-                    true_ts = '2/4'
-                elif (tempdf=='4/4').any():
-                    true_ts = '4/4'
-                else:
-                    print(tempdf)
-                    true_ts = tempdf.iloc[0]
-                mydf = mydf[mydf['ts_m21'].str[2:5] == true_ts]
+        # A "true" time sig in the PK data file wins (the first one listed for the title).
+        true_ts = mydf['true_ts'].groupby(mydf['title']).first()
+
+        # Otherwise take the mode time sig per title.  On a tie, prefer 2/4 over 4/4 over the rest,
+        # and among the rest take the first in sorted order (same as Series.mode()).
+        counts = pd.DataFrame({'title': mydf['title'], 'ts': ts}).dropna()
+        counts = counts.groupby(['title', 'ts']).size().rename('count').reset_index()
+        counts = counts[counts['count'] == counts.groupby('title')['count'].transform('max')]
+        counts['priority'] = counts['ts'].map({'2/4': 0, '4/4': 1}).fillna(2)
+        mode_ts = counts.sort_values(['title', 'priority', 'ts']).drop_duplicates('title').set_index('title')['ts']
+
+        chosen_ts = true_ts.combine_first(mode_ts)
+        mydf = mydf[ts == mydf['title'].map(chosen_ts)]
 
         # if this is False, we remove songs with 0 silence at start.
         # Reasoning is b/c songs with no silence at beginning may have an upbeat and we don't
         # know if the musicxml is aligned with the time sig correctly.
         if not accept_no_silence_at_start:
-            mydf = mydf[mydf['silence_beats_m21']>0]
+            mydf = mydf[mydf['silence_beats_m21'] > 0]
 
         if quant_cutoff is not None:
-            mydf = mydf[ mydf['onset_pct_m21'] >= quant_cutoff ]
-
-        # now sort by quantized percent from music21, and take the file with the largest value.
-        mydf = mydf[mydf['onset_pct_m21'] == (mydf['onset_pct_m21'].max())]
+            mydf = mydf[mydf['onset_pct_m21'] >= quant_cutoff]
 
-        # there should be only one value in mydf, unless there are multiple top quantized files
-        if len(mydf) == 0:
-            return None  # No versions of this rag with non-zero startup, presumably
-        else:
-            return mydf.iloc[0]
+        # now take the file(s) with the largest quantized percent from music21 for each title,
+        # and the first of those if there are multiple top quantized files
+        mydf = mydf[mydf['onset_pct_m21'] == mydf.groupby('title')['onset_pct_m21'].transform('max')]
+        return mydf.drop_duplicates('title').set_index('title', drop=False).rename_axis(None)
 
     def get_all_titles(self):
         """
@@ -95,6 +125,20 @@ class PKDataset(object):
         """
         return list(self.df['title'].unique())
 
+    def get_metadata(self, fileids, columns=None) -> pd.DataFrame:
+        """
+        Return the metadata rows for many fileids at once, indexed by fileid and in the order given.
+        Besides the compendium columns, the derived columns 'melody_part', 'ts', 'year_is_number',
+        'year_num' and 'year_cat' are available.
+        :param fileids: iterable of fileids.
+        :param columns: optional list of columns to return (default: all).
+        :return:
+        """
+        rows = self.meta_df.loc[list(fileids)]
+        if columns is not None:
+            rows = rows[columns]
+        return rows
+
     def get_melody_part_number(self, fileid) -> int:
         """
         Return the upper (treble, melody) part for a fileid.  Returns either 0 or 1.
@@ -102,16 +146,8 @@ class PKDataset(object):
         :return:
         """
 
-        # look up the fileid and figure out which part has the melody
-        # by examining the average pitch of each part
-
-        series = self.df[self.df['fileid']==fileid].iloc[0]  # we know there will be one match
-        p0pitch = series['part0_avgpitch']
-        p1pitch = series['part1_avgpitch']
-        if p0pitch > p1pitch:
-            return 0
-        else:
-            return 1
+        # the part with the higher average pitch has the melody; worked out once in _build_metadata()
+        return int(self.meta_df.at[fileid, 'melody_part'])
 
     def get_melody_bips(self, fileid) -> List:
         """
@@ -119,11 +155,7 @@ class PKDataset(object):
         of 8, which means for 2/4 time signatures, each bit is a 16th note.  For 2/2 and 4/4,
         bits are 8th notes.
         """
-        melpart_num = self.get_melody_part_number(fileid)
-        if melpart_num == 0:
-            return eval(self.bip_df.loc[fileid, 'part0list'])
-        else:
-            return eval(self.bip_df.loc[fileid, 'part1list'])
+        return self.bips.get_strings(fileid, self.get_melody_part_number(fileid))
 
     def get_bass_bips(self, fileid) -> List:
         """
@@ -131,33 +163,77 @@ class PKDataset(object):
         of 8, which means for 2/4 time signatures, each bit is a 16th note.  For 2/2 and 4/4,
         bits are 8th notes.
         """
-        melpart_num = self.get_melody_part_number(fileid)
-        if melpart_num == 0:
-            return eval(self.bip_df.loc[fileid, 'part1list'])
-        else:
-            return eval(self.bip_df.loc[fileid, 'part0list'])
+        return self.bips.get_strings(fileid, 1 - self.get_melody_part_number(fileid))
 
     def get_melody_bips16(self, fileid) -> List:
         """
         Returns the melody binary onset patterns for this fileid, which assumes this is a 2/2
         or 4/4 song, and we want the 16th note binar onset pattern.
         """
-        melpart_num = self.get_melody_part_number(fileid)
-        if melpart_num == 0:
-            return eval(self.bip16_df.loc[fileid, 'part0list'])
-        else:
-            return eval(self.bip16_df.loc[fileid, 'part1list'])
+        return self.bips16.get_strings(fileid, self.get_melody_part_number(fileid))
 
     def get_bass_bips16(self, fileid) -> List:
         """
         Returns the bass binary onset patterns for this fileid, which assumes this is a 2/2
         or 4/4 song, and we want the 16th note binar onset pattern.
         """
-        melpart_num = self.get_melody_part_number(fileid)
-        if melpart_num == 0:
-            return eval(self.bip16_df.loc[fileid, 'part1list'])
-        else:
-            return eval(self.bip16_df.loc[fileid, 'part0list'])
+        return self.bips16.get_strings(fileid, 1 - self.get_melody_part_number(fileid))
+
+    def get_melody_bips_packed(self, fileid) -> np.ndarray:
+        """
+        Same as get_melody_bips(), but returns a uint8 array view with one packed pattern per
+        measure (first bit of the pattern is the most significant bit).
+        """
+        return self.bips.get_packed(fileid, self.get_melody_part_number(fileid))
+
+    def get_bass_bips_packed(self, fileid) -> np.ndarray:
+        """
+        Same as get_bass_bips(), but returns a uint8 array view with one packed pattern per measure.
+        """
+        return self.bips.get_packed(fileid, 1 - self.get_melody_part_number(fileid))
+
+    def get_melody_bips16_packed(self, fileid) -> np.ndarray:
+        """
+        Same as get_melody_bips16(), but returns a uint16 array view with one packed pattern per measure.
+        """
+        return self.bips16.get_packed(fileid, self.get_melody_part_number(fileid))
+
+    def get_bass_bips16_packed(self, fileid) -> np.ndarray:
+        """
+        Same as get_bass_bips16(), but returns a uint16 array view with one packed pattern per measure.
+        """
+        return self.bips16.get_packed(fileid, 1 - self.get_melody_part_number(fileid))
+
+    def get_bips_corpus(self, fileids, melody=True, bips16=False, resolution=None):
+        """
+        Returns the packed patterns of the melody (or bass) of many fileids concatenated into one
+        array, as needed by data.PatternMatcher.  See BipStore.gather().
+        :param fileids:
+        :param melody: True for the melody part, False for the bass.
+        :param bips16: True for the 16-bit patterns, False for the 8-bit ones.
+        :param resolution: bits per pattern to convert the patterns to (e.g. 16 or 32 for 8-bit patterns,
+                           8 for 16-bit ones), see BipStore.convert_resolution().  Default: no conversion.
+        :return: (packed patterns, offsets per fileid, mask of regular measures)
+        """
+        fileids = list(fileids)
+        melody_parts = self.get_metadata(fileids, ['melody_part'])['melody_part'].to_numpy()
+        parts = melody_parts if melody else 1 - melody_parts
+        store = self.bips16 if bips16 else self.bips
+        packed, offsets, regular = store.gather(fileids, parts)
+        if resolution is not None:
+            packed = convert_resolution(packed, store.width, resolution)
+        return packed, offsets, regular
+
+    def get_irregular_bips(self, fileids, melody=True, bips16=False) -> Dict[int, str]:
+        """
+        Returns the patterns of the measures that get_bips_corpus() (with the same arguments) marks as
+        irregular, as they appear in the CSV, by position in its packed array.  See BipStore.gather_irregular().
+        """
+        fileids = list(fileids)
+        melody_parts = self.get_metadata(fileids, ['melody_part'])['melody_part'].to_numpy()
+        parts = melody_parts if melody else 1 - melody_parts
+        store = self.bips16 if bips16 else self.bips
+        return store.gather_irregular(fileids, parts)
 
     def get_music21_time_signature(self, fileid) -> str:
         """
@@ -165,8 +241,7 @@ class PKDataset(object):
         :param fileid:
         :return:
         """
-        series = self.df[self.df['fileid'] == fileid].iloc[0]  # we know there will be one match
-        return series['ts_m21']
+        return self.meta_df.at[fileid, 'ts_m21']
 
     def get_music21_time_signature_clean(self, fileid) -> str:
         """
@@ -174,29 +249,22 @@ class PKDataset(object):
         :param fileid:
         :return:
         """
-        series = self.df[self.df['fileid'] == fileid].iloc[0]  # we know there will be one match
-        ts =  series['ts_m21']
-        return ts[2:5]
+        return self.meta_df.at[fileid, 'ts']
 
     def get_composer(self, fileid) -> str:
-        series = self.df[self.df['fileid'] == fileid].iloc[0]  # we know there will be one match
-        return series['composer']
+        return self.meta_df.at[fileid, 'composer']
 
     def get_rtc_type(self, fileid) -> str:
-        series = self.df[self.df['fileid'] == fileid].iloc[0]  # we know there will be one match
-        return series['rtctype']
+        return self.meta_df.at[fileid, 'rtctype']
 
     def has_year_as_number(self, fileid) -> bool:
-        series = self.df[self.df['fileid']==fileid].iloc[0]  # we know there will be one match
-
-        return str(series['year']).isdigit()
+        return bool(self.meta_df.at[fileid, 'year_is_number'])
 
     def get_year_as_number(self, fileid) -> int:
-        series = self.df[self.df['fileid'] == fileid].iloc[0]  # we know there will be one match
-        if str(series['year']).isdigit():
-            return int(series['year'])
+        if self.meta_df.at[fileid, 'year_is_number']:
+            return int(self.meta_df.at[fileid, 'year_num'])
         else:
-            raise Exception("can't convert to integer: " + series['year'])
+            raise Exception("can't convert to integer: " + str(self.meta_df.at[fileid, 'year']))
 
     def get_year_as_category(self, fileid) -> str:
         """
@@ -205,19 +273,7 @@ class PKDataset(object):
         :param fileid:
         :return:
         """
-        series = self.df[self.df['fileid'] == fileid].iloc[0]  # we know there will be one match
-        if str(series['year']).isdigit():
-            year = int(series['year'])
-            if year < 1890:
-                return "<1890"
-            elif year < 1902:
-                return "1890-1901"
-            elif year < 1920:
-                return "1902-1919"
-            else:
-                return ">1919"
-        else:
-            return series['year_alt']
+        return self.meta_df.at[fileid, 'year_cat']
 
 
 
@@ -0,0 +1,97 @@
+import numpy as np
+from typing import Dict, List
+
+
+class PatternSpec(object):
+    """
+    A rhythm to look for in a measure: the bits `bits` starting `offset` bits into the measure.  If the
+    bits run past the end of the measure, the rest of them must be at the start of the next measure of
+    the same song (a pattern tied across the barline).  For example, in 8-bit patterns:
+      PatternSpec('1101', 0)      - 121 untied at the beginning of the measure
+      PatternSpec('1101', 6)      - 121 tied across the barline ('11' at the end, '01' in the next bar)
+      PatternSpec('10100010', 0)  - the whole measure is exactly 10100010
+    """
+
+    def __init__(self, bits, offset=0, width=8):
+        if not bits or set(bits) - {'0', '1'}:
+            raise ValueError("bits must be a non-empty string of '0's and '1's: " + str(bits))
+        if offset < 0 or offset >= width or offset + len(bits) > 2 * width:
+            raise ValueError("The pattern must start in the measure and end at most in the next one.")
+        self.bits = bits
+        self.offset = offset
+        self.width = width
+
+    @property
+    def crosses_barline(self) -> bool:
+        return self.offset + len(self.bits) > self.width
+
+    def __repr__(self):
+        return "PatternSpec(%r, %d, width=%d)" % (self.bits, self.offset, self.width)
+
+
+def match_bars(packed, offsets, spec, irregular=None) -> np.ndarray:
+    """
+    Returns a boolean array saying which measures of the corpus match a PatternSpec.
+    :param packed: the packed patterns of the whole corpus (see BipStore.gather()).
+    :param offsets: where each song starts in `packed` (one more value than songs).
+    :param spec: a PatternSpec.
+    :param irregular: optional position -> pattern string of the measures whose pattern isn't `width` long
+                      (packed as 0, see BipStore.gather_irregular()).  For a pattern tied across the barline,
+                      the start of such a next measure is then read from its string, as the per-measure
+                      loop over the CSV strings did.
+    :return:
+    """
+    packed = np.asarray(packed, dtype=np.uint64)
+    width = spec.width
+
+    # Each measure followed by the next one of the same song, as a single 2*width-bit window.
+    next_bar = np.zeros_like(packed)
+    next_bar[:-1] = packed[1:]
+    has_next = np.ones(len(packed), dtype=bool)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    song_ends = offsets[1:][np.diff(offsets) > 0] - 1
+    has_next[song_ends] = False  # the last measure of each song has no next measure
+    window = (packed << np.uint64(width)) | next_bar
+
+    shift = np.uint64(2 * width - spec.offset - len(spec.bits))
+    mask = np.uint64((1 << len(spec.bits)) - 1)
+    matches = ((window >> shift) & mask) == np.uint64(int(spec.bits, 2))
+    if spec.crosses_barline:
+        matches &= has_next
+        if irregular:
+            in_bar = spec.width - spec.offset  # how many bits of the pattern are in the measure itself
+            head_mask = np.uint64((1 << in_bar) - 1)
+            head = np.uint64(int(spec.bits[:in_bar], 2))
+            tail = spec.bits[in_bar:]
+            for j, pattern in irregular.items():
+                if j > 0 and has_next[j - 1]:
+                    matches[j - 1] = (packed[j - 1] & head_mask) == head and pattern[:len(tail)] == tail
+    return matches
+
+
+def count_matches(packed, offsets, specs: Dict[str, List[PatternSpec]], bar_mask=None,
+                  irregular=None) -> Dict[str, np.ndarray]:
+    """
+    Counts, for every song of the corpus at once, how many measures match each group of PatternSpecs.
+    A measure matching several specs of a group counts once per spec (as with a chain of ifs).
+    :param packed: the packed patterns of the whole corpus (see BipStore.gather()).
+    :param offsets: where each song starts in `packed` (one more value than songs).
+    :param specs: name -> list of PatternSpecs whose matches are added up under that name.
+    :param bar_mask: optional boolean array; measures where it is False are not counted (but can still be
+                     the "next measure" of a pattern tied across the barline).
+    :param irregular: optional position -> pattern string of the irregular measures, see match_bars().
+    :return: name -> array with the count for each song, plus 'barcount' -> number of counted measures.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_songs = len(offsets) - 1
+    song_of_bar = np.repeat(np.arange(num_songs), np.diff(offsets))
+    if bar_mask is None:
+        bar_mask = np.ones(len(song_of_bar), dtype=bool)
+
+    counts = {'barcount': np.bincount(song_of_bar[bar_mask], minlength=num_songs)}
+    for name, group in specs.items():
+        total = np.zeros(num_songs, dtype=np.int64)
+        for spec in group:
+            total += np.bincount(song_of_bar[match_bars(packed, offsets, spec, irregular) & bar_mask], minlength=num_songs)
+        counts[name] = total
+    return counts
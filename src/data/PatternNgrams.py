@@ -0,0 +1,235 @@
+import numpy as np
+from typing import Dict, List, Tuple
+from data.BipStore import pack_bips, unpack_bips
+from data.PatternMatcher import PatternSpec, match_bars
+
+
+class _SparseCounts(object):
+    """
+    Counts of n-grams of pattern ids, as a sparse matrix with one row per context (the n - 1 previous ids)
+    and one column per next id, in compressed rows: the next ids and counts of context `contexts[r]` are
+    `indices[indptr[r]:indptr[r + 1]]` and `counts[...]`.  Contexts are the n - 1 ids combined into one
+    int64 key (see PatternNgrams._context_key()), sorted so a context's row is found by binary search.
+    """
+
+    def __init__(self, context_keys, next_ids, vocabulary_size):
+        keys = context_keys * vocabulary_size + next_ids
+        keys, counts = np.unique(keys, return_counts=True)
+        contexts = keys // vocabulary_size
+        self.keys = keys  # context key * vocabulary size + next id, sorted: one per distinct n-gram
+        self.contexts, starts = np.unique(contexts, return_index=True)
+        self.indptr = np.append(starts, len(keys)).astype(np.int64)
+        self.indices = keys % vocabulary_size
+        self.counts = counts.astype(np.int64)
+        self.row_totals = np.add.reduceat(self.counts, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+
+    def row(self, context_key) -> int:
+        r = np.searchsorted(self.contexts, context_key)
+        return int(r) if r < len(self.contexts) and self.contexts[r] == context_key else -1
+
+    def lookup(self, keys) -> np.ndarray:
+        """
+        Return the count of every n-gram key in `keys` (0 for n-grams that never occur).
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(self.keys):
+            return np.zeros(keys.shape, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[i] == keys, self.counts[i], 0)
+
+
+class PatternNgrams(object):
+    """
+    Index of the patterns of consecutive measures of a corpus: how often each pattern occurs (unigrams),
+    and how often each one is followed by each other one in the next measure (bigrams) and in the next two
+    (trigrams), within a song.  Patterns are numbered (their id is their position in `vocabulary`, which is
+    sorted) and the counts kept as sparse matrices over the ids, so conditional probabilities such as
+    P(y | previous pattern) and counts of patterns tied across the barline are lookups in the index, not
+    passes over the corpus.
+
+    Build it from the packed patterns of a corpus (see PKDataset.get_bips_corpus()) or from pattern strings
+    per song (see from_song_patterns()).  Either way, patterns are given to and returned by the lookups as
+    strings such as '10100010'.
+    """
+
+    def __init__(self, patterns, offsets, bar_mask=None, width=None):
+        """
+        :param patterns: the pattern of every measure of the corpus, songs one after the other: packed
+                         patterns (see BipStore.gather()) or strings.
+        :param offsets: where each song starts in `patterns` (one more value than songs).
+        :param bar_mask: optional boolean array; measures where it is False are not counted, nor any n-gram
+                         they are part of.
+        :param width: bits per pattern of packed patterns, needed by count_spec().
+        """
+        patterns = np.asarray(patterns)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if bar_mask is None:
+            bar_mask = np.ones(len(patterns), dtype=bool)
+        self.width = width
+        self.vocabulary, ids = np.unique(patterns, return_inverse=True)
+        self.ids = ids.reshape(-1).astype(np.int64)  # the pattern id of every measure
+        self.offsets = offsets
+        size = len(self.vocabulary)
+
+        self.unigram_counts = np.bincount(self.ids[bar_mask], minlength=size).astype(np.int64)
+        # measure i starts an n-gram if the song still has n - 1 measures after it, all in the mask
+        song_end = np.repeat(offsets[1:], np.diff(offsets))
+        position = np.arange(len(self.ids))
+        next_in_mask = np.append(bar_mask[1:], False)
+        starts2 = np.flatnonzero(bar_mask & next_in_mask & (position + 1 < song_end))
+        starts3 = np.flatnonzero(bar_mask & next_in_mask & np.append(next_in_mask[1:], False)
+                                 & (position + 2 < song_end))
+        self.bigrams = _SparseCounts(self.ids[starts2], self.ids[starts2 + 1], size)
+        self.trigrams = _SparseCounts(self.ids[starts3] * size + self.ids[starts3 + 1], self.ids[starts3 + 2], size)
+
+    @staticmethod
+    def from_song_patterns(song_patterns: Dict[str, List[str]], width=None) -> 'PatternNgrams':
+        """
+        Build the index from pattern strings per song, e.g. the output of
+        pattern_extractors.rag_dataset_song_patterns().
+        :param song_patterns: song ID -> its patterns, one per measure.
+        :param width: if given, the patterns are packed, which is needed by count_spec(); patterns that are
+                      not `width` long are then left out like measures outside `bar_mask` (see __init__()).
+        :return:
+        """
+        lengths = [len(patterns) for patterns in song_patterns.values()]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        patterns = [pattern for song in song_patterns.values() for pattern in song]
+        if width is not None:
+            regular = np.array([len(p) == width for p in patterns], dtype=bool)
+            packed = pack_bips([p if ok else '' for p, ok in zip(patterns, regular)], width)
+            return PatternNgrams(packed, offsets, regular, width=width)
+        return PatternNgrams(np.array(patterns, dtype=str), offsets)
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    def id_of(self, pattern) -> int:
+        """
+        Return the id of a pattern, or -1 if it never occurs in the corpus.
+        """
+        if self.width is not None:
+            pattern = int(pattern, 2)
+        i = np.searchsorted(self.vocabulary, pattern)
+        return int(i) if i < len(self.vocabulary) and self.vocabulary[i] == pattern else -1
+
+    def patterns(self, ids) -> List[str]:
+        """
+        Return the patterns with the given ids, as strings.
+        """
+        if self.width is not None:
+            return unpack_bips(self.vocabulary[ids], self.width)
+        return self.vocabulary[ids].tolist()
+
+    def _ids(self, patterns) -> List[int]:
+        return [self.id_of(pattern) for pattern in patterns]
+
+    def _counts(self, n) -> _SparseCounts:
+        if n == 2:
+            return self.bigrams
+        if n == 3:
+            return self.trigrams
+        raise ValueError("Only bigrams and trigrams are indexed.")
+
+    def _context_key(self, ids) -> int:
+        key = 0
+        for i in ids:
+            key = key * len(self) + i
+        return key
+
+    def count(self, *patterns) -> int:
+        """
+        Return how many times the patterns occur in consecutive measures, e.g. count('10101010') or
+        count('10101010', '10001000').  At most 3 patterns.
+        """
+        ids = self._ids(patterns)
+        if -1 in ids:
+            return 0
+        if len(ids) == 1:
+            return int(self.unigram_counts[ids[0]])
+        return int(self._counts(len(ids)).lookup([self._context_key(ids)])[0])
+
+    def next_counts(self, *previous) -> Tuple[List, np.ndarray]:
+        """
+        Return the patterns that follow the previous pattern (or two patterns) and how many times each does.
+        :param previous: one or two patterns, in the order of the measures.
+        :return: (patterns, counts), the patterns in the order of the vocabulary.
+        """
+        ids = self._ids(previous)
+        counts = self._counts(len(ids) + 1)
+        r = counts.row(self._context_key(ids)) if -1 not in ids else -1
+        if r == -1:
+            return [], np.zeros(0, dtype=np.int64)
+        indices = counts.indices[counts.indptr[r]:counts.indptr[r + 1]]
+        return self.patterns(indices), counts.counts[counts.indptr[r]:counts.indptr[r + 1]]
+
+    def conditional(self, *previous) -> Dict:
+        """
+        Return P(y | previous) for every pattern y seen after the previous pattern (or two patterns),
+        e.g. conditional('10101010') -> {'10001000': 0.25, ...}.  Empty if the context never occurs
+        followed by a measure.
+        """
+        patterns, counts = self.next_counts(*previous)
+        total = int(counts.sum())
+        return {pattern: count / total for pattern, count in zip(patterns, counts.tolist())}
+
+    def probability(self, y, *previous) -> float:
+        """
+        Return P(y | previous), 0 if the context never occurs followed by a measure.
+        """
+        ids = self._ids(previous)
+        if -1 in ids:
+            return 0.0
+        counts = self._counts(len(ids) + 1)
+        r = counts.row(self._context_key(ids))
+        if r == -1:
+            return 0.0
+        return self.count(*previous, y) / int(counts.row_totals[r])
+
+    def probabilities(self, previous_ids, next_ids) -> np.ndarray:
+        """
+        Vectorized P(next | previous) over arrays of pattern ids (bigrams), e.g. to score every measure
+        transition of a song at once.  Pairs whose previous pattern is never followed get 0.
+        """
+        previous_ids = np.asarray(previous_ids, dtype=np.int64)
+        next_ids = np.asarray(next_ids, dtype=np.int64)
+        if not len(self.bigrams.contexts):
+            return np.zeros(previous_ids.shape)
+        counts = self.bigrams.lookup(previous_ids * len(self) + next_ids)
+        rows = np.minimum(np.searchsorted(self.bigrams.contexts, previous_ids), len(self.bigrams.contexts) - 1)
+        totals = np.where(self.bigrams.contexts[rows] == previous_ids, self.bigrams.row_totals[rows], 0)
+        return np.divide(counts, totals, out=np.zeros(previous_ids.shape), where=totals > 0)
+
+    def count_spec(self, spec: PatternSpec) -> int:
+        """
+        Return how many measures of the corpus match a PatternSpec (e.g. 121 tied across the barline), the
+        total of PatternMatcher.count_matches() over all songs, from the distinct patterns (or distinct
+        bigrams, for specs crossing the barline) instead of every measure.  Needs packed patterns.
+        Unlike count_matches(), a measure outside the mask never completes a pattern crossing the barline,
+        so the count is count_matches()'s when measures outside the mask are silent and no irregular
+        patterns are given (build_feature_table() gives them, so its ties into irregular measures are not
+        counted here).
+        """
+        if self.width is None:
+            raise ValueError("count_spec() needs an index of packed patterns (give the width).")
+        if spec.width != self.width:
+            raise ValueError("The spec is for " + str(spec.width) + "-bit patterns, the index has "
+                             + str(self.width) + "-bit patterns.")
+        if not spec.crosses_barline:
+            matches = match_bars(self.vocabulary, [0, len(self.vocabulary)], spec)
+            return int(self.unigram_counts[matches].sum())
+        # every distinct bigram as a song of two measures
+        size = len(self)
+        firsts = self.bigrams.keys // size
+        seconds = self.bigrams.keys % size
+        pairs = np.empty(2 * len(firsts), dtype=self.vocabulary.dtype)
+        pairs[0::2] = self.vocabulary[firsts]
+        pairs[1::2] = self.vocabulary[seconds]
+        matches = match_bars(pairs, np.arange(0, len(pairs) + 1, 2), spec)[0::2]
+        return int(self.bigrams.counts[matches].sum())
+
+    def count_specs(self, specs: Dict[str, List[PatternSpec]]) -> Dict[str, int]:
+        """
+        Return, for each group of PatternSpecs, the total number of matches in the corpus (see count_spec()).
+        """
+        return {name: sum(self.count_spec(spec) for spec in group) for name, group in specs.items()}
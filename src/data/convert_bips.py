@@ -0,0 +1,48 @@
+"""
+Convert bit pattern CSVs to the binary corpus format read by BipStore.load() (and memory-mapped by
+PKDataset).  Without arguments, converts the PK dataset CSVs in data/processed to .bips files next to
+them, which is also what PKDataset does by itself the first time it is used.
+
+    python -m data.convert_bips                                     # the PK dataset
+    python -m data.convert_bips patterns.csv patterns.bips --width 16
+"""
+import argparse
+from data.BipStore import BipStore
+from data.paths import PK_BINARY_ONSET_PATTERNS_CSV, PK_BINARY_ONSET_PATTERNS16_CSV
+
+
+def convert(csv_path, output_path, width) -> BipStore:
+    """
+    Compile a bit pattern CSV and write it in the binary corpus format.
+    :param csv_path: the bit pattern CSV (columns: index, fileid, part0list, part1list).
+    :param output_path: the .bips file to write.
+    :param width: bits per pattern in the CSV.
+    :return: the compiled store.
+    """
+    store = BipStore.from_csv(csv_path, width)
+    store.save(output_path)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert bit pattern CSVs to the binary corpus format.")
+    parser.add_argument("csv", nargs="?", help="bit pattern CSV (default: the PK dataset CSVs)")
+    parser.add_argument("output", nargs="?", help="output file (default: the CSV with a .bips extension)")
+    parser.add_argument("--width", type=int, default=16, help="bits per pattern in the CSV (default 16)")
+    args = parser.parse_args()
+
+    if args.csv is None:
+        jobs = [(PK_BINARY_ONSET_PATTERNS_CSV, 8), (PK_BINARY_ONSET_PATTERNS16_CSV, 16)]
+        jobs = [(csv_path, csv_path.with_suffix('.bips'), width) for csv_path, width in jobs if csv_path.exists()]
+    else:
+        output = args.output if args.output is not None else str(args.csv).rsplit('.', 1)[0] + '.bips'
+        jobs = [(args.csv, output, args.width)]
+
+    for csv_path, output_path, width in jobs:
+        store = convert(csv_path, output_path, width)
+        print("%s -> %s: %d fileids, %d + %d patterns" % (csv_path, output_path, len(store.fileids),
+                                                          len(store.parts[0]), len(store.parts[1])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+# Locations of the data files.  Kept in a module of their own so they can be used (e.g. to check
+# whether a cache is up to date) without importing pandas through PKDataset.
+from pathlib import Path
+
+PK_COMPENDIUM_CSV = (Path(__file__).parent / "../../data/processed/pk-compendium2-new.csv").resolve()  # my data
+
+# set of patterns for 2/4 onset patterns by 16th notes, and 2/2 & 4/4 patterns in 8th notes
+# (so each pattern has 16 bits)
+PK_BINARY_ONSET_PATTERNS_CSV = (Path(__file__).parent / "../../data/processed/bitpatterns.csv").resolve()
+
+# set of patterns for 2/2 and 4/4 including 16th notes, so each pattern has 16 bits
+PK_BINARY_ONSET_PATTERNS16_CSV = (Path(__file__).parent / "../../data/processed/16bitpatterns.csv").resolve()
+
+# the full RTC compendium (one row per composition, with or without midi renditions)
+COMPENDIUM_CSV = (Path(__file__).parent / "../../data/processed/compendium.csv").resolve()
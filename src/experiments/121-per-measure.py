@@ -10,7 +10,8 @@
 
 import data.PKDataset
 import data.RagDataset
-import scipy.stats
+from data.PatternMatcher import PatternSpec
+from data.CorpusFeatures import build_feature_table, rollup
 import pandas as pd
 from collections import Counter
 import functions
@@ -22,93 +23,19 @@ pd.set_option('display.width', 1000)
 pkdata = data.PKDataset.PKDataset()
 rags = data.RagDataset.RagDataset()
 
-rowslist = []
-
-for title in pkdata.get_all_titles():
-    series = pkdata.get_best_version_of_rag(title,
-                                            accept_no_silence_at_start=True,  # modify this #####
-                                            quant_cutoff=.95)
-    if series is not None:
-        fileid = series['fileid']
-        melbips = pkdata.get_melody_bips(fileid) # list of num of measures in the song, each item is 8chars long
-        bassbips = pkdata.get_bass_bips(fileid)
-
-        assert len(melbips) == len(bassbips)
-
-        d = {}
-        d['fileid'] = fileid
-
-        # initialize vars per song
-        barcount = 0
-        pattern_count_tied = 0
-        pattern_count_tied_aug = 0
-        pattern_count_untied = 0
-        pattern_count_untied_aug = 0
-
-        for x in range(0, len(melbips)):
-            melbip = melbips[x]
-            bassbip = bassbips[x]
-
-            # check if we have a next bar, needed for tied 121 pattern across barline
-            melbip_nextbar = 'XXXXXXXX'
-            if x+1 < len(melbips):
-                melbip_nextbar = melbips[x+1]
-
-            # if both mel and bass are silent, don't count either
-            if melbip == "00000000" and bassbip == "00000000":
-                continue
-
-            if len(melbip) != 8:
-                continue
-
-            # we have a good melody bar
-            barcount += 1
-
-            # check 121 untied
-            if melbip[0:4] == '1101':# or melbip == '10100010':
-                pattern_count_untied += 1
-                #print('found untied beg', x)
-            if melbip[4:8] == '1101':
-                pattern_count_untied += 1
-                #print('found untied end', x)
-            if melbip[2:6] == '1101':
-                pattern_count_tied += 1
-                #print('found tied middle', x)
-            if melbip[6:8] == '11' and melbip_nextbar[0:2] == '01':
-                pattern_count_tied += 1
-                #print('found tied across bar', x)
-
-            if melbip == '10100010':
-                pattern_count_untied_aug += 1
-            if melbip[4:8] == '1010' and melbip_nextbar[0:4] == '0010':
-                pattern_count_tied_aug += 1
-
-        # end of song
-        d['barcount'] = barcount
-        d['tied'] = pattern_count_tied
-        d['untied'] = pattern_count_untied
-        d['tied_aug'] = pattern_count_tied_aug
-        d['untied_aug'] = pattern_count_untied_aug
-
-        # add in some extra stats to look at
-        d['year_cat'] = pkdata.get_year_as_category(fileid)
-        d['composer'] = pkdata.get_composer(fileid)
-        d['rtctype'] = pkdata.get_rtc_type(fileid)
-        d['ts'] = pkdata.get_music21_time_signature_clean(fileid)
-
-        # For Jose's code cell at the bottom.
-        try:
-            d['year'] = pkdata.get_year_as_number(fileid)
-        except:
-            d['year'] = pd.NA
-
-        rowslist.append(d)
-
-df = pd.DataFrame(rowslist)
-df['untied_pct'] = df['untied']/df['barcount']
-df['tied_pct'] = df['tied']/df['barcount']
-df['untied_aug_pct'] = df['untied_aug']/df['barcount']
-df['tied_aug_pct'] = df['tied_aug']/df['barcount']
+# 121 patterns, tied and untied, in 8-bit patterns.  Each name adds up the matches of its specs.
+PATTERNS_121 = {
+    'untied': [PatternSpec('1101', 0), PatternSpec('1101', 4)],
+    'tied': [PatternSpec('1101', 2),
+             PatternSpec('1101', 6)],       # '11' at the end of the bar, '01' at the start of the next
+    'untied_aug': [PatternSpec('10100010', 0)],
+    'tied_aug': [PatternSpec('10100010', 4)],  # '1010' at the end of the bar, '0010' at the start of the next
+}
+
+# one row per rag: metadata plus counts of each pattern group, and <name>_pct = count / barcount
+df = build_feature_table(pkdata, PATTERNS_121,
+                         accept_no_silence_at_start=True,  # modify this #####
+                         quant_cutoff=.95)
 
 df_early = df[df['year_cat'] == '1890-1901']
 df_late = df[df['year_cat'] == '1902-1919']
@@ -124,6 +51,12 @@ print("Late  rags: untied/tied:", df_late['untied_pct'].mean(), df_late['tied_pc
 print("Early+late: untied/tied:", df_earlylate['untied_pct'].mean(), df_earlylate['tied_pct'].mean())
 print("Modern rgs: untied/tied:", df_modern['untied_pct'].mean(), df_modern['tied_pct'].mean())
 
+# same breakdown, pooling the bars of each era/composer instead of averaging per-rag proportions
+print(rollup(df, 'year_cat', ['barcount', 'untied', 'tied']))
+print(rollup(df, 'composer', ['barcount', 'untied', 'tied']).sort_values('compositions', ascending=False).head(10))
+
+import scipy.stats  # only needed from here on
+
 test_early_late_untied = scipy.stats.mannwhitneyu(df_early['untied_pct'], df_late['untied_pct'], alternative='two-sided')
 test_early_late_tied   = scipy.stats.mannwhitneyu(df_early['tied_pct'],   df_late['tied_pct'],   alternative='two-sided')
 
@@ -259,25 +192,11 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-df_yearly = pd.DataFrame({"year": range(df["year"].min(skipna=True),
-                                        df["year"].max(skipna=True)+1)})
-df_yearly = df_yearly.append({"year": "Unknown"}, ignore_index=True)
-
-df_yearly["compositions"] = 0
-df_yearly["tied"] = 0
-df_yearly["untied"] = 0
-df_yearly["total bars"] = 0
-for i, year in enumerate(df["year"]):
-    if year is pd.NA:
-        df_yearly.loc[df_yearly["year"] == "Unknown", "compositions"] += 1
-        df_yearly.loc[df_yearly["year"] == "Unknown", "tied"] += df.iloc[i].loc["tied"]
-        df_yearly.loc[df_yearly["year"] == "Unknown", "untied"] += df.iloc[i].loc["untied"]
-        df_yearly.loc[df_yearly["year"] == "Unknown", "total bars"] += df.iloc[i].loc["barcount"]
-    else:
-        df_yearly.loc[df_yearly["year"] == year, "compositions"] += 1
-        df_yearly.loc[df_yearly["year"] == year, "tied"] += df.iloc[i].loc["tied"]
-        df_yearly.loc[df_yearly["year"] == year, "untied"] += df.iloc[i].loc["untied"]
-        df_yearly.loc[df_yearly["year"] == year, "total bars"] += df.iloc[i].loc["barcount"]
+years = list(range(df["year"].min(skipna=True), df["year"].max(skipna=True)+1)) + ["Unknown"]
+year_or_unknown = df["year"].astype(object).where(df["year"].notna(), "Unknown")
+df_yearly = rollup(df, year_or_unknown, ["tied", "untied", "barcount"])
+df_yearly = df_yearly[["compositions", "tied", "untied", "barcount"]].reindex(years, fill_value=0)
+df_yearly = df_yearly.rename(columns={"barcount": "total bars"}).rename_axis("year").reset_index()
 
 df_yearly.insert(4, "total", df_yearly["tied"] + df_yearly["untied"])
 
@@ -1,10 +1,17 @@
 # Author: Jose
 # Python 3.8.1
 
-from typing import Dict, List, Tuple
+from typing import Dict, List, NamedTuple, Tuple
+from collections import defaultdict
+from functools import lru_cache
 import numpy as np
 import random
-import music21
+from song_transformations.alias_sampler import AliasSampler
+from data.BipStore import bips_to_matrix
+from song_transformations import instrumentation
+# music21 takes seconds to import, so it is only imported by the functions
+# that build music21 objects (build_score(), generate_melody_measure()).
+#
 # Convenient music21 commands:
 #   Note().nameWithOctave
 #   Note().duration.type and Note().dots()
@@ -44,24 +51,35 @@ import music21
 # Suggestion: there's no value in making a weighted choice vs ordering the
 #             pool of potential y's by frequency and pop one by one until
 #             obtaining a suitable y.
-def algorithm_1(song_notes, song_chords, song_patterns, dataset_patterns, pattern_length):
-    unique_song_patterns = []
-    for pattern in song_patterns:
-        if pattern not in unique_song_patterns:  # could optimize by using a dict instead.
-            unique_song_patterns.append(pattern)
-
-    rules = {}
-    for x in unique_song_patterns:
-        num_onsets = x.count('1')
-        freq = [tup[0] for tup in dataset_patterns[num_onsets]]
-        patterns = [tup[1] for tup in dataset_patterns[num_onsets]]
-        rule_generated = False
-        while not rule_generated:  # AND TIME < 2 SECONDS
-            y = np.random.choice(patterns, p=freq)
-            if x != y and onset_distance(x, y) <= pattern_length / 2:
-                rules[x] = y
-                print(f"Rule added: {x} -> {y}")  # -> add how popular y and whether rest at the beginning or not (caused by syncopation) <- push for those to happen!
-                rule_generated = True
+#
+# The while loop (rejection sampling) has been replaced by RuleSampler: the
+# eligible y's for each x are found once and y is drawn directly from them
+# (same distribution as rejecting ineligible draws), so the number of steps
+# is bounded and an x without eligible y's simply gets no rule.
+#
+# rng: optional seed or numpy.random.Generator, so the same seed always gives
+# the same rules (see generate_rules()).
+def algorithm_1(song_notes, song_chords, song_patterns, dataset_patterns, pattern_length, rule_sampler=None,
+                rng=None):
+    rules = generate_rules(song_patterns, dataset_patterns, pattern_length, rule_sampler, rng)
+    return build_score(song_notes, song_chords, song_patterns, rules)
+
+
+def build_score(song_notes, song_chords, song_patterns, rules):
+    """ Build the music21 score of the new song from the rules of algorithm_1().
+
+    :param Dict song_notes: the song's notes per measure (XmkSong.notes).
+    :param Dict song_chords: the song's chords per measure (XmkSong.chords).
+    :param List song_patterns: the song's onset patterns, one per measure.
+    :param Dict rules: song patterns x mapped to dataset patterns y.
+    :return: a music21 score with the melody and harmony staves.
+    """
+    with instrumentation.stage("score_construction"):
+        return _build_score(song_notes, song_chords, song_patterns, rules)
+
+
+def _build_score(song_notes, song_chords, song_patterns, rules):
+    import music21
 
     # Create new song by replacing original song's measures that appear in rules[0]
 
@@ -99,6 +117,139 @@ def algorithm_1(song_notes, song_chords, song_patterns, dataset_patterns, patter
 
 # Helper functions #
 
+def generate_rules(song_patterns, dataset_patterns, pattern_length, rule_sampler=None, rng=None) -> Dict[str, str]:
+    """ Generate the rules x -> y for the unique patterns x of a song.
+
+    Patterns for which no rule is possible (no dataset pattern with the same
+    number of onsets is different enough from x and close enough to it) are
+    left out of the rules, so those measures stay as they are.
+
+    Called by (depends on) algorithm_1().
+
+    :param List song_patterns: the song's onset patterns, one per measure.
+    :param Dict dataset_patterns: output of rag_dataset_pattern_extractor().
+    :param int pattern_length:
+    :param RuleSampler rule_sampler: reuse the eligible candidates already
+                                     found for `dataset_patterns` (e.g. across
+                                     songs); a new one is made if not given.
+    :param rng: a seed or numpy.random.Generator to draw the rules from, so
+                they can be reproduced (default: the global numpy random
+                state).
+    :return: a dictionary mapping song patterns x to dataset patterns y.
+    """
+    with instrumentation.stage("rule_generation"):
+        if rule_sampler is None:
+            rule_sampler = RuleSampler(dataset_patterns, pattern_length)
+        if rng is not None:
+            rng = np.random.default_rng(rng)  # a Generator is returned as it is.
+
+        unique_song_patterns = list(dict.fromkeys(song_patterns))  # in order of appearance.
+        instrumentation.count("unique_patterns", len(unique_song_patterns))
+        rule_sampler.precompute(unique_song_patterns)
+
+        rules = {}
+        for x in unique_song_patterns:
+            y = rule_sampler.sample(x, rng)
+            if y is None:
+                instrumentation.count("no_rule_possible")
+            else:
+                rules[x] = y
+                print(f"Rule added: {x} -> {y}")  # -> add how popular y and whether rest at the beginning or not (caused by syncopation) <- push for those to happen!
+        instrumentation.count("rules_generated", len(rules))
+    return rules
+
+
+class RuleSampler(object):
+    """ Draws the y of a rule x -> y without rejection sampling.
+
+    For each song pattern x, the eligible dataset patterns y (same number of
+    onsets, y != x and onset_distance(x, y) <= pattern_length / 2) are found
+    once, their proportions renormalized and put in an alias table, so every
+    draw afterwards is O(1). The candidates are memoized per x, so a single
+    RuleSampler can be shared by every song transformed against the same
+    `dataset_patterns`. If `dataset_patterns` is a PatternStatistics that
+    songs are added to or removed from, the memoized candidates are dropped
+    the next time the sampler is used.
+
+    :param Dict dataset_patterns: output of rag_dataset_pattern_extractor(),
+                                  or a PatternStatistics.
+    :param int pattern_length:
+    """
+
+    def __init__(self, dataset_patterns, pattern_length):
+        self.dataset_patterns = dataset_patterns
+        self.pattern_length = pattern_length
+        self._samplers = {}
+        self._buckets = {}
+        self._version = getattr(dataset_patterns, 'version', None)
+
+    def _refresh(self):
+        """ Forget the memoized candidates if the dataset patterns changed since they were found. """
+        version = getattr(self.dataset_patterns, 'version', None)
+        if version != self._version:
+            self._samplers = {}
+            self._buckets = {}
+            self._version = version
+
+    def _bucket(self, num_onsets):
+        """ The dataset patterns with `num_onsets` onsets, with their bit matrix. """
+        if num_onsets not in self._buckets:
+            bucket = [(freq, y) for freq, y in self.dataset_patterns.get(num_onsets, [])
+                      if len(y) == self.pattern_length]
+            self._buckets[num_onsets] = (bucket, bips_to_matrix([y for _, y in bucket], self.pattern_length))
+        return self._buckets[num_onsets]
+
+    def precompute(self, song_patterns):
+        """ Find the candidates for many song patterns at once.
+
+        The song patterns are grouped by number of onsets and each group is
+        compared against its whole dataset bucket with a single call to
+        onset_distances().
+        """
+        self._refresh()
+        by_onsets = defaultdict(list)
+        for x in song_patterns:
+            if x not in self._samplers:
+                by_onsets[x.count('1')].append(x)
+        for num_onsets, xs in by_onsets.items():
+            bucket, bucket_matrix = self._bucket(num_onsets)
+            distances = onset_distances(xs, bucket_matrix, self.pattern_length)
+            for x, x_distances in zip(xs, distances):
+                self._samplers[x] = self._make_sampler(x, bucket, x_distances)
+
+    def candidates(self, x) -> List[Tuple[float, str]]:
+        """ The eligible (proportion, y) for x, proportions not renormalized. """
+        self._refresh()
+        bucket, bucket_matrix = self._bucket(x.count('1'))
+        return self._eligible(x, bucket, onset_distances(x, bucket_matrix, self.pattern_length))
+
+    def _eligible(self, x, bucket, distances):
+        return [(freq, y) for (freq, y), distance in zip(bucket, distances)
+                if x != y and distance <= self.pattern_length / 2]
+
+    def _make_sampler(self, x, bucket, distances):
+        candidates = self._eligible(x, bucket, distances)
+        if not candidates:
+            return None
+        return AliasSampler([y for _, y in candidates], [freq for freq, _ in candidates])
+
+    def get_sampler(self, x):
+        """ The alias table for x, or None if no rule is possible for x. """
+        self._refresh()
+        if x not in self._samplers:
+            self.precompute([x])
+        return self._samplers[x]
+
+    def sample(self, x, rng=None):
+        """ Draw a y for x (from `rng`, a seed or numpy.random.Generator, if
+        given), or None if no rule is possible for x. """
+        sampler = self.get_sampler(x)
+        if sampler is None:
+            return None
+        instrumentation.count("sampling_attempts")  # always 1 per rule, the alias table never rejects.
+        return sampler.sample(rng)
+
+
 def onset_distance(pattern1, pattern2) -> int:
     """ Calculate the distance between onsets between two different patterns.
 
@@ -125,20 +276,91 @@ def onset_distance(pattern1, pattern2) -> int:
     return dist
 
 
-def generate_melody_measure(notes, pattern):
-    """ Obtain the music21 notes for a given measure.
+def onset_distances(patterns1, patterns2, pattern_length) -> np.ndarray:
+    """ Vectorized onset_distance() between whole banks of patterns.
+
+    Between two patterns with the same number of onsets, the sum of the
+    distances between their i-th onsets equals the sum, over every position
+    of the pattern, of the difference between how many onsets each one has
+    had up to that position. So the distances come from the cumulative onset
+    counts of every pattern, with no per-character loops.
+
+    Only meaningful for patterns with the same number of onsets (as in the
+    onset count buckets of the dataset patterns).
+
+    Called by (depends on) RuleSampler.
+
+    :param patterns1: a pattern, or many (list of strings, packed integers
+                      or a bit matrix; see data.BipStore.bips_to_matrix()).
+    :param patterns2: many patterns, same formats as `patterns1`.
+    :param int pattern_length:
+    :return: the distances from the pattern to each of `patterns2`, or the
+             len(patterns1) x len(patterns2) matrix of distances.
+    """
+    single = isinstance(patterns1, str)
+    matrix1 = bips_to_matrix([patterns1] if single else patterns1, pattern_length)
+    matrix2 = bips_to_matrix(patterns2, pattern_length)
+    onsets_so_far1 = np.cumsum(matrix1, axis=1, dtype=np.int32)
+    onsets_so_far2 = np.cumsum(matrix2, axis=1, dtype=np.int32)
+    distances = np.abs(onsets_so_far1[:, None, :] - onsets_so_far2[None, :, :]).sum(axis=2)
+    return distances[0] if single else distances
+
+
+class DurationTemplate(NamedTuple):
+    note_lengths: Tuple[int, ...]        # see get_note_lengths().
+    quarter_lengths: Tuple[float, ...]   # the same, in quarter notes (as music21 wants them).
+    rests_inserted: int                  # number of rests the fix-up in get_note_lengths() inserted.
 
-    Two types of patterns (measures) are passed to this function: patterns from
-    the xmk input song or patterns coming from the rag dataset (the selected
-    `y`'s in `rules`). Remember that '0's in a pattern represent both notes
-    being held after an onset and rests, and that patterns may begin with a
-    rest.
+
+# Number of (pattern, rest positions) templates kept by duration_template().
+DURATION_TEMPLATE_CACHE_SIZE = 8192
+
+
+def duration_template(notes, pattern) -> DurationTemplate:
+    """ The durations of a measure's notes, memoized.
+
+    The durations only depend on the pattern and on where the rests (-1) are
+    in `notes` (not on the pitches), and songs and the rag dataset reuse a
+    small set of rhythms, so they are computed once per (pattern, number of
+    notes, rest positions) and shared by every measure with the same rhythm.
+
+    Called by (depends on) get_note_lengths(), generate_melody_measure() and
+    midi_writer.melody_events().
 
     :param List notes: a measure's list of MIDI notes (>=0) and/or rests (-1).
     :param str pattern: the measure's onset pattern.
-    :return: a music21 stream containing a measure's notes exactly as they will
-             be played.
+    :return: the measure's DurationTemplate.
     """
+    rests = tuple(i for i, note in enumerate(notes) if note == -1)
+    template = _duration_template(pattern, len(notes), rests)
+    instrumentation.count("rests_inserted", template.rests_inserted)
+    return template
+
+
+@lru_cache(maxsize=DURATION_TEMPLATE_CACHE_SIZE)
+def _duration_template(pattern, num_notes, rests) -> DurationTemplate:
+    notes = [0] * num_notes
+    for i in rests:
+        notes[i] = -1
+    note_lengths, rests_inserted = _note_lengths(notes, pattern)
+    return DurationTemplate(tuple(note_lengths), tuple((length / len(pattern)) * 4 for length in note_lengths),
+                            rests_inserted)
+
+
+def get_note_lengths(notes, pattern) -> List[int]:
+    """ Obtain how long each note (or rest) of a measure lasts.
+
+    The lengths come from the memoized duration_template(), which
+    generate_melody_measure() and midi_writer.write_midi() use directly.
+
+    :param List notes: a measure's list of MIDI notes (>=0) and/or rests (-1).
+    :param str pattern: the measure's onset pattern.
+    :return: the length of each note in `notes`, in pattern positions.
+    """
+    return list(duration_template(notes, pattern).note_lengths)
+
+
+def _note_lengths(notes, pattern) -> Tuple[List[int], int]:
     note_lengths = []
     amount_held = 1
     for index in range(1, len(pattern)):
@@ -196,16 +418,41 @@ def generate_melody_measure(notes, pattern):
     # will have to first be found according to the -1s in `notes` AND the
     # note following it made shorter. BUT BY HOW MUCH!?!?!?!!
     # Only happens when there is a rest (-1) in `notes`.
+    rests_inserted = 0
     if len(notes) != len(note_lengths):
         for i in range(1, len(notes)):  # if before the first onset, already accounted for
             if notes[i] == -1 and note_lengths[i-1] > 0:
                 note_lengths.insert(i, 1)  # <- Experiment with rest length
                 note_lengths[i-1] -= 1
+                rests_inserted += 1
     # Alternative to reducing previous note by 1: if the pattern starts
     # with 0, put it there; else if it's between two notes in `notes`
     # (or is the last note in `notes`), split the duration of the
     # first one and make half of the hold belong to the Rest.
 
+    return note_lengths, rests_inserted
+
+
+def generate_melody_measure(notes, pattern):
+    """ Obtain the music21 notes for a given measure.
+
+    Two types of patterns (measures) are passed to this function: patterns from
+    the xmk input song or patterns coming from the rag dataset (the selected
+    `y`'s in `rules`). Remember that '0's in a pattern represent both notes
+    being held after an onset and rests, and that patterns may begin with a
+    rest.
+
+    :param List notes: a measure's list of MIDI notes (>=0) and/or rests (-1).
+    :param str pattern: the measure's onset pattern.
+    :return: a music21 stream containing a measure's notes exactly as they will
+             be played.
+    """
+    import music21
+
+    instrumentation.count("measures_rendered")
+    # music21 only understands duration in terms of quarter notes.
+    quarter_lengths = duration_template(notes, pattern).quarter_lengths
+
     melody_measure = music21.stream.Measure()
     for i, note_pitch in enumerate(notes):
         if note_pitch != -1:
@@ -213,8 +460,7 @@ def generate_melody_measure(notes, pattern):
             note.pitch.midi = note_pitch
         else:
             note = music21.note.Rest()
-        # music21 only understands duration in terms of quarter notes.
-        note.duration.quarterLength = (note_lengths[i] / len(pattern)) * 4
+        note.duration.quarterLength = quarter_lengths[i]
         melody_measure.append(note)
 
     return melody_measure
@@ -240,13 +486,19 @@ def modify_song(song_patterns, rules):
 #
 # DO WE WANT THIS? `chance` -> not yet, experiment with it later
 #
+# `rng` (a seed or numpy.random.Generator) makes the choices reproducible; without it
+# the global `random` module is used. Returns the onset position chosen for
+# each onset (from the song pattern or from the rag pattern).
+#
 # Optimized version of randomlyChange() in
 # Midireader/midiReader/src/midireader/processingXmk/syncopalooza.java
-def randomly_change(rule, chance):
+def randomly_change(rule, chance, rng=None):
     song_pattern = rule[0]
     rag_pattern = rule[1]
 
     onsets = song_pattern.count("1")
+    if rng is not None:
+        rng = np.random.default_rng(rng)
 
     song_onset_indices = []
     rag_onset_indices = []
@@ -256,11 +508,13 @@ def randomly_change(rule, chance):
         if rag_pattern[i] == "1":
             rag_onset_indices.append(i)
 
+    chosen_indices = []
     for i in range(onsets):
-        rand = random.random()
+        rand = rng.random() if rng is not None else random.random()
         if chance > rand:
             ind = song_onset_indices[i]
         else:
             ind = rag_onset_indices[i]
 
-        pass
+        chosen_indices.append(ind)
+    return chosen_indices
@@ -0,0 +1,80 @@
+from typing import List, Sequence
+import numpy as np
+
+
+class AliasSampler(object):
+    """ Draws items from a fixed discrete distribution in O(1) per draw.
+
+    Uses Vose's alias method: building the table is O(n), after that every
+    draw costs two uniform floats, no matter how many items there are
+    (np.random.choice(items, p=weights) is O(n) per draw). The first float
+    picks a column of the table, the second whether to keep it or take its
+    alias; every way of drawing (sample(), sample_indices() and
+    variants.draw_rule_sets()) takes them in that order, so the same random
+    stream gives the same items whichever is used.
+
+    :param Sequence items: the values to draw from.
+    :param Sequence[float] weights: non-negative weights (don't need to add
+                                    up to 1), one per item.
+    """
+
+    def __init__(self, items: Sequence, weights: Sequence[float]):
+        if len(items) == 0:
+            raise ValueError("Cannot sample from an empty set of items.")
+        if len(items) != len(weights):
+            raise ValueError("There must be one weight per item.")
+
+        n = len(items)
+        scaled = np.asarray(weights, dtype=float)
+        scaled = scaled * n / scaled.sum()
+
+        self.items = list(items)
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        # Whatever is left has (up to rounding error) probability 1 of being kept.
+
+    def __len__(self):
+        return len(self.items)
+
+    def sample(self, rng=None):
+        """ Draws one item.
+
+        :param rng: a seed or numpy.random.Generator to draw from (default:
+                    the global numpy random state).
+        """
+        # a Generator is returned by default_rng() as it is.
+        uniform = np.random.random_sample if rng is None else np.random.default_rng(rng).random
+        i = min(int(uniform() * len(self.items)), len(self.items) - 1)
+        kept = uniform() < self.prob[i]
+        if kept:
+            return self.items[i]
+        return self.items[self.alias[i]]
+
+    def sample_indices(self, size, rng=None) -> np.ndarray:
+        """ Draws `size` item indices at once (vectorized).
+
+        :param rng: a seed or numpy.random.Generator to draw from (default:
+                    the global numpy random state).
+        """
+        uniform = np.random.random_sample if rng is None else np.random.default_rng(rng).random
+        u = uniform((size, 2))  # the same floats, in the same order, as `size` calls to sample().
+        i = np.minimum((u[:, 0] * len(self.items)).astype(np.int64), len(self.items) - 1)
+        keep = u[:, 1] < self.prob[i]
+        return np.where(keep, i, self.alias[i])
+
+    def sample_many(self, size, rng=None) -> List:
+        """ Draws `size` items at once (see sample_indices()). """
+        return [self.items[i] for i in self.sample_indices(size, rng)]
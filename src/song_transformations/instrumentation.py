@@ -0,0 +1,154 @@
+""" Opt-in timing and counters for the song transformation pipeline.
+
+Nothing is recorded until enable() is called. Until then stage() returns a
+shared do-nothing context manager and count() returns right away, so the
+calls left in the pipeline cost next to nothing.
+
+    from song_transformations import instrumentation
+    metrics = instrumentation.enable()
+    song_transformer(...)
+    print(metrics.to_json())            # or metrics.to_prometheus()
+
+Stages recorded (wall time and number of calls):
+    corpus_loading, corpus_cache_load, xmk_parsing, onset_patterns,
+    rule_generation, score_construction, midi_writing, output_writing
+Counters:
+    unique_patterns, sampling_attempts, rules_generated, no_rule_possible,
+    measures_rendered, rests_inserted, cache_hits
+Everything recorded inside song(name) is also kept per song.
+"""
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+import json
+import time
+
+
+class Metrics(object):
+    """ Wall time per stage and counters, in total and per song. """
+
+    def __init__(self):
+        self.stages = {}    # stage -> {"calls": int, "seconds": float}
+        self.counters = {}  # counter -> total
+        self.songs = {}     # song -> {"stages": {...}, "counters": {...}}
+        self._current_song = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._add_stage(self.stages, name, 1, seconds)
+            if self._current_song is not None:
+                self._add_stage(self._current_song["stages"], name, 1, seconds)
+
+    @staticmethod
+    def _add_stage(stages, name, calls, seconds):
+        stage = stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+        stage["calls"] += calls
+        stage["seconds"] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self._current_song is not None:
+            counters = self._current_song["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    @contextmanager
+    def song(self, name):
+        """ Also attribute what is recorded inside the block to the song `name`. """
+        previous = self._current_song
+        self._current_song = self.songs.setdefault(name, {"stages": {}, "counters": {}})
+        try:
+            yield
+        finally:
+            self._current_song = previous
+
+    def add_song(self, name, song_metrics):
+        """ Merge the metrics of one song recorded elsewhere (e.g. in a worker process of transform_batch()). """
+        song = self.songs.setdefault(name, {"stages": {}, "counters": {}})
+        for stage, values in song_metrics["stages"].items():
+            self._add_stage(self.stages, stage, values["calls"], values["seconds"])
+            self._add_stage(song["stages"], stage, values["calls"], values["seconds"])
+        for counter, value in song_metrics["counters"].items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+            song["counters"][counter] = song["counters"].get(counter, 0) + value
+
+    def to_dict(self) -> Dict:
+        return {"stages": self.stages, "counters": self.counters, "songs": self.songs}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix="song_transformer", per_song=False) -> str:
+        """ The metrics in the Prometheus text exposition format.
+
+        :param str prefix: prepended to every metric name.
+        :param bool per_song: also export every song's values, with a song label.
+        """
+        rows = [(self.stages, self.counters, "")]
+        if per_song:
+            rows += [(song["stages"], song["counters"], f'song="{_escape(name)}"')
+                     for name, song in self.songs.items()]
+
+        lines = []
+        for metric, key in [("stage_seconds_total", "seconds"), ("stage_calls_total", "calls")]:
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for stages, _, song_label in rows:
+                for stage, values in stages.items():
+                    labels = "{" + ",".join(filter(None, [f'stage="{_escape(stage)}"', song_label])) + "}"
+                    lines.append(f"{prefix}_{metric}{labels} {values[key]!r}")
+        for counter in self.counters:
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            for _, counters, song_label in rows:
+                if counter in counters:
+                    labels = "{" + song_label + "}" if song_label else ""
+                    lines.append(f"{prefix}_{counter}_total{labels} {counters[counter]}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label_value) -> str:
+    return str(label_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_metrics = None  # type: Optional[Metrics]
+_NO_STAGE = nullcontext()
+
+
+def enable() -> Metrics:
+    """ Start recording (into a new Metrics, which is returned). """
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def disable() -> Optional[Metrics]:
+    """ Stop recording; returns what was recorded. """
+    global _metrics
+    metrics, _metrics = _metrics, None
+    return metrics
+
+
+def current() -> Optional[Metrics]:
+    """ The Metrics being recorded into, or None if instrumentation is off. """
+    return _metrics
+
+
+def stage(name):
+    """ Context manager timing the stage `name`. """
+    if _metrics is None:
+        return _NO_STAGE
+    return _metrics.stage(name)
+
+
+def count(name, value=1):
+    if _metrics is not None:
+        _metrics.count(name, value)
+
+
+def song(name):
+    """ Context manager attributing what is recorded inside it to the song `name`. """
+    if _metrics is None:
+        return _NO_STAGE
+    return _metrics.song(name)
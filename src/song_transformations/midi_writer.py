@@ -0,0 +1,108 @@
+from typing import List
+import mido
+from song_transformations.algorithm_1 import duration_template
+from song_transformations import instrumentation
+
+# MIDI ticks per quarter note of the files written.
+TICKS_PER_BEAT = 480
+MELODY_CHANNEL = 0
+HARMONY_CHANNEL = 1
+VELOCITY = 64
+
+
+def write_midi(filename, song_notes, song_chords, song_patterns, rules, beats_per_minute=120):
+    """ Write the new song straight to a MIDI file, without music21.
+
+    Takes the same inputs as algorithm_1.build_score() and produces the same
+    music: the melody uses the (rule-replaced) pattern of every measure and
+    the durations from get_note_lengths(); the harmony has one chord per
+    chord change, lasting a quarter note each (music21's default duration,
+    which is what build_score() ends up with). Only mido objects are created,
+    so this is much faster than building and writing a music21 score; use
+    build_score() when notation (MusicXML) is needed.
+
+    :param str filename: where to write the MIDI file.
+    :param Dict song_notes: the song's notes per measure (XmkSong.notes).
+    :param Dict song_chords: the song's chords per measure (XmkSong.chords).
+    :param List song_patterns: the song's onset patterns, one per measure.
+    :param Dict rules: song patterns x mapped to dataset patterns y.
+    :param int beats_per_minute: tempo of the file (XmkSong.beats_per_minute).
+    :return: the mido MidiFile written.
+    """
+    with instrumentation.stage("midi_writing"):
+        return _write_midi(filename, song_notes, song_chords, song_patterns, rules, beats_per_minute)
+
+
+def _write_midi(filename, song_notes, song_chords, song_patterns, rules, beats_per_minute):
+    midi_file = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+
+    melody_track = mido.MidiTrack()
+    melody_track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(beats_per_minute), time=0))
+    melody_track.extend(_to_track_messages(melody_events(song_notes, song_patterns, rules), MELODY_CHANNEL))
+    midi_file.tracks.append(melody_track)
+
+    harmony_track = mido.MidiTrack()
+    harmony_track.extend(_to_track_messages(harmony_events(song_chords), HARMONY_CHANNEL))
+    midi_file.tracks.append(harmony_track)
+
+    midi_file.save(filename)
+    return midi_file
+
+
+def melody_events(song_notes, song_patterns, rules) -> List[tuple]:
+    """ The melody as (start tick, end tick, MIDI note) events.
+
+    :return: a list of events, with rests left out.
+    """
+    events = []
+    time = 0  # in quarter notes; converted to ticks per event so rounding never accumulates.
+    for index, pattern in enumerate(song_patterns):
+        notes = song_notes[index + 1]
+        pattern = rules.get(pattern, pattern)
+        instrumentation.count("measures_rendered")
+        quarter_lengths = duration_template(notes, pattern).quarter_lengths
+        for i, note_pitch in enumerate(notes):
+            duration = quarter_lengths[i]
+            if note_pitch != -1:
+                events.append((_ticks(time), _ticks(time + duration), note_pitch))
+            time += duration
+    return events
+
+
+def harmony_events(song_chords) -> List[tuple]:
+    """ The harmony as (start tick, end tick, MIDI note) events, one per chord note. """
+    events = []
+    time = 0
+    for note_groups in song_chords.values():
+        for note_group in note_groups:
+            if note_group == -1:  # rests are ignored for chords, as in build_score().
+                continue
+            for note_pitch in note_group:
+                events.append((_ticks(time), _ticks(time + 1), note_pitch))
+            time += 1
+    return events
+
+
+def _ticks(quarter_length) -> int:
+    return int(round(quarter_length * TICKS_PER_BEAT))
+
+
+def _to_track_messages(events, channel) -> List[mido.Message]:
+    """ Turn (start, end, note) events into delta-timed note_on/note_off messages. """
+    timeline = []
+    for start, end, note_pitch in events:
+        if end <= start:
+            continue  # zero-length notes can come out of the rest fix-up in get_note_lengths().
+        # At the same tick, note_offs (0) go before note_ons (1).
+        timeline.append((end, 0, note_pitch))
+        timeline.append((start, 1, note_pitch))
+    timeline.sort()
+
+    messages = []
+    previous_tick = 0
+    for tick, is_on, note_pitch in timeline:
+        message_type = 'note_on' if is_on else 'note_off'
+        messages.append(mido.Message(message_type, channel=channel, note=note_pitch, velocity=VELOCITY,
+                                     time=tick - previous_tick))
+        previous_tick = tick
+    return messages
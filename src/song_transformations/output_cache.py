@@ -0,0 +1,164 @@
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Default place and size of the cache of transformed songs.
+DEFAULT_CACHE_DIR = (Path(__file__).parent / "../../data/cache/outputs").resolve()
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Bump when a change to the algorithm makes previously cached outputs stale.
+ALGORITHM_VERSION = 1
+# Fraction of max_bytes that OutputCache.evict() goes down to.
+EVICT_TO = 0.9
+
+
+def content_hash(filename) -> str:
+    """ SHA-256 of a file's content (e.g. of an xmk song). """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def corpus_hash(dataset_patterns) -> str:
+    """ A version of the dataset patterns: the hash of every (onset count, proportion, pattern).
+
+    :param Dict dataset_patterns: output of rag_dataset_pattern_extractor()
+                                  (or a PatternStatistics).
+    """
+    digest = hashlib.sha256()
+    for num_onsets in sorted(dataset_patterns.keys()):
+        digest.update(repr((num_onsets, sorted(dataset_patterns[num_onsets]))).encode())
+    return digest.hexdigest()
+
+
+def song_seed(seed, filename) -> np.random.SeedSequence:
+    """ The random stream of one song of a batch transformed with `seed`.
+
+    It is derived from the seed and the song's content (content_hash()), not
+    from the song's position in the batch, so adding, removing, renaming or
+    moving other songs (or this one) doesn't change it, and its cache
+    entries stay valid.
+    """
+    digest = content_hash(filename)
+    return np.random.SeedSequence([int(seed)] + [int(digest[i:i + 8], 16) for i in range(0, len(digest), 8)])
+
+
+def seed_key(rng) -> Optional[Tuple]:
+    """ What identifies the random stream `rng` will give, or None if it can't be known.
+
+    Seeds (ints) and numpy.random.SeedSequences always give the same stream;
+    a Generator (or no rng at all, the global random state) depends on what
+    was drawn from it before, so results made with one can't be cached.
+    """
+    if isinstance(rng, (int, np.integer)) and not isinstance(rng, bool):
+        return ('seed', int(rng))
+    if isinstance(rng, np.random.SeedSequence):
+        return ('seed_sequence', rng.entropy, tuple(rng.spawn_key), rng.pool_size)
+    return None
+
+
+class OutputCache(object):
+    """ Content-addressed cache of transformed songs.
+
+    Each entry is keyed by the hash of the xmk file's content, the version of
+    the dataset patterns (corpus_hash()), pattern_length, the seed, the
+    output format and ALGORITHM_VERSION, and holds the rendered file (MIDI or
+    MusicXML) along with the rules that were chosen. Entries are two files,
+    <key><extension> and <key>.json, written atomically. When the cache grows
+    past `max_bytes`, the least recently used entries are removed (a hit
+    touches the entry's files, so their modification time is their last use).
+    The size of the cache is only measured (by listing the directory) the
+    first time an entry is added and when the entries added since then may
+    have taken it past `max_bytes`; eviction then goes down to
+    EVICT_TO * max_bytes so the next one is some entries away. Other
+    processes writing to the same directory are only seen at those times, so
+    with several writers the cache can briefly go over the cap.
+
+    :param str directory: where the entries are kept (created if needed).
+    :param str corpus_version: corpus_hash() of the dataset patterns the
+                               songs are transformed against.
+    :param int max_bytes: size cap of the cache.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, corpus_version="", max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.corpus_version = corpus_version
+        self.max_bytes = max_bytes
+        self._size = None  # bytes in the cache as of the last evict(), plus what was put since.
+
+    def key(self, xmk_filename, pattern_length, rng, output_format) -> Optional[str]:
+        """ The cache key of a transformation, or None if it can't be cached (see seed_key()). """
+        seed = seed_key(rng)
+        if seed is None:
+            return None
+        parts = (ALGORITHM_VERSION, content_hash(xmk_filename), self.corpus_version, pattern_length, seed,
+                 output_format)
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def _files(self, key, extension) -> Tuple[Path, Path]:
+        return self.directory / (key + extension), self.directory / (key + ".json")
+
+    def get(self, key, extension) -> Optional[Tuple[Path, Dict[str, str]]]:
+        """ The cached output file and rules of `key`, or None on a miss. """
+        output, metadata = self._files(key, extension)
+        try:
+            with open(metadata) as file:
+                rules = json.load(file)["rules"]
+            os.utime(output)
+            os.utime(metadata)
+        except (OSError, ValueError, KeyError):
+            return None
+        return output, rules
+
+    def put(self, key, extension, source, rules):
+        """ Store a copy of the rendered file `source` and its rules under `key`, then evict if needed. """
+        output, metadata = self._files(key, extension)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            suffix = f".{os.getpid()}.tmp"
+            shutil.copyfile(source, str(output) + suffix)
+            with open(str(metadata) + suffix, 'w') as file:
+                json.dump({"rules": rules}, file)
+            os.replace(str(output) + suffix, output)
+            os.replace(str(metadata) + suffix, metadata)  # last: an entry only counts once its rules are there
+            added = output.stat().st_size + metadata.stat().st_size
+        except OSError:
+            return  # not being able to cache is not an error.
+        if self._size is None or self._size + added > self.max_bytes:
+            self.evict()
+        else:
+            self._size += added
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits in EVICT_TO * max_bytes
+        (nothing is removed if it already fits in max_bytes). """
+        entries = {}
+        for path in self.directory.iterdir():
+            if path.name.endswith(".tmp"):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # removed by another process meanwhile.
+            key = path.name.split('.')[0]
+            size, last_used, paths = entries.get(key, (0, 0, []))
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime), paths + [path])
+
+        total = sum(size for size, _, _ in entries.values())
+        target = self.max_bytes if total <= self.max_bytes else EVICT_TO * self.max_bytes
+        for size, _, paths in sorted(entries.values(), key=lambda entry: entry[1]):
+            if total <= target:
+                break
+            for path in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
+        self._size = total
@@ -1,13 +1,29 @@
 # Author: Jose
 # Python 3.8.1
 
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, NamedTuple
 from collections import defaultdict
+from functools import cached_property
+from pathlib import Path
+import hashlib
+import os
+import pickle
+import re
 import sys
-import data.PKDataset
+import numpy as np
+import data.paths
+from data.BipStore import bips_to_matrix, matrix_to_bips, matrix_to_strings
+from song_transformations.pattern_statistics import PatternStatistics
+from song_transformations import instrumentation
 
+# Where rag_dataset_pattern_extractor() keeps its on-disk cache.
+CACHE_DIR = (Path(__file__).parent / "../../data/cache").resolve()
+# Bump when the format of the cached dataset patterns changes.
+_CACHE_VERSION = 1
 
-def rag_dataset_pattern_extractor(pattern_length=8) -> Dict[int, List[Tuple[int, str]]]:
+
+def rag_dataset_pattern_extractor(pattern_length=8, accept_no_silence_at_start=True, quant_cutoff=.95,
+                                  use_cache=True) -> Dict[int, List[Tuple[int, str]]]:
     """ Gets the rag dataset onset patterns with their occurrence proportion.
 
     The patterns returned correspond to every measure of all the songs in
@@ -21,10 +37,17 @@ def rag_dataset_pattern_extractor(pattern_length=8) -> Dict[int, List[Tuple[int,
           `pattern_length` of 16 (based on its shortest note). If 8 is given
           instead, get_onset_pattern() will fail.
 
+    The result is cached on disk (see load_cached_dataset_patterns()), so
+    only the first call for a given set of arguments goes through the whole
+    dataset; the cache is rebuilt whenever the dataset CSVs change.
+
     Equivalent in Java code:
         Done by reading a cryptic file in the project called "table.csv".
 
     :param int pattern_length: must be a multiple of 8.
+    :param bool accept_no_silence_at_start: passed to get_best_version_of_rag().
+    :param float quant_cutoff: passed to get_best_version_of_rag().
+    :param bool use_cache: whether to read and write the on-disk cache.
     :return: a dictionary mapping number of onsets to each pattern's number
              of occurrences in the dataset over the total occurrences of its
              number of onsets.
@@ -32,32 +55,156 @@ def rag_dataset_pattern_extractor(pattern_length=8) -> Dict[int, List[Tuple[int,
     if pattern_length % 8 != 0:
         sys.exit("The length of patterns must be a multiple of 8.")
 
-    dataset_patterns = {}
+    if use_cache:
+        with instrumentation.stage("corpus_cache_load"):
+            dataset_patterns = load_cached_dataset_patterns(pattern_length, accept_no_silence_at_start,
+                                                            quant_cutoff)
+        if dataset_patterns is not None:
+            return dataset_patterns
+
+    with instrumentation.stage("corpus_loading"):
+        dataset_patterns = rag_dataset_song_patterns(pattern_length, accept_no_silence_at_start, quant_cutoff)
+        dataset_patterns = format_dataset_patterns(dataset_patterns)
+
+    if use_cache:
+        save_cached_dataset_patterns(dataset_patterns, pattern_length, accept_no_silence_at_start, quant_cutoff)
+
+    return dataset_patterns
+
+
+def rag_dataset_song_patterns(pattern_length=8, accept_no_silence_at_start=True,
+                              quant_cutoff=.95) -> Dict[str, List[str]]:
+    """ Gets the melody onset patterns of every song in the rag dataset.
+
+    Uses the best version of each rag (see get_best_version_of_rag()), with
+    its patterns stretched to `pattern_length` as described in
+    rag_dataset_pattern_extractor(). Nothing is cached. The packed 8-bit
+    patterns of all the songs are stretched at once (see
+    BipStore.convert_resolution()); only the few measures whose pattern in
+    the CSV is not 8 long are stretched as strings.
+
+    Called by (depends on) rag_dataset_pattern_extractor(),
+    rag_dataset_statistics().
+
+    :param int pattern_length: must be a multiple of 8.
+    :param bool accept_no_silence_at_start: passed to get_best_version_of_rag().
+    :param float quant_cutoff: passed to get_best_version_of_rag().
+    :return: a mapping of each song ID to its patterns.
+    """
+    import data.PKDataset  # pandas is only needed when the cache can't be used.
     pkdata = data.PKDataset.PKDataset()
-    for title in pkdata.get_all_titles():
-        series = pkdata.get_best_version_of_rag(title,
-                                                accept_no_silence_at_start=True,  # FIXME modify args?
-                                                quant_cutoff=.95)
-        if series is not None:
-            fileid = series['fileid']
-            song_patterns = pkdata.get_melody_bips(fileid)
-            if pattern_length > 8:
-                stretched_song_patterns = []
-                for pattern in song_patterns:
-                    stretched_pattern = ''
-                    for char in pattern:
-                        stretched_pattern += char
-                        stretched_pattern += '0' * (int(pattern_length / 8) - 1)
-                    stretched_song_patterns.append(stretched_pattern)
-                dataset_patterns[fileid] = stretched_song_patterns
-            else:
-                dataset_patterns[fileid] = song_patterns
+    best = pkdata.get_best_versions(accept_no_silence_at_start, quant_cutoff)
+    titles = [title for title in pkdata.get_all_titles() if title in best.index]
+    fileids = list(dict.fromkeys(best.loc[titles, 'fileid']))  # in order of title, as before
 
-    dataset_patterns = format_dataset_patterns(dataset_patterns)
+    packed, offsets, regular = pkdata.get_bips_corpus(fileids, resolution=max(pattern_length, 8))
+    patterns = matrix_to_strings(bips_to_matrix(packed, max(pattern_length, 8)))
+    dataset_patterns = {}
+    for i, fileid in enumerate(fileids):
+        start, end = offsets[i], offsets[i + 1]
+        song_patterns = patterns[start:end]
+        if not regular[start:end].all():
+            stretch = '0' * (pattern_length // 8 - 1)
+            song_patterns = [''.join(char + stretch for char in pattern)
+                             for pattern in pkdata.get_melody_bips(fileid)]
+        dataset_patterns[fileid] = song_patterns
 
     return dataset_patterns
 
 
+def rag_dataset_statistics(pattern_length=8, accept_no_silence_at_start=True,
+                           quant_cutoff=.95) -> PatternStatistics:
+    """ Gets the rag dataset patterns as incrementally updatable statistics.
+
+    Unlike rag_dataset_pattern_extractor(), the raw occurrence counts are
+    kept, so songs can later be added to (or removed from) the statistics
+    without going through the whole dataset again.
+
+    :return: a PatternStatistics, usable as `dataset_patterns`.
+    """
+    if pattern_length % 8 != 0:
+        sys.exit("The length of patterns must be a multiple of 8.")
+    return PatternStatistics(rag_dataset_song_patterns(pattern_length, accept_no_silence_at_start, quant_cutoff))
+
+
+def rag_dataset_ngrams(pattern_length=8, accept_no_silence_at_start=True, quant_cutoff=.95):
+    """ Gets the index of consecutive-measure patterns of the rag dataset.
+
+    Bigram and trigram counts of the patterns of consecutive measures of
+    each song, for lookups such as P(y | previous y) that the per-pattern
+    frequencies of rag_dataset_pattern_extractor() can't answer. Measures
+    whose pattern is not `pattern_length` long are not counted.
+
+    :return: a data.PatternNgrams.PatternNgrams of the packed patterns.
+    """
+    from data.PatternNgrams import PatternNgrams
+    if pattern_length % 8 != 0:
+        sys.exit("The length of patterns must be a multiple of 8.")
+    song_patterns = rag_dataset_song_patterns(pattern_length, accept_no_silence_at_start, quant_cutoff)
+    return PatternNgrams.from_song_patterns(song_patterns, width=pattern_length)
+
+
+def load_cached_dataset_patterns(pattern_length, accept_no_silence_at_start,
+                                 quant_cutoff) -> Dict[int, List[Tuple[int, str]]]:
+    """ Loads the output of rag_dataset_pattern_extractor() from the cache.
+
+    There is one cache file per combination of arguments. Each one stores a
+    fingerprint of the dataset CSVs (size and modification time), so a cache
+    file written before the CSVs changed is ignored (and later overwritten).
+
+    Called by (depends on) rag_dataset_pattern_extractor().
+
+    :return: the cached dataset patterns, or None if there's no valid cache.
+    """
+    cache_file = _dataset_patterns_cache_file(pattern_length, accept_no_silence_at_start, quant_cutoff)
+    try:
+        with open(cache_file, 'rb') as file:
+            cached = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cached.get('fingerprint') != _dataset_fingerprint():
+        return None
+    return cached['dataset_patterns']
+
+
+def save_cached_dataset_patterns(dataset_patterns, pattern_length, accept_no_silence_at_start, quant_cutoff):
+    """ Writes the output of rag_dataset_pattern_extractor() to the cache.
+
+    The file is written under a temporary name and then renamed, so a
+    concurrent reader never sees a partially written cache.
+
+    Called by (depends on) rag_dataset_pattern_extractor().
+    """
+    cache_file = _dataset_patterns_cache_file(pattern_length, accept_no_silence_at_start, quant_cutoff)
+    cached = {'fingerprint': _dataset_fingerprint(), 'dataset_patterns': dataset_patterns}
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_file, 'wb') as file:
+            pickle.dump(cached, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass  # not being able to cache is not an error.
+
+
+def _dataset_patterns_cache_file(pattern_length, accept_no_silence_at_start, quant_cutoff) -> Path:
+    key = repr((_CACHE_VERSION, pattern_length, bool(accept_no_silence_at_start), quant_cutoff))
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return CACHE_DIR / f"rag_patterns_{pattern_length}_{digest}.pkl"
+
+
+def _dataset_fingerprint() -> Tuple:
+    sources = [data.paths.PK_COMPENDIUM_CSV, data.paths.PK_BINARY_ONSET_PATTERNS_CSV]
+    fingerprint = []
+    for source in sources:
+        try:
+            stat = os.stat(source)
+            fingerprint.append((str(source), stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            fingerprint.append((str(source), None, None))
+    return tuple(fingerprint)
+
+
 def format_dataset_patterns(dataset_patterns) -> Dict[int, List[Tuple[int, str]]]:
     """ Extracts useful information from the `dataset_patterns` dictionary.
 
@@ -73,6 +220,9 @@ def format_dataset_patterns(dataset_patterns) -> Dict[int, List[Tuple[int, str]]
           counted (even if the pattern repeats in the same song) to calculate
           the proportions.
 
+    The raw counts are kept by PatternStatistics, which this is a snapshot
+    of; use it directly to add or remove songs without recounting the rest.
+
     Called by (depends on) rag_dataset_pattern_extractor().
 
     :param Dict dataset_patterns: a mapping of each song ID to its patterns.
@@ -80,19 +230,130 @@ def format_dataset_patterns(dataset_patterns) -> Dict[int, List[Tuple[int, str]]
              of occurrences in the dataset over the total occurrences of its
              number of onsets.
     """
-    pattern_occurrences = defaultdict(int)
-    onset_frequencies = defaultdict(int)
-    for patterns in dataset_patterns.values():
-        for pattern in patterns:
-            pattern_occurrences[pattern] += 1
-            onset_frequencies[pattern.count('1')] += 1
+    return PatternStatistics(dataset_patterns).patterns_by_onsets()
+
+
+class XmkSong(object):
+    """ An xmk song, read from its file only once.
+
+    The patterns (for any `pattern_length`), notes and chords of the song are
+    all derived from a single tokenize_xmk() pass and cached, so getting all
+    three (as song_transformer does) doesn't read and parse the file three
+    times. `song` has the song as read_xmk() returns it.
+
+    :param str filename: the xmk file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with instrumentation.stage("xmk_parsing"):
+            self.columns = tokenize_xmk(filename)
+        self.beats_per_measure, self.beat_unit, self.beats_per_minute = self.columns[:3]
+        self._patterns = {}
+
+    @cached_property
+    def song(self) -> Dict[int, List]:
+        return self.columns.to_song()
+
+    def patterns(self, pattern_length=8) -> List[str]:
+        """ Gets all the patterns of the song.
+
+        :param int pattern_length:
+        :return: the list of patterns corresponding to every measure of the song.
+        """
+        if pattern_length not in self._patterns:
+            with instrumentation.stage("onset_patterns"):
+                self._patterns[pattern_length] = song_onset_patterns(self.columns, pattern_length)
+        return self._patterns[pattern_length]
+
+    def _measure_rows(self):
+        """ (measure number, first row, end row) of every measure with notes. """
+        offsets = self.columns.offsets.tolist()
+        for i, measure_number in enumerate(self.columns.measures.tolist()):
+            if offsets[i] < offsets[i + 1]:
+                yield measure_number, offsets[i], offsets[i + 1]
+
+    @cached_property
+    def notes(self) -> Dict[int, List[int]]:
+        """ A dictionary mapping the measure number to its list of MIDI notes. """
+        notes = defaultdict(list)
+        song_notes = self.columns.note.tolist()
+        for measure_number, start, end in self._measure_rows():
+            notes[measure_number] = song_notes[start:end]
+        return notes
+
+    @cached_property
+    def chords(self) -> Dict[int, List[List[int]]]:
+        """ A dictionary mapping the measure number to its list of chords.
+
+        Consecutive onsets with the same chord only count it once.
+        """
+        chords = defaultdict(list)
+        chord_ids = self.columns.chord.tolist()
+        for measure_number, start, end in self._measure_rows():
+            for row in range(start, end):
+                chord = chord_from_id(chord_ids[row])
+                if not chords[measure_number]:
+                    chords[measure_number].append(chord)
+                else:
+                    if chord != chords[measure_number][-1]:
+                        chords[measure_number].append(chord)
+        return chords
+
+
+def song_onset_patterns(columns, pattern_length=8, packed=False):
+    """ Converts every measure of a song into its onset pattern at once.
+
+    Same patterns, checks and error messages as calling get_onset_pattern()
+    on each measure (rests being the notes that are -1), except that the
+    messages start with the number of the offending measure, and that a
+    measure whose zero-length notes push a note to or past `pattern_length`
+    raises the "does not fit" error (get_onset_pattern() returns a longer
+    string for it). Every measure is checked at once and the note positions
+    come from a cumulative sum of the note lengths, instead of building each
+    pattern string note by note.
 
-    patterns_by_onsets = defaultdict(list)
-    for pattern, occurrences in pattern_occurrences.items():
-        onset_total = onset_frequencies[pattern.count('1')]
-        patterns_by_onsets[pattern.count('1')].append((occurrences / onset_total, pattern))
+    Called by (depends on) XmkSong.patterns().
 
-    return patterns_by_onsets
+    :param XmkColumns columns: the song, from tokenize_xmk().
+    :param int pattern_length:
+    :param bool packed: return the patterns packed into integers (see
+                        BipStore.pack_bips()) instead of as strings.
+    :return: the onset pattern of every measure of the song.
+    """
+    num_measures = len(columns.measures)
+    counts = np.diff(columns.offsets)
+    measure_of_row = np.repeat(np.arange(num_measures), counts)
+    numerator, denominator = columns.numerator, columns.denominator
+
+    # Safety checks, for all the measures at once.
+    divisible = pattern_length % np.maximum(denominator, 1) == 0
+    amount_held = (pattern_length / np.maximum(denominator, 1)) * numerator
+    fraction_sum = np.bincount(measure_of_row, weights=amount_held, minlength=num_measures)
+    not_divisible = np.bincount(measure_of_row, weights=~divisible, minlength=num_measures) > 0
+
+    # Where each note starts in its measure: every note takes at least one position (as in get_onset_pattern()).
+    lengths = np.maximum(amount_held.astype(np.int64), 1)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths - np.repeat(np.concatenate([[0], ends])[columns.offsets[:-1]], counts)
+    # Zero-length notes can push the notes after them out of the pattern.
+    overflow = np.bincount(measure_of_row, weights=starts >= pattern_length, minlength=num_measures) > 0
+
+    bad = not_divisible | (fraction_sum > pattern_length) | overflow
+    if bad.any():
+        i = int(np.argmax(bad))  # the first bad measure, as when checking them in order.
+        if not_divisible[i]:
+            message = "Onsets cannot be evenly divided."
+        else:
+            message = f"Onset pattern does not fit in {pattern_length} characters."
+        raise ValueError(f"Measure {columns.measures[i]}: {message}")
+    onsets = columns.note != -1
+
+    matrix = np.zeros((num_measures, pattern_length), dtype=np.uint8)
+    matrix[measure_of_row[onsets], starts[onsets]] = 1
+    if packed:
+        return matrix_to_bips(matrix)
+    return matrix_to_strings(matrix)
 
 
 def song_patterns_extractor(filename, pattern_length=8) -> List[str]:
@@ -102,17 +363,7 @@ def song_patterns_extractor(filename, pattern_length=8) -> List[str]:
     :param int pattern_length:
     :return: the list of patterns corresponding to every measure of the song.
     """
-    _, _, _, song = read_xmk(filename)
-    song_patterns = []
-    for measure in song.values():
-        # If note is a rest (-1), signal it by making its note value negative.
-        note_values = [line[0] if line[1] != -1 else (-line[0][0], -line[0][1]) for line in measure]
-        try:
-            measure_pattern = get_onset_pattern(note_values, pattern_length)
-        except ValueError:
-            raise  # relays error message.
-        song_patterns.append(measure_pattern)
-    return song_patterns
+    return XmkSong(filename).patterns(pattern_length)
 
 
 def get_onset_pattern(note_values, pattern_length=8) -> str:
@@ -136,7 +387,8 @@ def get_onset_pattern(note_values, pattern_length=8) -> str:
           `pattern_length`. This function does not, however, directly guarantee
           that the time signature of the underlying song is respected!
 
-    Called by (depends on) song_patterns_extractor().
+    XmkSong uses song_onset_patterns() instead, which gives the same patterns
+    for all the measures of a song at once.
 
     Equivalent in Java code:
         Optimized version of MeasureAnalyzer.getRhythm() in
@@ -187,13 +439,7 @@ def get_song_notes(filename) -> Dict[int, List[int]]:
     :param str filename: the xmk file.
     :return: a dictionary mapping the measure number to its list of notes.
     """
-    _, _, _, song = read_xmk(filename)
-    notes = defaultdict(list)
-    for measure_number, measure in song.items():
-        for onset in measure:
-            note = onset[1]
-            notes[measure_number].append(note)
-    return notes
+    return XmkSong(filename).notes
 
 
 def get_song_chords(filename) -> Dict[int, List[List[int]]]:
@@ -202,17 +448,7 @@ def get_song_chords(filename) -> Dict[int, List[List[int]]]:
     :param str filename: the xmk file.
     :return: a dictionary mapping the measure number to its list of chords.
     """
-    _, _, _, song = read_xmk(filename)
-    chords = defaultdict(list)
-    for measure_number, measure in song.items():
-        for onset in measure:
-            chord = onset[2]
-            if not chords[measure_number]:
-                chords[measure_number].append(chord)
-            else:
-                if chord != chords[measure_number][-1]:
-                    chords[measure_number].append(chord)
-    return chords
+    return XmkSong(filename).chords
 
 
 def read_xmk(filename) -> Tuple[int, int, int, Dict[int, List]]:
@@ -260,44 +496,173 @@ def read_xmk(filename) -> Tuple[int, int, int, Dict[int, List]]:
                 line = line.split()
                 note_duration = tuple(map(int, line[0].split('/')))
                 note = int(line[1])
-                chord = []
-
-                if line[2] == "-1":
-                    chord = -1
-                elif '[' not in line[2]:
-                    chord_root = int(line[2])
-                    chord.append(chord_root)
-                    chord.append(chord_root + 4)
-                    chord.append(chord_root + 7)
-                else:
-                    modifier_index = line[2].index("[")
-                    chord_root = int(line[2][:modifier_index])
-                    chord.append(chord_root)
-                    chord.append(chord_root + 4)
-                    chord.append(chord_root + 7)
-
-                    modifiers = line[2][modifier_index+1:]
-                    if 'm' in modifiers:    # minor
-                        chord[1] = chord_root + 3
-                    elif '2' in modifiers:  # sus2
-                        chord[1] = chord_root + 2
-                    elif '4' in modifiers:  # sus4
-                        chord[1] = chord_root + 5
-                    elif 'd' in modifiers:    # diminished
-                        chord[1] = chord_root + 3
-                        chord[2] = chord_root + 6
-                    elif 'a' in modifiers:  # augmented
-                        chord[2] = chord_root + 8
-                    if '6' in modifiers:    # six
-                        chord.append(chord_root + 8)
-                    if '7' in modifiers:    # seven
-                        chord.append(chord_root + 10)
+                chord = get_chord(line[2])
 
                 onset = [note_duration, note, chord]
                 song[measure].append(onset)
     return beats_per_measure, beat_unit, beats_per_minute, song
 
 
+def get_chord(token):
+    """ Gets the MIDI notes of a chord as written in an xmk file.
+
+    Called by (depends on) read_xmk(), chord_id().
+
+    :param str token: the third column of an xmk line: a root ("48"), a root
+                      with modifiers ("53[m7") or "-1" for no chord.
+    :return: the list of MIDI notes of the chord, or -1 for no chord.
+    """
+    chord = []
+
+    if token == "-1":
+        chord = -1
+    elif '[' not in token:
+        chord_root = int(token)
+        chord.append(chord_root)
+        chord.append(chord_root + 4)
+        chord.append(chord_root + 7)
+    else:
+        modifier_index = token.index("[")
+        chord_root = int(token[:modifier_index])
+        chord.append(chord_root)
+        chord.append(chord_root + 4)
+        chord.append(chord_root + 7)
+
+        modifiers = token[modifier_index+1:]
+        if 'm' in modifiers:    # minor
+            chord[1] = chord_root + 3
+        elif '2' in modifiers:  # sus2
+            chord[1] = chord_root + 2
+        elif '4' in modifiers:  # sus4
+            chord[1] = chord_root + 5
+        elif 'd' in modifiers:    # diminished
+            chord[1] = chord_root + 3
+            chord[2] = chord_root + 6
+        elif 'a' in modifiers:  # augmented
+            chord[2] = chord_root + 8
+        if '6' in modifiers:    # six
+            chord.append(chord_root + 8)
+        if '7' in modifiers:    # seven
+            chord.append(chord_root + 10)
+    return chord
+
+
+# Chord table shared by every song tokenized by tokenize_xmk(): each distinct
+# raw chord token is parsed by get_chord() once and given an id.
+_CHORD_IDS = {}  # chord token -> chord id
+_CHORDS = []     # chord id -> get_chord(token)
+
+
+def chord_id(token) -> int:
+    """ The id of a raw xmk chord token in the chord table (added if new). """
+    if token not in _CHORD_IDS:
+        _CHORD_IDS[token] = len(_CHORDS)
+        _CHORDS.append(get_chord(token))
+    return _CHORD_IDS[token]
+
+
+def chord_from_id(chord_id):
+    """ The chord (as returned by get_chord()) with id `chord_id`. """
+    chord = _CHORDS[chord_id]
+    return chord if chord == -1 else list(chord)
+
+
+# One non-blank xmk line after the header: a note ("1/4<tab>60<tab>48[m"),
+# the end ("=end") or a measure number ("=12"). Any other line is captured
+# by the last group, so it can be reported instead of skipped.
+_XMK_LINE_RE = re.compile(r"^[ \t]*(?:(\d+)/(\d+)[ \t]+(-?\d+)[ \t]+(\S+)[^\n]*|=end[^\n]*|=[ \t]*(-?\d+)[ \t]*$"
+                          r"|(\S[^\n]*))", re.MULTILINE)
+
+
+class XmkColumns(NamedTuple):
+    """ An xmk song as columns, one row per note (or rest), in song order. """
+    beats_per_measure: int
+    beat_unit: int
+    beats_per_minute: int
+    measures: np.ndarray     # measure numbers, in the order of the song.
+    offsets: np.ndarray      # the rows of measures[i] are offsets[i]:offsets[i+1].
+    measure: np.ndarray      # measure number of each row.
+    numerator: np.ndarray    # note value numerator (1 in "1/4").
+    denominator: np.ndarray  # note value denominator (4 in "1/4").
+    note: np.ndarray         # MIDI note, -1 for a rest.
+    chord: np.ndarray        # chord id, see chord_from_id().
+
+    def to_song(self) -> Dict[int, List]:
+        """ The song in the format of read_xmk(). """
+        song = {}
+        numerators, denominators, notes, chords = (self.numerator.tolist(), self.denominator.tolist(),
+                                                   self.note.tolist(), self.chord.tolist())
+        for i, measure in enumerate(self.measures.tolist()):
+            song[measure] = [[(numerators[row], denominators[row]), notes[row], chord_from_id(chords[row])]
+                             for row in range(self.offsets[i], self.offsets[i + 1])]
+        return song
+
+
+def tokenize_xmk(filename) -> XmkColumns:
+    """ Reads an xmk file into columns, in bulk.
+
+    Gives the same song as read_xmk() (XmkColumns.to_song() is equal to its
+    output), but the whole file is split by a single regular expression and
+    each distinct chord token is only parsed once (see chord_id()), so it
+    is faster for reading many songs (about 1.5x on long songs, most of the
+    time going into the regular expression), and the columns can be worked
+    on with numpy directly. Like read_xmk(), it fails on a line that is not
+    a note or a measure marker (a ValueError naming the line); blank lines
+    are skipped.
+
+    :param str filename: the xmk song.
+    :return: the song's columns.
+    """
+    with open(filename) as file:
+        header = get_time_signature(file.readline())
+        text = file.read()
+    rows = _XMK_LINE_RE.findall(text)
+
+    numerators, denominators, notes, tokens, markers, others = zip(*rows) if rows else ((),) * 6
+    if any(others):
+        # read_xmk() fails on these lines too; don't build a song without them.
+        match = next(match for match in _XMK_LINE_RE.finditer(text) if match.group(6))
+        line_number = text.count('\n', 0, match.start()) + 2  # the header is line 1
+        raise ValueError(f"{filename}: line {line_number} is not a note or a measure: {match.group(6)!r}")
+    is_marker = np.fromiter(map(bool, markers), dtype=bool, count=len(rows))
+    is_note = np.fromiter(map(bool, numerators), dtype=bool, count=len(rows))
+    marker_numbers = _to_ints(markers)
+    owner = (np.cumsum(is_marker) - 1)[is_note]  # index of the measure marker above each note
+    if len(owner) and owner[0] < 0:
+        raise ValueError(f"{filename}: note before the first measure.")
+    columns = [_to_ints(numerators), _to_ints(denominators), _to_ints(notes),
+               np.fromiter(map(chord_id, filter(None, tokens)), dtype=np.int32)]
+
+    measures, first_marker, position = np.unique(marker_numbers, return_index=True, return_inverse=True)
+    position = position.reshape(-1)
+    if len(measures) == len(marker_numbers):
+        measures = marker_numbers
+        note_counts = np.bincount(owner, minlength=len(measures))
+    else:
+        # As in read_xmk(), a measure number seen again starts that measure over (only the notes after
+        # its last marker count) but keeps its place in the song.
+        last_marker = np.full(len(measures), -1)
+        np.maximum.at(last_marker, position, np.arange(len(marker_numbers)))
+        keep = last_marker[position[owner]] == owner
+        order = np.argsort(first_marker, kind='stable')  # measures in order of first appearance
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        note_rank = rank[position[owner[keep]]]
+        rows_order = np.argsort(note_rank, kind='stable')
+        columns = [column[keep][rows_order] for column in columns]
+        measures = measures[order]
+        note_counts = np.bincount(note_rank, minlength=len(measures))
+
+    offsets = np.concatenate([[0], np.cumsum(note_counts)]).astype(np.int64)
+    return XmkColumns(header[0], header[1], header[2], measures, offsets, np.repeat(measures, note_counts),
+                      *columns)
+
+
+def _to_ints(column) -> np.ndarray:
+    """ The non-empty strings of a regular expression group, as integers (parsed by numpy in one call). """
+    return np.array(' '.join(column).split(), dtype=np.int64)
+
+
 def get_time_signature(line) -> List[int]:
     """ Gets the information at the top of the xmk file.
 
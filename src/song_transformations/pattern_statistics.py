@@ -0,0 +1,99 @@
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Tuple
+
+
+class PatternStatistics(Mapping):
+    """ Incrementally maintained pattern occurrence statistics of a corpus.
+
+    Keeps the raw counts that format_dataset_patterns() normalizes away: the
+    number of occurrences of every pattern and the total number of patterns
+    with each number of onsets, along with the patterns of every song, so
+    songs can be added and removed in O(patterns in that song) without going
+    through the rest of the corpus again.
+
+    It is also a read-only mapping from number of onsets to the list of
+    (proportion, pattern) that format_dataset_patterns() would return for the
+    current songs, so it can be passed anywhere a `dataset_patterns` is
+    expected (RuleSampler notices when it changes, see `version`). Each list
+    is built on first use after a change to its number of onsets; the other
+    lists stay cached.
+
+    :param Dict dataset_patterns: optional mapping of song ID to its patterns
+                                  to start with.
+    """
+
+    def __init__(self, dataset_patterns: Dict[str, List[str]] = None):
+        self.occurrences = {}                # pattern -> number of occurrences
+        self.onset_totals = {}               # number of onsets -> number of occurrences
+        self.songs = {}                      # song ID -> its patterns
+        self.version = 0                     # incremented on every change
+        self._by_onsets = {}                 # number of onsets -> {pattern: occurrences}
+        self._tables = {}                    # number of onsets -> [(proportion, pattern)]
+        if dataset_patterns is not None:
+            for song_id, patterns in dataset_patterns.items():
+                self.add_song(song_id, patterns)
+
+    def add_song(self, song_id, patterns: Iterable[str]):
+        """ Count the patterns of a song (replacing it if it was already counted). """
+        if song_id in self.songs:
+            self.remove_song(song_id)
+        patterns = list(patterns)
+        self.songs[song_id] = patterns
+        for pattern in patterns:
+            num_onsets = pattern.count('1')
+            self.occurrences[pattern] = self.occurrences.get(pattern, 0) + 1
+            self.onset_totals[num_onsets] = self.onset_totals.get(num_onsets, 0) + 1
+            bucket = self._by_onsets.setdefault(num_onsets, {})
+            bucket[pattern] = bucket.get(pattern, 0) + 1
+            self._tables.pop(num_onsets, None)
+        self.version += 1
+
+    def remove_song(self, song_id):
+        """ Stop counting the patterns of a song. Raises KeyError if it isn't counted. """
+        patterns = self.songs.pop(song_id)
+        for pattern in patterns:
+            num_onsets = pattern.count('1')
+            self._decrement(self.occurrences, pattern)
+            self._decrement(self.onset_totals, num_onsets)
+            bucket = self._by_onsets[num_onsets]
+            self._decrement(bucket, pattern)
+            if not bucket:
+                del self._by_onsets[num_onsets]
+            self._tables.pop(num_onsets, None)
+        self.version += 1
+
+    @staticmethod
+    def _decrement(counts, key):
+        if counts[key] == 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
+
+    def proportion(self, pattern) -> float:
+        """ Occurrences of a pattern over the occurrences of its number of onsets (0 if never seen). """
+        occurrences = self.occurrences.get(pattern, 0)
+        if occurrences == 0:
+            return 0.0
+        return occurrences / self.onset_totals[pattern.count('1')]
+
+    def __getitem__(self, num_onsets) -> List[Tuple[float, str]]:
+        if num_onsets not in self._tables:
+            bucket = self._by_onsets[num_onsets]  # KeyError for an unseen number of onsets, as a dict would
+            onset_total = self.onset_totals[num_onsets]
+            self._tables[num_onsets] = [(occurrences / onset_total, pattern)
+                                        for pattern, occurrences in bucket.items()]
+        return self._tables[num_onsets]
+
+    def __iter__(self):
+        return iter(self._by_onsets)
+
+    def __len__(self):
+        return len(self._by_onsets)
+
+    def patterns_by_onsets(self) -> Dict[int, List[Tuple[float, str]]]:
+        """ A snapshot in the format of format_dataset_patterns(). """
+        patterns_by_onsets = defaultdict(list)
+        for num_onsets in self:
+            patterns_by_onsets[num_onsets] = list(self[num_onsets])
+        return patterns_by_onsets
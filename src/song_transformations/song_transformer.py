@@ -1,47 +1,232 @@
 # Author: Jose
 # Python 3.8.1
 
-from os import listdir
-from os.path import join
+from os import listdir, makedirs
+from os.path import join, basename, splitext
+from typing import Dict, NamedTuple, Optional
+import argparse
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
 from song_transformations.pattern_extractors import *
-from song_transformations.algorithm_1 import algorithm_1
-import music21
+from song_transformations.algorithm_1 import algorithm_1, generate_rules, build_score, RuleSampler
+from song_transformations.midi_writer import write_midi
+from song_transformations import instrumentation
+from song_transformations.output_cache import OutputCache, corpus_hash, song_seed, DEFAULT_MAX_BYTES
 
+# Possible outcomes of transforming a song.
+SUCCESS = "success"
+INVALID_SONG = "invalid song"  # song_onset_patterns() raised a ValueError.
+NO_RULE_POSSIBLE = "no rule possible"
 
-# Move all code here that deals with a single file, not all of them
-def song_transformer(filename):
-    pass
+# File extension for each output format: the ones accepted by music21's
+# Score.write(), plus "fastmidi" (midi_writer.write_midi(), no music21 score).
+OUTPUT_EXTENSIONS = {"midi": ".mid", "musicxml": ".musicxml", "fastmidi": ".mid"}
+
+
+class TransformResult(NamedTuple):
+    filename: str
+    status: str
+    message: str = ""
+    output: Optional[str] = None
+    metrics: Optional[Dict] = None  # the song's instrumentation, when transform_batch() is instrumented.
+
+
+def song_transformer(filename, dataset_patterns, pattern_length=8, output_dir=None, output_format="midi",
+                     rule_sampler=None, rng=None, cache=None) -> TransformResult:
+    """ Transform a single xmk song.
+
+    :param str filename: the xmk file.
+    :param Dict dataset_patterns: output of rag_dataset_pattern_extractor().
+    :param int pattern_length: must be a multiple of 8.
+    :param str output_dir: if given, the new song is written there, named
+                           after the xmk file.
+    :param str output_format: "midi", "musicxml" or "fastmidi".
+    :param RuleSampler rule_sampler: shared rule candidates, if any.
+    :param rng: seed, numpy.random.SeedSequence or numpy.random.Generator for
+                the rules (default: the global numpy random state).
+    :param OutputCache cache: if given, a song already transformed with the
+                              same content, corpus, pattern_length, seed and
+                              format is copied from the cache instead (only
+                              for a seed or SeedSequence `rng`, see
+                              output_cache.seed_key()), and new ones are added.
+    :return: the status of the transformation (and where the output went).
+    """
+    with instrumentation.song(filename):
+        return _song_transformer(filename, dataset_patterns, pattern_length, output_dir, output_format,
+                                 rule_sampler, rng, cache)
+
+
+def _song_transformer(filename, dataset_patterns, pattern_length, output_dir, output_format,
+                      rule_sampler, rng, cache) -> TransformResult:
+    extension = OUTPUT_EXTENSIONS[output_format]
+    output = None
+    if output_dir is not None:
+        output = join(output_dir, splitext(basename(filename))[0] + extension)
+
+    cache_key = cache.key(filename, pattern_length, rng, output_format) if cache is not None else None
+    if cache_key is not None:
+        cached = cache.get(cache_key, extension)
+        if cached is not None:
+            instrumentation.count("cache_hits")
+            if output is not None:
+                shutil.copyfile(cached[0], output)
+            return TransformResult(filename, SUCCESS, "from cache", output)
+
+    song = XmkSong(filename)  # the file is read only once
+    try:
+        # Big performance bottleneck: ~O( ??? * n^???)
+        song_patterns = song.patterns(pattern_length)
+    except ValueError as error:
+        return TransformResult(filename, INVALID_SONG, str(error))
+
+    rules = generate_rules(song_patterns, dataset_patterns, pattern_length, rule_sampler, rng)
+    if not rules:
+        return TransformResult(filename, NO_RULE_POSSIBLE, "No rule could be generated for any measure.")
+
+    # Without an output file, the song is still written (to a temporary file) if it goes in the cache.
+    target = output
+    if target is None and cache_key is not None:
+        handle, target = tempfile.mkstemp(suffix=extension)
+        os.close(handle)
+    try:
+        if output_format == "fastmidi":
+            if target is not None:
+                write_midi(target, song.notes, song.chords, song_patterns, rules, song.beats_per_minute)
+        else:
+            new_song = build_score(song.notes, song.chords, song_patterns, rules)
+            if target is not None:
+                with instrumentation.stage("output_writing"):
+                    new_song.write(output_format, fp=target)
+        if cache_key is not None:
+            cache.put(cache_key, extension, target, rules)
+    finally:
+        if target is not None and target != output:
+            os.remove(target)
+    return TransformResult(filename, SUCCESS, output=output)
+
+
+def transform_batch(xmk_dir, output_dir, pattern_length=8, output_format="midi", processes=None, seed=None,
+                    cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES):
+    """ Transform every xmk song in a directory, in parallel and headless.
+
+    The rag dataset patterns are loaded once in this process and handed to
+    the worker processes when they start (with fork they are simply shared
+    memory pages), so each worker only parses, transforms and writes songs.
+
+    :param str xmk_dir: directory with the input xmk songs.
+    :param str output_dir: directory where the new songs are written.
+    :param int pattern_length: must be a multiple of 8.
+    :param str output_format: "midi", "musicxml" or "fastmidi".
+    :param int processes: number of worker processes (default: one per core).
+    :param int seed: if given, every song gets its own random stream,
+                     derived from the seed and the song's content (see
+                     output_cache.song_seed()), so the output is the same
+                     whichever worker transforms which song and whatever
+                     other files are in the directory.
+    :param str cache_dir: if given (and with a seed), keep the new songs in
+                          an OutputCache there and reuse the ones already in it.
+    :param int cache_max_bytes: size cap of the cache.
+    :return: a list with the TransformResult of every song.
+
+    If instrumentation is enabled, the workers record each song's metrics
+    and they are merged into the current instrumentation.Metrics.
+    """
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    makedirs(output_dir, exist_ok=True)
+    dataset_patterns = rag_dataset_pattern_extractor(pattern_length)
+    filenames = [join(xmk_dir, song_file) for song_file in sorted(listdir(xmk_dir)) if song_file.endswith(".xmk")]
+    if seed is None:
+        song_seeds = [None] * len(filenames)
+    else:
+        song_seeds = [song_seed(seed, filename) for filename in filenames]
+
+    cache = None
+    if cache_dir is not None:
+        cache = OutputCache(cache_dir, corpus_hash(dataset_patterns), cache_max_bytes)
+
+    metrics = instrumentation.current()
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(dataset_patterns, pattern_length, output_dir, output_format,
+                                        metrics is not None, cache)) as pool:
+        results = pool.starmap(_transform_worker, zip(filenames, song_seeds), chunksize=1)
+
+    if metrics is not None:
+        for result in results:
+            if result.metrics is not None:
+                metrics.add_song(result.filename, result.metrics)
+
+    for result in results:
+        if result.status != SUCCESS:
+            logging.warning(f"In {basename(result.filename)}: {result.status}: {result.message}")
+    return results
+
+
+# Read-only state of each worker process of transform_batch().
+_worker_state = {}
+
+
+def _init_worker(dataset_patterns, pattern_length, output_dir, output_format, instrumented=False, cache=None):
+    if instrumented:
+        instrumentation.enable()
+    else:
+        instrumentation.disable()  # a forked worker would otherwise inherit the parent's Metrics.
+    _worker_state["dataset_patterns"] = dataset_patterns
+    _worker_state["pattern_length"] = pattern_length
+    _worker_state["output_dir"] = output_dir
+    _worker_state["output_format"] = output_format
+    _worker_state["rule_sampler"] = RuleSampler(dataset_patterns, pattern_length)
+    _worker_state["cache"] = cache
+
+
+def _transform_worker(filename, seed_sequence=None) -> TransformResult:
+    try:
+        result = song_transformer(filename, _worker_state["dataset_patterns"], _worker_state["pattern_length"],
+                                  _worker_state["output_dir"], _worker_state["output_format"],
+                                  _worker_state["rule_sampler"], seed_sequence, _worker_state["cache"])
+    except Exception as error:  # one bad song shouldn't take down the whole batch.
+        result = TransformResult(filename, type(error).__name__, str(error))
+    metrics = instrumentation.current()
+    if metrics is not None:
+        result = result._replace(metrics=metrics.songs.pop(filename, None))
+    return result
 
 
 # Just in case this module is ran by itself: transform
 # all xmk songs at once. These are the input (classical) songs
-def main(pattern_length=8):
+def main(xmk_dir, pattern_length=8, seed=None):
     """
 
+    :param str xmk_dir: directory with the input xmk songs.
     :param int pattern_length: must be a multiple of 8 (that is the size used
                                by the rag dataset patterns).
+    :param int seed: makes the generated songs reproducible.
     :return:
     """
-    xmk_dir = "/Users/jose/Documents/Rhodes/Year_4/Research/Midireader/midiReader/input/xm"
     # Big operation: ~O( ??? * n^???)
     dataset_patterns = rag_dataset_pattern_extractor(pattern_length)
+    # Eligible rule candidates are shared by all the songs.
+    rule_sampler = RuleSampler(dataset_patterns, pattern_length)
+    rng = np.random.default_rng(seed) if seed is not None else None
     for song_file in listdir(xmk_dir):
         if song_file.endswith(".xmk"):
             filename = join(xmk_dir, song_file)
+            song = XmkSong(filename)  # the file is read only once
             try:
                 # Big performance bottleneck: ~O( ??? * n^???)
-                song_patterns = song_patterns_extractor(filename, pattern_length)
+                song_patterns = song.patterns(pattern_length)
             except ValueError as error:
                 logging.warning(f"In {filename.split('/')[-1]}: {error}")
                 continue
 
             # compare_with_java_patterns(song_file, song_patterns)
 
-            song_notes = get_song_notes(filename)
-            song_chords = get_song_chords(filename)
-
-            new_song = algorithm_1(song_notes, song_chords, song_patterns, dataset_patterns, pattern_length)
+            new_song = algorithm_1(song.notes, song.chords, song_patterns, dataset_patterns, pattern_length,
+                                   rule_sampler, rng)
             new_song.show()
 
     return 0
@@ -146,7 +331,30 @@ def compare_with_java_patterns(song, patterns):
 
 
 if __name__ == '__main__':
-    main(16)
+    parser = argparse.ArgumentParser(description="Transform classical xmk songs into ragtime.")
+    parser.add_argument("xmk_dir", help="directory with the input xmk songs")
+    parser.add_argument("--output-dir", help="write the new songs here (headless, in parallel) instead of "
+                                             "showing them")
+    parser.add_argument("--pattern-length", type=int, default=16)
+    parser.add_argument("--format", default="midi", choices=sorted(OUTPUT_EXTENSIONS))
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None, help="make the generated songs reproducible")
+    parser.add_argument("--cache-dir", help="with --seed, reuse songs already transformed (kept in this directory)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // 2**20,
+                        help="size cap of the cache, in MiB (default %(default)s)")
+    parser.add_argument("--metrics", help="record per-stage timings and counters and write them to this file "
+                                          "(Prometheus text if it ends in .prom, JSON otherwise)")
+    args = parser.parse_args()
+    metrics = instrumentation.enable() if args.metrics else None
+    if args.output_dir is None:
+        main(args.xmk_dir, args.pattern_length, args.seed)
+    else:
+        for result in transform_batch(args.xmk_dir, args.output_dir, args.pattern_length, args.format,
+                                      args.processes, args.seed, args.cache_dir, args.cache_size * 2**20):
+            print(f"{basename(result.filename)}: {result.status}")
+    if metrics is not None:
+        with open(args.metrics, "w") as file:
+            file.write(metrics.to_prometheus() if args.metrics.endswith(".prom") else metrics.to_json(indent=2))
 
 
 # Not used (but functional) #
@@ -0,0 +1,124 @@
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+from song_transformations import instrumentation
+from song_transformations.algorithm_1 import RuleSampler, build_score
+
+
+class Variant(NamedTuple):
+    rules: Dict[str, str]  # song patterns x mapped to dataset patterns y.
+    draws: List            # the seeds (or draw numbers, when a count was given) that gave these rules.
+    output: Any            # what `render` returned for these rules.
+
+
+def draw_rule_sets(song_patterns, dataset_patterns, pattern_length, count=None, seeds=None,
+                   rule_sampler=None, rng=None) -> Tuple[List[str], List[List[str]], np.ndarray]:
+    """ Draw many rule sets for a song at once.
+
+    The alias tables of all the song's patterns (see RuleSampler) are laid
+    end to end, so drawing the y of every pattern x for every rule set is a
+    handful of numpy operations on a (rule sets, patterns) array, rather than
+    one generate_rules() call per rule set. The random floats are taken in
+    the same order as generate_rules() takes them (see AliasSampler), so a
+    seed gives the same rules here as in generate_rules() (and so in
+    song_transformer()), and `count` rule sets drawn from a Generator are
+    the rules of `count` generate_rules() calls in a row with it.
+
+    :param List song_patterns: the song's onset patterns, one per measure.
+    :param Dict dataset_patterns: output of rag_dataset_pattern_extractor().
+    :param int pattern_length:
+    :param int count: number of rule sets, drawn from `rng`. Give either
+                      `count` or `seeds`.
+    :param Sequence seeds: one rule set per seed, each drawn from
+                           numpy.random.default_rng(seed), so the same seed
+                           always gives the same rule set.
+    :param RuleSampler rule_sampler: shared rule candidates, if any.
+    :param rng: seed or numpy.random.Generator used with `count` (default:
+                the global numpy random state).
+    :return: a tuple containing
+             - the song patterns x for which a rule is possible, in order of
+               appearance.
+             - the candidates y of each of them.
+             - a (rule sets, len(x's)) array with the index of the candidate
+               chosen for each x in each rule set.
+    """
+    if (count is None) == (seeds is None):
+        raise ValueError("Give either a count or a list of seeds.")
+    if rule_sampler is None:
+        rule_sampler = RuleSampler(dataset_patterns, pattern_length)
+    num_rule_sets = count if count is not None else len(seeds)
+
+    with instrumentation.stage("rule_generation"):
+        unique_song_patterns = list(dict.fromkeys(song_patterns))  # in order of appearance.
+        instrumentation.count("unique_patterns", len(unique_song_patterns))
+        rule_sampler.precompute(unique_song_patterns)
+        xs = [x for x in unique_song_patterns if rule_sampler.get_sampler(x) is not None]
+        samplers = [rule_sampler.get_sampler(x) for x in xs]
+        if not xs:
+            return xs, [], np.zeros((num_rule_sets, 0), dtype=np.int64)
+
+        sizes = np.array([len(sampler) for sampler in samplers])
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        prob = np.concatenate([sampler.prob for sampler in samplers])
+        alias = np.concatenate([sampler.alias + start for sampler, start in zip(samplers, starts)])
+
+        def draw(uniform, rows):
+            # uniform(shape) -> floats in [0, 1); two per (rule set, x), as in AliasSampler.sample().
+            u = uniform((rows, len(xs), 2))
+            i = starts + np.minimum((u[..., 0] * sizes).astype(np.int64), sizes - 1)
+            keep = u[..., 1] < prob[i]
+            return np.where(keep, i, alias[i]) - starts
+
+        if seeds is None:
+            uniform = np.random.default_rng(rng).random if rng is not None else np.random.random_sample
+            choices = draw(uniform, num_rule_sets)
+        else:
+            choices = np.vstack([draw(np.random.default_rng(seed).random, 1) for seed in seeds])
+        instrumentation.count("sampling_attempts", choices.size)
+        instrumentation.count("rules_generated", choices.size)
+    return xs, [sampler.items for sampler in samplers], choices
+
+
+def song_variants(song, dataset_patterns, pattern_length, count=None, seeds=None, rule_sampler=None,
+                  render: Optional[Callable] = None, rng=None) -> Iterator[Variant]:
+    """ Generate distinct variants of one song, lazily.
+
+    All the rule sets are drawn at once (see draw_rule_sets()), identical
+    ones are merged and only the distinct ones are rendered, one at a time as
+    the generator is consumed (nothing is done before the first one is asked
+    for), so variants can be streamed to disk (or to a scorer) without
+    keeping them all in memory. Variants come in the order of the first draw
+    that produced them. Nothing is yielded if no rule is possible for any of
+    the song's patterns (what song_transformer() reports as
+    NO_RULE_POSSIBLE).
+
+    :param XmkSong song: the parsed input song.
+    :param Dict dataset_patterns: output of rag_dataset_pattern_extractor().
+    :param int pattern_length: must be a multiple of 8.
+    :param int count: number of rule sets to draw (fewer variants come out
+                      if some are the same).
+    :param Sequence seeds: draw one rule set per seed instead.
+    :param RuleSampler rule_sampler: shared rule candidates, if any.
+    :param Callable render: called as render(song.notes, song.chords,
+                            song_patterns, rules); defaults to build_score()
+                            (e.g. pass a function calling
+                            midi_writer.write_midi() to write files instead).
+    :param rng: seed or numpy.random.Generator to draw the `count` rule sets
+                from.
+    :return: a generator of Variants.
+    """
+    if render is None:
+        render = build_score
+    song_patterns = song.patterns(pattern_length)  # ValueError for invalid songs, as in song_transformer()
+    xs, candidates, choices = draw_rule_sets(song_patterns, dataset_patterns, pattern_length, count, seeds,
+                                             rule_sampler, rng)
+    draw_ids = list(seeds) if seeds is not None else list(range(count))
+    if len(draw_ids) == 0 or not xs:
+        return
+
+    distinct, first_draws, inverse = np.unique(choices, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    draws_of = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse))[:-1])
+    for row in np.argsort(first_draws):
+        rules = {x: candidates[j][k] for j, (x, k) in enumerate(zip(xs, distinct[row]))}
+        yield Variant(rules, [draw_ids[i] for i in draws_of[row]],
+                      render(song.notes, song.chords, song_patterns, rules))
@@ -0,0 +1,5 @@
+# The tests import the packages the way the scripts do, from src/.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,41 @@
+from itertools import product
+
+import numpy as np
+
+from song_transformations.algorithm_1 import RuleSampler, generate_rules, onset_distance, onset_distances
+
+DATASET_PATTERNS = {
+    2: [(0.5, '10001000'), (0.3, '10100000'), (0.2, '00101000')],
+    3: [(0.4, '10101000'), (0.4, '10001010'), (0.2, '11000100')],
+}
+
+
+def test_generate_rules_only_eligible_rules():
+    song_patterns = ['10001000', '10101000', '10100000', '11111111']
+    rules = generate_rules(song_patterns, DATASET_PATTERNS, 8, rng=1)
+    assert '11111111' not in rules  # no dataset pattern with 8 onsets
+    for x, y in rules.items():
+        assert x != y
+        assert x.count('1') == y.count('1')
+        assert onset_distance(x, y) <= 8 / 2
+
+
+def test_no_rule_possible_is_not_printed(capsys):
+    assert generate_rules(['11111111'], DATASET_PATTERNS, 8, rng=1) == {}
+    assert "No rule possible" not in capsys.readouterr().out
+
+
+def test_candidates_follow_dataset_proportions():
+    sampler = RuleSampler(DATASET_PATTERNS, 8)
+    assert sampler.candidates('10001000') == [(0.3, '10100000'), (0.2, '00101000')]
+    draws = [sampler.sample('10001000', rng) for rng in [np.random.default_rng(0)] for _ in range(5000)]
+    assert abs(draws.count('10100000') / len(draws) - 0.6) < 0.03
+
+
+def test_onset_distances_match_onset_distance():
+    patterns = [''.join(bits) for bits in product('01', repeat=6) if bits.count('1') == 3]
+    distances = onset_distances(patterns, patterns, 6)
+    for i, p in enumerate(patterns):
+        for j, q in enumerate(patterns):
+            assert distances[i, j] == onset_distance(p, q)
+    assert list(onset_distances(patterns[0], patterns, 6)) == list(distances[0])
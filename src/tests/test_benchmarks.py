@@ -0,0 +1,34 @@
+import pytest
+
+from benchmarks import pipeline
+from benchmarks.synthetic import synthetic_corpus, synthetic_xmk, write_synthetic_xmk
+from song_transformations.pattern_extractors import XmkSong, song_onset_patterns, tokenize_xmk
+
+
+def test_synthetic_inputs_are_seeded():
+    assert synthetic_xmk(seed=4) == synthetic_xmk(seed=4) != synthetic_xmk(seed=5)
+    corpus = synthetic_corpus(num_songs=10, measures_per_song=5, pattern_length=16, seed=1)
+    assert corpus == synthetic_corpus(num_songs=10, measures_per_song=5, pattern_length=16, seed=1)
+    assert all(len(song) == 5 and all(len(p) == 16 for p in song) for song in corpus.values())
+
+
+@pytest.mark.parametrize("measures, beats_per_measure, beat_unit, density", pipeline.SONGS)
+def test_synthetic_songs_have_patterns(tmp_path, measures, beats_per_measure, beat_unit, density):
+    path = write_synthetic_xmk(tmp_path / "song.xmk", measures=measures, beats_per_measure=beats_per_measure,
+                               beat_unit=beat_unit, density=density)
+    song = XmkSong(path)
+    assert song.beats_per_measure == beats_per_measure and song.beat_unit == beat_unit
+    for pattern_length in pipeline.PATTERN_LENGTHS:
+        assert len(song_onset_patterns(tokenize_xmk(path), pattern_length)) == measures
+
+
+def test_quick_run_and_compare():
+    results = pipeline.run(quick=True, repeat=1)
+    assert {r["benchmark"] for r in results} == {"read_xmk", "tokenize_xmk", "get_onset_pattern",
+                                                  "song_onset_patterns", "format_dataset_patterns",
+                                                  "generate_rules", "generate_melody_measure"}
+    assert [r for r in results if r["error"]] == []
+
+    lines = pipeline.compare(results, results)
+    assert len(lines) == len(results)
+    assert all(line.endswith("x1.00") for line in lines)
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+from data.BipStore import (BipStore, bips_to_matrix, convert_resolution, is_representable, matrix_to_bips,
+                           matrix_to_strings, pack_bips, parse_bip_list, unpack_bips)
+
+RESOLUTION_PAIRS = [(width, width * factor) for width in range(1, 65) for factor in range(2, 65)
+                    if width * factor <= 64]
+
+
+def random_patterns(rng, count, width):
+    return [''.join(rng.choice(['0', '1'], width)) for _ in range(count)]
+
+
+def stretch(pattern, factor):
+    return ''.join(char + '0' * (factor - 1) for char in pattern)
+
+
+@pytest.mark.parametrize("width", [1, 4, 8, 12, 16, 32, 64])
+def test_pack_round_trip(width):
+    patterns = random_patterns(np.random.default_rng(width), 100, width)
+    packed = pack_bips(patterns, width)
+    assert unpack_bips(packed, width) == patterns
+    assert matrix_to_strings(bips_to_matrix(packed, width)) == patterns
+    assert (matrix_to_bips(bips_to_matrix(patterns, width)) == packed).all()
+
+
+def test_first_character_is_most_significant_bit():
+    assert pack_bips(['10000000', '00000001'], 8).tolist() == [128, 1]
+
+
+@pytest.mark.parametrize("width,new_width", RESOLUTION_PAIRS)
+def test_convert_resolution_round_trip(width, new_width):
+    rng = np.random.default_rng(new_width * 100 + width)
+    patterns = random_patterns(rng, 200, width) + ['1' * width, '0' * width]
+    packed = pack_bips(patterns, width)
+
+    up = convert_resolution(packed, width, new_width)
+    assert up.dtype == pack_bips([], new_width).dtype
+    assert unpack_bips(up, new_width) == [stretch(p, new_width // width) for p in patterns]
+    assert is_representable(up, new_width, width).all()
+    assert (convert_resolution(up, new_width, width) == packed).all()
+
+
+@pytest.mark.parametrize("width,new_width", [(16, 8), (64, 4), (32, 2), (16, 1), (64, 1), (24, 8)])
+def test_lossy_downsampling_is_refused(width, new_width):
+    factor = width // new_width
+    off_grid = '0' * (factor - 1) + '1' + '0' * (width - factor)
+    on_grid = '1' + '0' * (width - 1)
+    packed = pack_bips([on_grid, off_grid], width)
+    assert is_representable(packed, width, new_width).tolist() == [True, False]
+    with pytest.raises(ValueError):
+        convert_resolution(packed, width, new_width)
+    assert unpack_bips(convert_resolution(packed[:1], width, new_width), new_width) == ['1' + '0' * (new_width - 1)]
+
+
+def test_convert_resolution_rejects_other_widths():
+    with pytest.raises(ValueError):
+        convert_resolution(pack_bips(['10101010'], 8), 8, 12)
+    with pytest.raises(ValueError):
+        convert_resolution(pack_bips(['10101010'], 8), 8, 128)
+
+
+@pytest.fixture
+def store(tmp_path):
+    csv = tmp_path / "bips.csv"
+    csv.write_text("index,fileid,part0list,part1list\n"
+                   "0,a,\"['10101010', '1000']\",\"['00000000', '11111111']\"\n"
+                   "1,b,\"[]\",\"[]\"\n"
+                   "2,c,\"['0111101', '10000000', '10100010']\",\"['00000001', '', '10000000']\"\n")
+    return BipStore.from_csv(csv, 8)
+
+
+def test_store_strings_and_masks(store):
+    assert parse_bip_list("['1010', '']") == ['1010', '']
+    assert store.get_strings('a', 0) == ['10101010', '1000']
+    assert store.get_strings('c', 1) == ['00000001', '', '10000000']
+    assert store.get_regular_mask('c', 0).tolist() == [False, True, True]
+    assert store.get_packed('a', 1).tolist() == [0, 255]
+
+
+def test_store_gather(store):
+    packed, offsets, regular = store.gather(['c', 'b', 'a'], [0, 0, 0])
+    assert offsets.tolist() == [0, 3, 3, 5]
+    assert unpack_bips(packed, 8) == ['00000000', '10000000', '10100010', '10101010', '00000000']
+    assert regular.tolist() == [False, True, True, True, False]
+    assert store.gather_irregular(['c', 'b', 'a'], [0, 0, 0]) == {0: '0111101', 4: '1000'}
+
+
+def test_store_save_load(store, tmp_path):
+    path = tmp_path / "bips.bips"
+    store.save(path)
+    loaded = BipStore.load(path)
+    for fileid in ['a', 'b', 'c']:
+        for part in [0, 1]:
+            assert loaded.get_strings(fileid, part) == store.get_strings(fileid, part)
+            assert (loaded.get_regular_mask(fileid, part) == store.get_regular_mask(fileid, part)).all()
+    assert 'b' in loaded and 'd' not in loaded
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "bad.bips"
+    path.write_bytes(b"not a bips file" * 20)
+    with pytest.raises(ValueError):
+        BipStore.load(path)
+
+
+def test_open_compiles_once(store, tmp_path):
+    csv = tmp_path / "bips.csv"
+    cache = tmp_path / "bips.bips"
+    opened = BipStore.open(csv, 8)
+    assert cache.exists()
+    assert opened.get_strings('c', 0) == store.get_strings('c', 0)
+
+    mtime = cache.stat().st_mtime_ns
+    BipStore.open(csv, 8)
+    assert cache.stat().st_mtime_ns == mtime  # up to date, read as is
+
+    cache.write_bytes(b"not a bips file" * 20)
+    os.utime(cache, ns=(mtime, mtime))
+    assert BipStore.open(csv, 8).get_strings('a', 0) == ['10101010', '1000']  # rebuilt
+
+    csv.write_text(csv.read_text().replace("'10101010'", "'11111111'"))
+    os.utime(csv, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    assert BipStore.open(csv, 8).get_strings('a', 0) == ['11111111', '1000']  # the CSV is newer
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+import data.paths
+from data import CompendiumReader
+from data.CompendiumReader import iter_csv, iter_songs, read_csv, read_pk_compendium
+
+
+@pytest.fixture
+def pk_compendium(tmp_path, monkeypatch):
+    csv = tmp_path / "pk.csv"
+    csv.write_text("fileid,title,composer,year,rtctype,ts_m21,part0_avgpitch,part1_avgpitch\n"
+                   "a,Rag A,Joplin,1899,rag,['2/4@0.0'],70,50\n"
+                   "b,Rag B,Lamb,1908,rag,['2/4@0.0'],40,60\n"
+                   "c,Rag C,Joplin,1902,rag,['4/4@0.0'],65,55\n")
+    monkeypatch.setattr(data.paths, "PK_COMPENDIUM_CSV", csv)
+    bips = tmp_path / "bips.csv"
+    bips.write_text("index,fileid,part0list,part1list\n"
+                    "0,a,\"['1000', '1010']\",\"['0001', '11']\"\n"
+                    "1,x,\"['1111']\",\"['1111']\"\n"
+                    "2,b,\"['1100']\",\"['0011']\"\n"
+                    "3,c,\"[]\",\"[]\"\n")
+    return bips
+
+
+def test_chunks_are_typed_and_filtered(pk_compendium, tmp_path):
+    csv = tmp_path / "pk.csv"
+    chunks = list(iter_csv(csv, chunksize=1, dtypes=CompendiumReader.PK_COMPENDIUM_DTYPES, fileids=['a', 'c']))
+    assert [list(chunk['fileid']) for chunk in chunks] == [['a'], ['c']]
+    df = read_pk_compendium(['fileid', 'composer'], chunksize=2)
+    assert list(df['fileid']) == ['a', 'b', 'c']
+    assert isinstance(df['composer'].dtype, pd.CategoricalDtype)
+
+
+def test_nothing_read_gives_typed_empty_frame(pk_compendium):
+    df = read_pk_compendium(['fileid', 'composer'], fileids=[])
+    assert len(df) == 0
+    assert list(df.columns) == ['fileid', 'composer']
+    assert isinstance(df['composer'].dtype, pd.CategoricalDtype)
+    assert read_csv(pk_compendium, fileids=['nothing']).columns.tolist() == ['index', 'fileid', 'part0list',
+                                                                               'part1list']
+
+
+def test_iter_songs(pk_compendium):
+    songs = list(iter_songs(pk_compendium, width=4, metadata_columns=['title', 'composer'], chunksize=2))
+    assert [fileid for fileid, _, _ in songs] == ['a', 'b', 'c']  # x has no metadata
+    fileid, metadata, parts = songs[0]
+    assert metadata == {'title': 'Rag A', 'composer': 'Joplin'}
+    assert parts['melody'].tolist() == [8, 10] and parts['bass'].tolist() == [1, 0]
+    _, _, parts = songs[1]
+    assert parts['melody'].tolist() == [3]  # the second part has the higher pitch
+
+    strings = list(iter_songs(pk_compendium, width=4, packed=False, fileids=['a']))
+    assert len(strings) == 1 and strings[0][2] == {'melody': ['1000', '1010'], 'bass': ['0001', '11']}
+    assert list(iter_songs(pk_compendium, width=4, fileids=[])) == []
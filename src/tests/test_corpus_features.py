@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+from data.BipStore import BipStore
+from data.CorpusFeatures import build_feature_table, rollup
+from data.PatternMatcher import PatternSpec
+
+SPECS = {'untied': [PatternSpec('1101', 0), PatternSpec('1101', 4)],
+         'tied': [PatternSpec('1101', 2), PatternSpec('1101', 6)]}
+
+SONGS = {  # fileid -> (part0, part1, melody part, year, composer)
+    'a': (['11011101', '00000011', '01000000'], ['10000000', '00000000', '10000000'], 0, '1899', 'Joplin'),
+    'b': (['00000000', '00000000'], ['11011000', '00000011'], 1, '1908', 'Lamb'),
+    'c': (['00000000', '10101010'], ['00000000', '0111'], 0, 'c. 1910', 'Joplin'),
+}
+
+
+class Dataset(object):
+    """ The parts of PKDataset that build_feature_table() uses, over a small BipStore. """
+
+    def __init__(self, csv):
+        self.bips = BipStore.from_csv(csv, 8)
+        years = pd.to_numeric(pd.Series([song[3] for song in SONGS.values()]), errors='coerce')
+        self.meta_df = pd.DataFrame({'melody_part': [song[2] for song in SONGS.values()],
+                                     'year_cat': ['1890-1901', '1902-1919', 'unknown'],
+                                     'composer': [song[4] for song in SONGS.values()],
+                                     'rtctype': 'rag', 'ts': '2/4',
+                                     'year_num': years.astype('Int64').array}, index=list(SONGS))
+
+    def get_best_versions(self, accept_no_silence_at_start=None, quant_cutoff=None):
+        return pd.DataFrame({'fileid': ['c', 'a', 'b']})
+
+    def get_metadata(self, fileids, columns=None):
+        rows = self.meta_df.loc[list(fileids)]
+        return rows[columns] if columns is not None else rows
+
+    def _parts(self, fileids, melody):
+        melody_parts = self.get_metadata(fileids, ['melody_part'])['melody_part'].to_numpy()
+        return melody_parts if melody else 1 - melody_parts
+
+    def get_bips_corpus(self, fileids, melody=True, bips16=False):
+        return self.bips.gather(list(fileids), self._parts(fileids, melody))
+
+    def get_irregular_bips(self, fileids, melody=True, bips16=False):
+        return self.bips.gather_irregular(list(fileids), self._parts(fileids, melody))
+
+
+@pytest.fixture
+def table(tmp_path):
+    csv = tmp_path / 'bips.csv'
+    lines = ['index,fileid,part0list,part1list']
+    for i, (fileid, song) in enumerate(SONGS.items()):
+        lines.append('%d,%s,"%r","%r"' % (i, fileid, song[0], song[1]))
+    csv.write_text('\n'.join(lines) + '\n')
+    return build_feature_table(Dataset(csv), SPECS)
+
+
+def test_feature_table(table):
+    assert list(table['fileid']) == ['c', 'a', 'b']
+    # c: the silent bar isn't counted; a: '11' + '01' is tied across the barline; b's melody is part 1
+    assert list(table['barcount']) == [1, 3, 2]
+    assert list(table['untied']) == [0, 2, 1]
+    assert list(table['tied']) == [0, 1, 0]
+    assert list(table['composer']) == ['Joplin', 'Joplin', 'Lamb']
+    assert table['year'].isna().tolist() == [True, False, False]
+    assert table['untied_pct'].tolist() == pytest.approx([0, 2 / 3, 1 / 2])
+
+
+def test_rollup(table):
+    by_composer = rollup(table, 'composer', ['barcount', 'untied', 'tied'])
+    assert by_composer.loc['Joplin', ['compositions', 'barcount', 'untied', 'tied']].tolist() == [2, 4, 2, 1]
+    assert by_composer.loc['Lamb', 'untied_pct'] == pytest.approx(1 / 2)
+    assert 'barcount_pct' not in by_composer
+
+    by_year = rollup(table, 'year', ['barcount', 'untied'])
+    assert by_year['compositions'].sum() == 3  # the rag without a year is kept, as its own group
+    assert by_year.index.isna().sum() == 1
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import data.paths
+from song_transformations import pattern_extractors
+from song_transformations.pattern_extractors import (load_cached_dataset_patterns, rag_dataset_pattern_extractor,
+                                                     save_cached_dataset_patterns)
+
+DATASET_PATTERNS = {2: [(0.75, '10001000'), (0.25, '10100000')], 1: [(1.0, '10000000')]}
+
+
+@pytest.fixture(autouse=True)
+def sources(tmp_path, monkeypatch):
+    compendium, patterns = tmp_path / "compendium.csv", tmp_path / "patterns.csv"
+    compendium.write_text("fileid\n")
+    patterns.write_text("fileid\n")
+    monkeypatch.setattr(data.paths, "PK_COMPENDIUM_CSV", compendium)
+    monkeypatch.setattr(data.paths, "PK_BINARY_ONSET_PATTERNS_CSV", patterns)
+    monkeypatch.setattr(pattern_extractors, "CACHE_DIR", tmp_path / "cache")
+    return compendium, patterns
+
+
+def test_round_trip_per_arguments():
+    assert load_cached_dataset_patterns(8, True, .95) is None
+    save_cached_dataset_patterns(DATASET_PATTERNS, 8, True, .95)
+    assert load_cached_dataset_patterns(8, True, .95) == DATASET_PATTERNS
+    assert load_cached_dataset_patterns(16, True, .95) is None
+    assert load_cached_dataset_patterns(8, False, .95) is None
+    assert load_cached_dataset_patterns(8, True, .9) is None
+    assert rag_dataset_pattern_extractor(8) == DATASET_PATTERNS  # from the cache, without the dataset
+
+
+def test_stale_when_the_sources_change(sources):
+    save_cached_dataset_patterns(DATASET_PATTERNS, 8, True, .95)
+    compendium, _ = sources
+    compendium.write_text("fileid\nnew\n")
+    assert load_cached_dataset_patterns(8, True, .95) is None
+
+
+def test_unreadable_cache_is_ignored():
+    save_cached_dataset_patterns(DATASET_PATTERNS, 8, True, .95)
+    [cache_file] = os.listdir(pattern_extractors.CACHE_DIR)
+    (pattern_extractors.CACHE_DIR / cache_file).write_bytes(b"not a pickle")
+    assert load_cached_dataset_patterns(8, True, .95) is None
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from song_transformations import instrumentation
+from song_transformations.algorithm_1 import duration_template, get_note_lengths
+
+
+def old_note_lengths(notes, pattern):
+    """ get_note_lengths() as it was, before the templates (returns the number of rests inserted too). """
+    note_lengths = []
+    amount_held = 1
+    for index in range(1, len(pattern)):
+        if pattern[index] == '0':
+            amount_held += 1
+        else:
+            note_lengths.append(amount_held)
+            amount_held = 1
+    note_lengths.append(amount_held)
+    rests_inserted = 0
+    if len(notes) != len(note_lengths):
+        for i in range(1, len(notes)):
+            if notes[i] == -1 and note_lengths[i-1] > 0:
+                note_lengths.insert(i, 1)
+                note_lengths[i-1] -= 1
+                rests_inserted += 1
+    return note_lengths, rests_inserted
+
+
+@pytest.fixture
+def metrics():
+    yield instrumentation.enable()
+    instrumentation.disable()
+
+
+@pytest.mark.parametrize("pattern_length", [8, 16])
+def test_templates_match_old_note_lengths(pattern_length, metrics):
+    rng = np.random.default_rng(pattern_length)
+    expected_rests = 0
+    for _ in range(500):
+        pattern = ''.join(rng.choice(['0', '1'], pattern_length, p=[.6, .4]))
+        num_notes = max(pattern.count('1'), 1) + int(rng.integers(0, 3))
+        notes = [-1 if rest else 60 for rest in rng.random(num_notes) < .3]
+        try:
+            lengths, rests_inserted = old_note_lengths(notes, pattern)
+        except IndexError:  # more rests than the fix-up can fit: both fail alike
+            with pytest.raises(IndexError):
+                duration_template(notes, pattern)
+            continue
+        template = duration_template(notes, pattern)
+        assert list(template.note_lengths) == get_note_lengths(notes, pattern) == lengths
+        assert template.quarter_lengths == tuple(length / pattern_length * 4 for length in lengths)
+        expected_rests += 2 * rests_inserted
+    # counted for every measure, cached or not
+    assert metrics.counters.get("rests_inserted", 0) == expected_rests
+
+
+def test_templates_depend_on_rest_positions_only():
+    assert duration_template([60, 62, 64], '10101000') is duration_template([70, 71, 72], '10101000')
+    assert duration_template([60, -1, 64], '10001000').note_lengths == (3, 1, 4)
+    assert duration_template([60, 62, -1], '10001000').note_lengths == (4, 3, 1)
+    lengths = get_note_lengths([60, 62, 64], '10101000')
+    lengths[0] = 100  # a copy, the template is unchanged
+    assert get_note_lengths([60, 62, 64], '10101000') == [2, 2, 4]
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_synthetic_xmk
+from song_transformations import instrumentation
+from song_transformations.pattern_statistics import PatternStatistics
+from song_transformations.song_transformer import SUCCESS, _init_worker, _transform_worker, song_transformer
+
+
+@pytest.fixture
+def metrics():
+    yield instrumentation.enable()
+    instrumentation.disable()
+
+
+def test_off_by_default():
+    assert instrumentation.current() is None
+    with instrumentation.stage("xmk_parsing"), instrumentation.song("song"):
+        instrumentation.count("rules_generated")
+    assert instrumentation.disable() is None
+
+
+def test_stages_counters_and_songs(metrics):
+    with instrumentation.stage("rule_generation"):
+        instrumentation.count("rules_generated", 3)
+    with instrumentation.song("a"):
+        with instrumentation.stage("rule_generation"):
+            instrumentation.count("rules_generated")
+    assert metrics.stages["rule_generation"]["calls"] == 2
+    assert metrics.counters == {"rules_generated": 4}
+    assert metrics.songs["a"]["counters"] == {"rules_generated": 1}
+    assert metrics.songs["a"]["stages"]["rule_generation"]["calls"] == 1
+
+    metrics.add_song("b", {"stages": {"midi_writing": {"calls": 1, "seconds": 0.5}},
+                           "counters": {"rules_generated": 2}})
+    assert metrics.counters["rules_generated"] == 6
+    assert metrics.stages["midi_writing"] == {"calls": 1, "seconds": 0.5}
+    assert json.loads(metrics.to_json())["songs"]["b"]["counters"] == {"rules_generated": 2}
+
+
+def test_prometheus(metrics):
+    with instrumentation.song('odd "name"'):
+        instrumentation.count("cache_hits")
+    text = metrics.to_prometheus(per_song=True)
+    assert "# TYPE song_transformer_cache_hits_total counter\n" in text
+    assert "song_transformer_cache_hits_total 1\n" in text
+    assert 'song_transformer_cache_hits_total{song="odd \\"name\\""} 1\n' in text
+
+
+@pytest.fixture
+def song(tmp_path):
+    path = write_synthetic_xmk(tmp_path / "song.xmk", measures=16, density=0.5, seed=1)
+    # without rests: get_note_lengths() can't always fit a rest into a dataset rhythm.
+    path.write_text(path.read_text().replace("\t-1\t", "\t60\t"))
+    return path
+
+
+@pytest.fixture
+def dataset_patterns():
+    bits = np.random.default_rng(0).random((400, 8)) < 0.5
+    return PatternStatistics({"corpus": [''.join('1' if b else '0' for b in row) for row in bits]})
+
+
+def test_song_transformer(song, dataset_patterns, tmp_path, metrics):
+    result = song_transformer(song, dataset_patterns, 8, tmp_path, "fastmidi", rng=1)
+    assert result.status == SUCCESS
+    for stage in ["xmk_parsing", "onset_patterns", "rule_generation", "midi_writing"]:
+        assert metrics.stages[stage]["calls"] == 1
+    assert metrics.counters["measures_rendered"] == 16
+    assert metrics.songs[song]["counters"] == metrics.counters
+
+
+def test_worker_hands_back_its_song_metrics(song, dataset_patterns, tmp_path):
+    _init_worker(dataset_patterns, 8, tmp_path, "fastmidi", instrumented=True)
+    try:
+        result = _transform_worker(str(song), np.random.SeedSequence(1))
+        assert result.status == SUCCESS
+        assert result.metrics["counters"]["measures_rendered"] == 16
+        assert instrumentation.current().songs == {}  # popped, so a worker doesn't keep every song
+    finally:
+        instrumentation.disable()
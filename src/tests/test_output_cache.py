@@ -0,0 +1,78 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_synthetic_xmk
+from song_transformations.output_cache import OutputCache, seed_key, song_seed
+from song_transformations.pattern_statistics import PatternStatistics
+from song_transformations.song_transformer import SUCCESS, song_transformer
+
+
+@pytest.fixture
+def song(tmp_path):
+    path = write_synthetic_xmk(tmp_path / "song.xmk", measures=16, density=0.5, seed=1)
+    # without rests: get_note_lengths() can't always fit a rest into a dataset rhythm.
+    path.write_text(path.read_text().replace("\t-1\t", "\t60\t"))
+    return path
+
+
+@pytest.fixture
+def dataset_patterns():
+    rng = np.random.default_rng(0)
+    bits = rng.random((400, 8)) < 0.5
+    patterns = [''.join('1' if b else '0' for b in row) for row in bits]
+    return PatternStatistics({"corpus": patterns})
+
+
+def test_seed_key():
+    assert seed_key(3) == seed_key(3)
+    assert seed_key(3) != seed_key(4)
+    assert seed_key(np.random.SeedSequence(3)) == seed_key(np.random.SeedSequence(3))
+    assert seed_key(np.random.default_rng(3)) is None
+    assert seed_key(None) is None
+
+
+def test_song_seed_depends_on_content_not_location(song, tmp_path):
+    moved = tmp_path / "elsewhere" / "renamed.xmk"
+    moved.parent.mkdir()
+    shutil.copyfile(song, moved)
+    cache = OutputCache(tmp_path / "cache")
+    assert seed_key(song_seed(1, song)) == seed_key(song_seed(1, moved))
+    assert cache.key(song, 8, song_seed(1, song), "fastmidi") == cache.key(moved, 8, song_seed(1, moved), "fastmidi")
+    assert seed_key(song_seed(1, song)) != seed_key(song_seed(2, song))
+
+    write_synthetic_xmk(moved, measures=16, density=0.5, seed=2)
+    assert seed_key(song_seed(1, song)) != seed_key(song_seed(1, moved))
+
+
+def test_transform_hits_cache(song, dataset_patterns, tmp_path):
+    cache = OutputCache(tmp_path / "cache")
+    first_dir, second_dir = tmp_path / "first", tmp_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+
+    first = song_transformer(song, dataset_patterns, 8, first_dir, "fastmidi", rng=5, cache=cache)
+    second = song_transformer(song, dataset_patterns, 8, second_dir, "fastmidi", rng=5, cache=cache)
+    assert first.status == second.status == SUCCESS
+    assert first.message != "from cache" and second.message == "from cache"
+    with open(first.output, 'rb') as a, open(second.output, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_put_get_and_evict(tmp_path, monkeypatch):
+    source = tmp_path / "out.mid"
+    source.write_bytes(b"x" * 1000)
+    cache = OutputCache(tmp_path / "cache", max_bytes=5000)
+    scans = []
+    evict = OutputCache.evict
+    monkeypatch.setattr(OutputCache, "evict", lambda self: scans.append(1) or evict(self))
+
+    for i in range(10):
+        cache.put("key%d" % i, ".mid", source, {"1000": "1010"})
+    assert len(scans) < 10  # the directory isn't listed on every put
+    total = sum(path.stat().st_size for path in (tmp_path / "cache").iterdir())
+    assert total <= 5000
+    assert cache.get("key9", ".mid") is not None  # the newest entries are kept
+    assert cache.get("key0", ".mid") is None
+    assert cache.get("key9", ".mid")[1] == {"1000": "1010"}
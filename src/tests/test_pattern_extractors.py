@@ -0,0 +1,119 @@
+import re
+
+import pytest
+
+from benchmarks.synthetic import write_synthetic_xmk
+from data.BipStore import pack_bips
+from song_transformations.pattern_extractors import (XmkSong, get_onset_pattern, read_xmk, song_onset_patterns,
+                                                     tokenize_xmk)
+
+
+def measure_patterns(filename, pattern_length):
+    """ The patterns built measure by measure, from read_xmk(). """
+    patterns = []
+    for measure in read_xmk(filename)[3].values():
+        note_values = [line[0] if line[1] != -1 else (-line[0][0], -line[0][1]) for line in measure]
+        patterns.append(get_onset_pattern(note_values, pattern_length))
+    return patterns
+
+
+def write_xmk(path, measures):
+    lines = ["[4][4][120]"]
+    for number, notes in enumerate(measures, 1):
+        lines.append(f"={number}")
+        lines += [f"{value}\t{note}\t55[4" for value, note in notes]
+    path.write_text("\n".join(lines + ["=end"]) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("pattern_length", [8, 16, 32])
+def test_song_patterns_match_measure_patterns(tmp_path, seed, pattern_length):
+    path = write_synthetic_xmk(tmp_path / "song.xmk", measures=20, density=0.5, seed=seed)
+    columns = tokenize_xmk(path)
+    assert columns.to_song() == read_xmk(path)[3]
+    patterns = song_onset_patterns(columns, pattern_length)
+    assert patterns == measure_patterns(path, pattern_length)
+    assert song_onset_patterns(columns, pattern_length, packed=True).tolist() == \
+        pack_bips(patterns, pattern_length).tolist()
+    assert XmkSong(path).patterns(pattern_length) == patterns
+
+
+def test_errors_name_the_first_bad_measure(tmp_path):
+    path = write_xmk(tmp_path / "song.xmk", [[("1/2", 60), ("1/2", 62)],
+                                             [("1/16", 60), ("7/8", 62)],
+                                             [("1/2", 60), ("3/4", 62)]])
+    with pytest.raises(ValueError, match="Onsets cannot be evenly divided"):
+        measure_patterns(path, 8)
+    with pytest.raises(ValueError, match="^Measure 2: Onsets cannot be evenly divided.$"):
+        song_onset_patterns(tokenize_xmk(path), 8)
+    with pytest.raises(ValueError, match="^Measure 3: Onset pattern does not fit in 16 characters.$"):
+        song_onset_patterns(tokenize_xmk(path), 16)
+
+
+def test_zero_length_notes(tmp_path):
+    # zero-length notes still take a position, as in get_onset_pattern()
+    path = write_xmk(tmp_path / "song.xmk", [[("0/4", 60), ("1/2", 62), ("1/4", -1)]])
+    assert song_onset_patterns(tokenize_xmk(path), 8) == measure_patterns(path, 8) == ['11000000']
+
+    # ...and when they push a note out of the pattern, the measure doesn't fit
+    path = write_xmk(tmp_path / "song.xmk", [[("1/2", 60), ("1/2", 62)],
+                                             [("1/2", 60), ("1/2", 62), ("0/4", 64)]])
+    assert measure_patterns(path, 8)[1] == '100010001'
+    with pytest.raises(ValueError, match="^Measure 2: Onset pattern does not fit in 8 characters.$"):
+        song_onset_patterns(tokenize_xmk(path), 8)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_song_notes_and_chords_match_read_xmk(tmp_path, seed):
+    path = write_synthetic_xmk(tmp_path / "song.xmk", measures=20, beats_per_measure=3, density=0.6, seed=seed)
+    beats_per_measure, beat_unit, beats_per_minute, song = read_xmk(path)
+    notes, chords = {}, {}
+    for measure_number, measure in song.items():
+        notes[measure_number] = [onset[1] for onset in measure]
+        chords[measure_number] = []
+        for onset in measure:
+            if not chords[measure_number] or onset[2] != chords[measure_number][-1]:
+                chords[measure_number].append(onset[2])
+
+    xmk_song = XmkSong(path)
+    assert (xmk_song.beats_per_measure, xmk_song.beat_unit, xmk_song.beats_per_minute) == \
+        (beats_per_measure, beat_unit, beats_per_minute)
+    assert xmk_song.notes == notes
+    assert xmk_song.chords == chords
+    assert xmk_song.song == song
+
+
+@pytest.mark.parametrize("line", ["1/4\t62", "1/2.\t60\t48", "abc", "=12abc"])
+def test_malformed_lines_are_reported(tmp_path, line):
+    path = tmp_path / "song.xmk"
+    path.write_text(f"[4][4][120]\n=1\n1/4\t60\t48\n\n{line}\n1/4\t64\t48\n=end\n")
+    with pytest.raises((IndexError, ValueError)):
+        read_xmk(path)
+    with pytest.raises(ValueError, match=re.escape(f"line 5 is not a note or a measure: {line!r}")):
+        tokenize_xmk(path)
+
+
+def test_blank_lines_and_extra_columns(tmp_path):
+    path = tmp_path / "song.xmk"
+    path.write_text("[4][4][120]\n=1\n1/2\t60\t48\tx\n\n1/2\t-1\t48\n=end\n")
+    columns = tokenize_xmk(path)
+    assert columns.note.tolist() == [60, -1]
+    assert song_onset_patterns(columns, 8) == ['10000000']
+
+
+def test_repeated_measure_numbers(tmp_path):
+    path = write_xmk(tmp_path / "song.xmk", [[("1/2", 60), ("1/2", 62)], [("1/1", 64)], [("1/4", 65)] * 4])
+    # measure 1 again: it starts over, but keeps its place before measure 2
+    path.write_text(path.read_text().replace("=3", "=1"))
+    columns = tokenize_xmk(path)
+    assert columns.to_song() == read_xmk(path)[3]
+    assert columns.measures.tolist() == [1, 2]
+    assert song_onset_patterns(columns, 8) == ['10101010', '10000000']
+
+
+def test_note_before_the_first_measure(tmp_path):
+    path = tmp_path / "song.xmk"
+    path.write_text("[4][4][120]\n1/1\t60\t48\n=1\n1/1\t62\t48\n")
+    with pytest.raises(ValueError, match="note before the first measure"):
+        tokenize_xmk(path)
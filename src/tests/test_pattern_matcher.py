@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from data.BipStore import BipStore
+from data.PatternMatcher import PatternSpec, count_matches, match_bars
+
+# as in experiments/121-per-measure.py
+PATTERNS_121 = {
+    'untied': [PatternSpec('1101', 0), PatternSpec('1101', 4)],
+    'tied': [PatternSpec('1101', 2), PatternSpec('1101', 6)],
+    'untied_aug': [PatternSpec('10100010', 0)],
+    'tied_aug': [PatternSpec('10100010', 4)],
+}
+IRREGULAR = ['0111101', '01', '0', '', '001011010', '0010']
+
+
+def per_measure_counts(melbips, bassbips):
+    """ The per-measure loop of the 121 experiment before it was vectorized. """
+    counts = {'barcount': 0, 'untied': 0, 'tied': 0, 'untied_aug': 0, 'tied_aug': 0}
+    for x in range(len(melbips)):
+        melbip = melbips[x]
+        bassbip = bassbips[x]
+        melbip_nextbar = 'XXXXXXXX'
+        if x + 1 < len(melbips):
+            melbip_nextbar = melbips[x + 1]
+        if melbip == "00000000" and bassbip == "00000000":
+            continue
+        if len(melbip) != 8:
+            continue
+        counts['barcount'] += 1
+        if melbip[0:4] == '1101':
+            counts['untied'] += 1
+        if melbip[4:8] == '1101':
+            counts['untied'] += 1
+        if melbip[2:6] == '1101':
+            counts['tied'] += 1
+        if melbip[6:8] == '11' and melbip_nextbar[0:2] == '01':
+            counts['tied'] += 1
+        if melbip == '10100010':
+            counts['untied_aug'] += 1
+        if melbip[4:8] == '1010' and melbip_nextbar[0:4] == '0010':
+            counts['tied_aug'] += 1
+    return counts
+
+
+def random_song(rng, num_bars):
+    vocabulary = ['00000000', '11011101', '10100010', '00110111', '01010011', '10101010', '01101000',
+                  '00101101', '11111111', '01000000']
+    bars = []
+    for _ in range(num_bars):
+        if rng.random() < 0.1:
+            bars.append(IRREGULAR[rng.integers(len(IRREGULAR))])
+        elif rng.random() < 0.5:
+            bars.append(vocabulary[rng.integers(len(vocabulary))])
+        else:
+            bars.append(''.join(rng.choice(['0', '1'], 8)))
+    return bars
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    rng = np.random.default_rng(0)
+    songs = {}
+    for i in range(60):
+        num_bars = int(rng.integers(0, 40))
+        songs['song%d' % i] = (random_song(rng, num_bars), random_song(rng, num_bars))
+    csv = tmp_path / 'bips.csv'
+    lines = ['index,fileid,part0list,part1list']
+    for i, (fileid, (melody, bass)) in enumerate(songs.items()):
+        lines.append('%d,%s,"%r","%r"' % (i, fileid, melody, bass))
+    csv.write_text('\n'.join(lines) + '\n')
+    return songs, BipStore.from_csv(csv, 8)
+
+
+def test_counts_match_per_measure_loop(corpus):
+    songs, store = corpus
+    fileids = list(songs)
+    melbips, offsets, mel_regular = store.gather(fileids, [0] * len(fileids))
+    bassbips, _, bass_regular = store.gather(fileids, [1] * len(fileids))
+    irregular = store.gather_irregular(fileids, [0] * len(fileids))
+    assert len(irregular) > 0
+
+    # as in CorpusFeatures.build_feature_table()
+    bar_mask = ((melbips != 0) | (bassbips != 0) | ~bass_regular) & mel_regular
+    counts = count_matches(melbips, offsets, PATTERNS_121, bar_mask, irregular)
+    for i, (melody, bass) in enumerate(songs.values()):
+        expected = per_measure_counts(melody, bass)
+        assert {name: int(values[i]) for name, values in counts.items()} == expected
+
+
+def test_tied_into_irregular_bar():
+    packed = np.array([0b00000011, 0], dtype=np.uint8)
+    spec = PatternSpec('1101', 6)
+    assert not match_bars(packed, [0, 2], spec)[0]
+    assert match_bars(packed, [0, 2], spec, {1: '0111101'})[0]
+    assert not match_bars(packed, [0, 1, 2], spec, {1: '0111101'})[0]  # different songs
+    assert not match_bars(packed, [0, 2], spec, {1: '0'})[0]
@@ -0,0 +1,69 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from data.BipStore import pack_bips
+from data.PatternMatcher import PatternSpec, count_matches
+from data.PatternNgrams import PatternNgrams
+
+VOCABULARY = ['10101010', '10001000', '11011000', '10100010', '00101101', '11111111']
+
+
+@pytest.fixture(scope="module")
+def songs():
+    rng = np.random.default_rng(0)
+    return {f"s{i}": [VOCABULARY[j] for j in rng.choice(6, rng.integers(0, 30), p=[.4, .2, .15, .1, .1, .05])]
+            for i in range(200)}
+
+
+@pytest.mark.parametrize("width", [None, 8])
+def test_counts_match_a_pass_over_the_corpus(songs, width):
+    index = PatternNgrams.from_song_patterns(songs, width=width)
+    unigrams = Counter(p for song in songs.values() for p in song)
+    bigrams = Counter((s[i], s[i + 1]) for s in songs.values() for i in range(len(s) - 1))
+    trigrams = Counter((s[i], s[i + 1], s[i + 2]) for s in songs.values() for i in range(len(s) - 2))
+
+    for pattern in VOCABULARY + ['00000001']:
+        assert index.count(pattern) == unigrams[pattern]
+    for a in VOCABULARY:
+        total = sum(count for (first, _), count in bigrams.items() if first == a)
+        for b in VOCABULARY:
+            assert index.count(a, b) == bigrams[(a, b)]
+            assert index.probability(b, a) == pytest.approx(bigrams[(a, b)] / total if total else 0)
+            for c in VOCABULARY:
+                assert index.count(a, b, c) == trigrams[(a, b, c)]
+            total_ab = sum(count for key, count in trigrams.items() if key[:2] == (a, b))
+            assert index.conditional(a, b) == pytest.approx(
+                {key[2]: count / total_ab for key, count in trigrams.items() if key[:2] == (a, b)})
+
+
+def test_vectorized_probabilities(songs):
+    index = PatternNgrams.from_song_patterns(songs, width=8)
+    ids = np.array([index.id_of(p) for p in VOCABULARY])
+    probabilities = index.probabilities(np.repeat(ids, len(ids)), np.tile(ids, len(ids)))
+    assert np.allclose(probabilities, [index.probability(b, a) for a in VOCABULARY for b in VOCABULARY])
+
+
+def test_count_specs_match_count_matches(songs):
+    rng = np.random.default_rng(1)
+    offsets = np.concatenate([[0], np.cumsum([len(song) for song in songs.values()])])
+    packed = pack_bips([p for song in songs.values() for p in song], 8)
+    mask = rng.random(len(packed)) < .8
+    packed[~mask] = 0  # measures outside the mask are silent
+    specs = {'untied': [PatternSpec('1101', 0), PatternSpec('1101', 4)],
+             'tied': [PatternSpec('1101', 2), PatternSpec('1101', 6)],
+             'tied_augmented': [PatternSpec('10100010', 4)],
+             'tied_late': [PatternSpec('0101', 7)]}
+    expected = {name: int(counts.sum()) for name, counts in count_matches(packed, offsets, specs, mask).items()
+                if name != 'barcount'}
+    assert PatternNgrams(packed, offsets, mask, width=8).count_specs(specs) == expected
+
+
+def test_empty_index():
+    index = PatternNgrams([], [0])
+    assert index.count('1') == 0
+    assert index.conditional('1') == {}
+    assert index.probabilities([0], [0]).tolist() == [0.0]
+    with pytest.raises(ValueError):
+        index.count_spec(PatternSpec('1', 0))
@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+import pytest
+
+from benchmarks.synthetic import synthetic_corpus
+from song_transformations.algorithm_1 import RuleSampler
+from song_transformations.pattern_statistics import PatternStatistics
+
+
+def recounted(dataset_patterns):
+    """ format_dataset_patterns() as it was, recounting the whole corpus. """
+    pattern_occurrences = defaultdict(int)
+    onset_frequencies = defaultdict(int)
+    for patterns in dataset_patterns.values():
+        for pattern in patterns:
+            pattern_occurrences[pattern] += 1
+            onset_frequencies[pattern.count('1')] += 1
+    patterns_by_onsets = defaultdict(list)
+    for pattern, occurrences in pattern_occurrences.items():
+        onset_total = onset_frequencies[pattern.count('1')]
+        patterns_by_onsets[pattern.count('1')].append((occurrences / onset_total, pattern))
+    return patterns_by_onsets
+
+
+def as_sets(patterns_by_onsets):
+    return {num_onsets: set(table) for num_onsets, table in patterns_by_onsets.items()}
+
+
+@pytest.fixture
+def corpus():
+    return synthetic_corpus(num_songs=60, measures_per_song=20, pattern_length=8, vocabulary=100, seed=2)
+
+
+def test_matches_recounting(corpus):
+    statistics = PatternStatistics(corpus)
+    assert as_sets(statistics) == as_sets(recounted(corpus))
+    assert as_sets(statistics.patterns_by_onsets()) == as_sets(recounted(corpus))
+    for pattern in ['10101010', '00000000', '11111111']:
+        matching = [p for p, q in recounted(corpus)[pattern.count('1')] if q == pattern]
+        assert statistics.proportion(pattern) == (matching[0] if matching else 0.0)
+
+
+def test_add_and_remove_songs(corpus):
+    statistics = PatternStatistics()
+    for song_id, patterns in corpus.items():
+        statistics.add_song(song_id, patterns)
+    removed = list(corpus)[::3]
+    for song_id in removed:
+        statistics.remove_song(song_id)
+    rest = {song_id: patterns for song_id, patterns in corpus.items() if song_id not in removed}
+    assert as_sets(statistics) == as_sets(recounted(rest))
+
+    statistics.add_song(removed[0], ['11110000'])
+    statistics.add_song(removed[0], ['11110000', '10000000'])  # replaces the song
+    rest[removed[0]] = ['11110000', '10000000']
+    assert as_sets(statistics) == as_sets(recounted(rest))
+    with pytest.raises(KeyError):
+        statistics.remove_song('no such song')
+
+    for song_id in list(rest):
+        statistics.remove_song(song_id)
+    assert len(statistics) == 0 and statistics.occurrences == {} and statistics.onset_totals == {}
+
+
+def test_rule_sampler_sees_changes():
+    statistics = PatternStatistics({'a': ['10101010', '10101010', '11001100']})
+    sampler = RuleSampler(statistics, 8)
+    assert sorted(sampler.candidates('10100110')) == [(1 / 3, '11001100'), (2 / 3, '10101010')]
+    statistics.add_song('b', ['10011010'])
+    assert sorted(sampler.candidates('10100110')) == [(0.25, '10011010'), (0.25, '11001100'), (0.5, '10101010')]
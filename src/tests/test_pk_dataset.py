@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data.paths
+from data.PKDataset import PKDataset
+
+TIME_SIGNATURES = ["['2/4@0.0']", "['4/4@0.0']", "['2/2@0.0']", "['3/4@0.0']"]
+
+
+def old_best_version(df, title, accept_no_silence_at_start, quant_cutoff):
+    """ get_best_version_of_rag() as it was, one title at a time. """
+    mydf = df[df['title'] == title]
+    mydf = mydf[mydf['do_not_use'].isna()]
+    mydf = mydf[mydf['ts_m21'] != "['3/4@0.0']"]
+    if len(mydf) == 0:
+        return None
+    tempdf = mydf[mydf['true_ts'].notna()]
+    if len(tempdf) != 0:
+        true_ts = tempdf['true_ts'].iloc[0]
+    else:
+        tempdf = mydf['ts_m21'].str[2:5].mode()
+        if len(tempdf) == 1:
+            true_ts = tempdf.iloc[0]
+        elif (tempdf == '2/4').any():
+            true_ts = '2/4'
+        elif (tempdf == '4/4').any():
+            true_ts = '4/4'
+        else:
+            true_ts = tempdf.iloc[0]
+    mydf = mydf[mydf['ts_m21'].str[2:5] == true_ts]
+    if not accept_no_silence_at_start:
+        mydf = mydf[mydf['silence_beats_m21'] > 0]
+    if quant_cutoff is not None:
+        mydf = mydf[mydf['onset_pct_m21'] >= quant_cutoff]
+    mydf = mydf[mydf['onset_pct_m21'] == (mydf['onset_pct_m21'].max())]
+    return None if len(mydf) == 0 else mydf.iloc[0]
+
+
+def old_year_category(series):
+    if str(series['year']).isdigit():
+        year = int(series['year'])
+        if year < 1890:
+            return "<1890"
+        elif year < 1902:
+            return "1890-1901"
+        elif year < 1920:
+            return "1902-1919"
+        return ">1919"
+    return series['year_alt']
+
+
+@pytest.fixture(scope="module")
+def pkdata():
+    rng = np.random.default_rng(0)
+    rows = []
+    for t in range(40):
+        for v in range(int(rng.integers(1, 6))):
+            rows.append({'fileid': f"f{t}_{v}",
+                         'title': f"Rag {t}" if rng.random() > .05 else np.nan,
+                         'composer': rng.choice(['Joplin', 'Lamb', 'Scott']),
+                         'rtctype': 'rag',
+                         'year': rng.choice(['1885', '1899', '1908', '1925', 'c. 1910']),
+                         'year_alt': rng.choice(['1900s', '1910s']),
+                         'ts_m21': rng.choice(TIME_SIGNATURES),
+                         'true_ts': rng.choice(['2/4', '4/4']) if rng.random() < .15 else np.nan,
+                         'do_not_use': 'x' if rng.random() < .1 else np.nan,
+                         'silence_beats_m21': int(rng.integers(0, 2)),
+                         'onset_pct_m21': rng.choice([.9, .95, .97, 1.0]),
+                         'part0_avgpitch': float(rng.integers(40, 80)),
+                         'part1_avgpitch': float(rng.integers(40, 80))})
+    pkdata = PKDataset.__new__(PKDataset)
+    pkdata.df = pd.DataFrame(rows)
+    pkdata.meta_df = PKDataset._build_metadata(pkdata.df)
+    pkdata._best_versions = {}
+    return pkdata
+
+
+@pytest.mark.parametrize("accept_no_silence_at_start", [True, False])
+@pytest.mark.parametrize("quant_cutoff", [None, .95])
+def test_best_versions_match_per_title(pkdata, accept_no_silence_at_start, quant_cutoff):
+    best = pkdata.get_best_versions(accept_no_silence_at_start, quant_cutoff)
+    assert pkdata.get_best_versions(accept_no_silence_at_start, quant_cutoff) is best
+    for title in pkdata.get_all_titles():
+        old = old_best_version(pkdata.df, title, accept_no_silence_at_start, quant_cutoff)
+        new = pkdata.get_best_version_of_rag(title, accept_no_silence_at_start, quant_cutoff)
+        if old is None:
+            assert new is None
+        else:
+            assert new['fileid'] == old['fileid']
+
+
+def test_metadata_matches_per_file(pkdata):
+    fileids = list(pkdata.df['fileid'])[::-1]
+    metadata = pkdata.get_metadata(fileids, ['melody_part', 'ts', 'year_cat', 'year_num', 'composer'])
+    assert list(metadata.index) == fileids
+    for fileid, row in metadata.iterrows():
+        series = pkdata.df[pkdata.df['fileid'] == fileid].iloc[0]
+        assert row['melody_part'] == pkdata.get_melody_part_number(fileid) == \
+            (0 if series['part0_avgpitch'] > series['part1_avgpitch'] else 1)
+        assert row['ts'] == pkdata.get_music21_time_signature_clean(fileid) == series['ts_m21'][2:5]
+        assert row['year_cat'] == pkdata.get_year_as_category(fileid) == old_year_category(series)
+        assert pkdata.has_year_as_number(fileid) == str(series['year']).isdigit()
+        if pkdata.has_year_as_number(fileid):
+            assert row['year_num'] == pkdata.get_year_as_number(fileid) == int(series['year'])
+        else:
+            assert pd.isna(row['year_num'])
+        assert row['composer'] == pkdata.get_composer(fileid) == series['composer']
+
+
+@pytest.mark.skipif(not data.paths.PK_COMPENDIUM_CSV.exists(), reason="the PK compendium is not there")
+@pytest.mark.parametrize("accept_no_silence_at_start", [True, False])
+@pytest.mark.parametrize("quant_cutoff", [None, .95])
+def test_best_versions_of_the_compendium(accept_no_silence_at_start, quant_cutoff):
+    pkdata = PKDataset.__new__(PKDataset)
+    pkdata.df = pd.read_csv(data.paths.PK_COMPENDIUM_CSV)
+    pkdata._best_versions = {}
+    best = pkdata.get_best_versions(accept_no_silence_at_start, quant_cutoff)
+    best = dict(zip(best.index, best['fileid']))
+    # every 10th title, as the per-title selection takes a few ms per title
+    titles = sorted(pkdata.df['title'].dropna().unique())[::10]
+    for title in titles:
+        old = old_best_version(pkdata.df, title, accept_no_silence_at_start, quant_cutoff)
+        assert best.get(title) == (None if old is None else old['fileid'])
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from song_transformations.alias_sampler import AliasSampler
+from song_transformations.algorithm_1 import RuleSampler, generate_rules, randomly_change
+
+DATASET_PATTERNS = {
+    2: [(0.5, '10001000'), (0.3, '10100000'), (0.2, '00101000')],
+    3: [(0.4, '10101000'), (0.4, '10001010'), (0.2, '11000100')],
+}
+SONG_PATTERNS = ['10001000', '10101000', '10100000', '10001000']
+
+
+@pytest.fixture
+def sampler():
+    return AliasSampler(['a', 'b', 'c', 'd'], [0.1, 0.2, 0.3, 0.4])
+
+
+def test_alias_sampler_accepts_int_seeds(sampler):
+    assert sampler.sample(7) == sampler.sample(7)
+    assert list(sampler.sample_indices(50, 7)) == list(sampler.sample_indices(50, 7))
+    assert sampler.sample_many(50, 7) == sampler.sample_many(50, 7)
+
+
+def test_alias_sampler_seed_is_same_as_generator(sampler):
+    assert sampler.sample_many(50, 3) == sampler.sample_many(50, np.random.default_rng(3))
+
+
+def test_rule_sampler_accepts_int_seeds():
+    rule_sampler = RuleSampler(DATASET_PATTERNS, 8)
+    assert [rule_sampler.sample('10001000', 11) for _ in range(5)] == [rule_sampler.sample('10001000', 11)] * 5
+
+
+def test_generate_rules_same_seed_same_rules():
+    first = generate_rules(SONG_PATTERNS, DATASET_PATTERNS, 8, rng=5)
+    second = generate_rules(SONG_PATTERNS, DATASET_PATTERNS, 8, rule_sampler=RuleSampler(DATASET_PATTERNS, 8), rng=5)
+    assert first == second
+    assert set(first) <= set(SONG_PATTERNS)
+
+
+def test_randomly_change_accepts_int_seeds():
+    rule = ('1010101010101010', '1101010101010100')
+    chosen = randomly_change(rule, 0.5, 3)
+    assert len(chosen) == 8
+    assert chosen == randomly_change(rule, 0.5, 3)
+    assert chosen == randomly_change(rule, 0.5, np.random.default_rng(3))
+    assert any(randomly_change(rule, 0.5, seed) != chosen for seed in range(4, 10))
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.startup import time_import
+
+
+@pytest.mark.parametrize("module", ["song_transformations.pattern_extractors",
+                                    "song_transformations.algorithm_1",
+                                    "song_transformations.song_transformer",
+                                    "data.BipStore"])
+def test_no_heavy_imports(module, monkeypatch):
+    monkeypatch.chdir(Path(__file__).parent.parent)  # the fresh interpreter imports from src/
+    result = time_import(module, repeat=1)
+    assert result["error"] is None
+    assert result["heavy_loaded"] == []
+
+
+def test_pk_dataset_imports(monkeypatch):
+    monkeypatch.chdir(Path(__file__).parent.parent)
+    result = time_import("data.PKDataset", repeat=1)
+    assert result["error"] is None
+    assert "music21" not in result["heavy_loaded"]  # it needs pandas, but not music21
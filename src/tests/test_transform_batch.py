@@ -0,0 +1,73 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_synthetic_xmk
+from song_transformations import instrumentation, song_transformer as song_transformer_module
+from song_transformations.pattern_extractors import format_dataset_patterns
+from song_transformations.song_transformer import INVALID_SONG, SUCCESS, transform_batch
+
+
+@pytest.fixture
+def xmk_dir(tmp_path, monkeypatch):
+    bits = np.random.default_rng(0).random((400, 8)) < 0.5
+    dataset_patterns = format_dataset_patterns({"corpus": [''.join('1' if b else '0' for b in row) for row in bits]})
+    monkeypatch.setattr(song_transformer_module, "rag_dataset_pattern_extractor",
+                        lambda pattern_length: dataset_patterns)
+
+    directory = tmp_path / "xmk"
+    directory.mkdir()
+    for i in range(4):
+        path = write_synthetic_xmk(directory / f"song{i}.xmk", measures=8, density=0.5, seed=i)
+        # without rests: get_note_lengths() can't always fit a rest into a dataset rhythm.
+        path.write_text(path.read_text().replace("\t-1\t", "\t60\t"))
+    (directory / "broken.xmk").write_text("[4][4][120]\n=1\n1/3\t60\t55[4\n=end\n")
+    (directory / "notes.txt").write_text("not a song")
+    return directory
+
+
+def outputs(results):
+    contents = {}
+    for result in results:
+        if result.status == SUCCESS:
+            with open(result.output, 'rb') as file:
+                contents[result.filename.rsplit('/', 1)[-1]] = file.read()
+    return contents
+
+
+def test_batch_is_reproducible_with_any_number_of_processes(xmk_dir, tmp_path):
+    one = transform_batch(xmk_dir, tmp_path / "one", output_format="fastmidi", processes=1, seed=3)
+    two = transform_batch(xmk_dir, tmp_path / "two", output_format="fastmidi", processes=2, seed=3)
+    assert sorted(r.filename.rsplit('/', 1)[-1] for r in one) == \
+        ['broken.xmk'] + [f"song{i}.xmk" for i in range(4)]
+    statuses = {r.filename.rsplit('/', 1)[-1]: r.status for r in one}
+    assert statuses.pop('broken.xmk') == INVALID_SONG  # one bad song doesn't stop the batch
+    assert set(statuses.values()) == {SUCCESS}
+    assert outputs(one) == outputs(two) and len(outputs(one)) == 4
+
+
+def test_batch_metrics_are_merged(xmk_dir, tmp_path):
+    metrics = instrumentation.enable()
+    try:
+        transform_batch(xmk_dir, tmp_path / "out", output_format="fastmidi", processes=2, seed=3)
+    finally:
+        instrumentation.disable()
+    assert len(metrics.songs) == 5
+    assert metrics.stages["xmk_parsing"]["calls"] == 5
+    assert metrics.counters["measures_rendered"] == 4 * 8
+
+
+def test_unknown_format(xmk_dir, tmp_path):
+    with pytest.raises(ValueError):
+        transform_batch(xmk_dir, tmp_path / "out", output_format="wav")
+
+
+def test_command_line_needs_the_xmk_dir(tmp_path):
+    completed = subprocess.run([sys.executable, "-m", "song_transformations.song_transformer",
+                                "--output-dir", str(tmp_path)], cwd=Path(__file__).parent.parent,
+                               capture_output=True, text=True)
+    assert completed.returncode == 2
+    assert "the following arguments are required: xmk_dir" in completed.stderr
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_synthetic_xmk
+from song_transformations.alias_sampler import AliasSampler
+from song_transformations.algorithm_1 import generate_rules
+from song_transformations.pattern_extractors import XmkSong
+from song_transformations.pattern_statistics import PatternStatistics
+from song_transformations.variants import draw_rule_sets, song_variants
+
+
+def rules_only(song_notes, song_chords, song_patterns, rules):
+    return dict(rules)
+
+
+@pytest.fixture
+def song(tmp_path):
+    return XmkSong(write_synthetic_xmk(tmp_path / "song.xmk", measures=24, density=0.5, seed=3))
+
+
+@pytest.fixture
+def dataset_patterns():
+    rng = np.random.default_rng(0)
+    bits = rng.random((300, 8)) < 0.5
+    return PatternStatistics({"corpus": [''.join('1' if b else '0' for b in row) for row in bits]})
+
+
+def test_seeds_give_the_rules_of_generate_rules(song, dataset_patterns):
+    song_patterns = song.patterns(8)
+    variants = list(song_variants(song, dataset_patterns, 8, seeds=[1, 2, 3, 1], render=rules_only))
+    for variant in variants:
+        for seed in variant.draws:
+            assert variant.rules == generate_rules(song_patterns, dataset_patterns, 8, rng=seed)
+    assert sorted(seed for variant in variants for seed in variant.draws) == [1, 1, 2, 3]
+
+
+def test_count_draws_are_successive_generate_rules_calls(song, dataset_patterns):
+    song_patterns = song.patterns(8)
+    rng = np.random.default_rng(7)
+    expected = [generate_rules(song_patterns, dataset_patterns, 8, rng=rng) for _ in range(5)]
+    xs, candidates, choices = draw_rule_sets(song_patterns, dataset_patterns, 8, count=5, rng=7)
+    drawn = [{x: candidates[j][k] for j, (x, k) in enumerate(zip(xs, row))} for row in choices]
+    assert drawn == expected
+
+
+def test_variants_are_distinct(song, dataset_patterns):
+    variants = list(song_variants(song, dataset_patterns, 8, count=50, rng=0, render=rules_only))
+    assert sum(len(variant.draws) for variant in variants) == 50
+    assert len({tuple(sorted(variant.rules.items())) for variant in variants}) == len(variants)
+
+
+def test_no_variant_without_rules(song):
+    assert list(song_variants(song, {}, 8, count=5, rng=0, render=rules_only)) == []
+
+
+def test_alias_sampler_ways_of_drawing_agree():
+    sampler = AliasSampler(['a', 'b', 'c'], [0.2, 0.5, 0.3])
+    rng = np.random.default_rng(4)
+    one_by_one = [sampler.sample(rng) for _ in range(100)]
+    assert sampler.sample_many(100, 4) == one_by_one
+    draws = sampler.sample_many(20000, 5)
+    assert abs(draws.count('b') / len(draws) - 0.5) < 0.02